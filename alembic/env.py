@@ -6,7 +6,11 @@ from sqlalchemy.pool import NullPool
 from sqlmodel import SQLModel
 
 from alembic import context  # type: ignore[attr-defined]
-from app.models import api_key, device  # noqa: F401 - ensure models are registered
+from app.models import (  # noqa: F401 - ensure models are registered
+    api_key,
+    device,
+    field,
+)
 from app.utils.config import settings
 
 config = context.config
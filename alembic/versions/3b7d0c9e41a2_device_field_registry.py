@@ -0,0 +1,82 @@
+"""device field registry and typed values
+
+Revision ID: 3b7d0c9e41a2
+Revises: f222bd2af0da
+Create Date: 2026-10-19 09:12:40.118204
+
+"""
+
+import sqlalchemy as sa
+
+from alembic import op  # type: ignore[attr-defined]
+
+# revision identifiers, used by Alembic.
+revision: str = "3b7d0c9e41a2"
+down_revision: str | None = "f222bd2af0da"
+branch_labels: str | list[str] | None = None
+depends_on: str | list[str] | None = None
+
+
+def upgrade() -> None:
+    op.create_table(
+        "devicefield",
+        sa.Column("id", sa.Uuid(), nullable=False),
+        sa.Column("device_id", sa.Uuid(), nullable=False),
+        sa.Column("key", sa.String(255), nullable=False),
+        sa.Column("count", sa.BigInteger(), nullable=False),
+        sa.Column("numeric_count", sa.BigInteger(), nullable=False),
+        sa.Column("last_type", sa.String(16), nullable=False),
+        sa.Column("promoted_at", sa.DateTime(timezone=True), nullable=True),
+        sa.Column("backfilled_at", sa.DateTime(timezone=True), nullable=True),
+        sa.Column(
+            "created_date",
+            sa.DateTime(timezone=True),
+            server_default=sa.text("now()"),
+            nullable=False,
+        ),
+        sa.Column(
+            "updated_date",
+            sa.DateTime(timezone=True),
+            server_default=sa.text("now()"),
+            nullable=False,
+        ),
+        sa.ForeignKeyConstraint(["device_id"], ["device.id"], ondelete="CASCADE"),
+        sa.PrimaryKeyConstraint("id"),
+        sa.UniqueConstraint("device_id", "key"),
+    )
+    op.create_table(
+        "devicedatavalue",
+        sa.Column("id", sa.Uuid(), nullable=False),
+        sa.Column("data_id", sa.Uuid(), nullable=False),
+        sa.Column("device_id", sa.Uuid(), nullable=False),
+        sa.Column("key", sa.String(255), nullable=False),
+        sa.Column("value", sa.Float(), nullable=False),
+        sa.Column(
+            "created_date",
+            sa.DateTime(timezone=True),
+            server_default=sa.text("now()"),
+            nullable=False,
+        ),
+        sa.Column(
+            "updated_date",
+            sa.DateTime(timezone=True),
+            server_default=sa.text("now()"),
+            nullable=False,
+        ),
+        sa.ForeignKeyConstraint(["data_id"], ["devicedata.id"], ondelete="CASCADE"),
+        sa.PrimaryKeyConstraint("id"),
+        sa.UniqueConstraint("data_id", "key"),
+    )
+    op.create_index(
+        "ix_devicedatavalue_device_id_key_created_date",
+        "devicedatavalue",
+        ["device_id", "key", "created_date"],
+    )
+
+
+def downgrade() -> None:
+    op.drop_index(
+        "ix_devicedatavalue_device_id_key_created_date", table_name="devicedatavalue"
+    )
+    op.drop_table("devicedatavalue")
+    op.drop_table("devicefield")
@@ -0,0 +1,50 @@
+"""idempotency keys for ingest retries
+
+Revision ID: 5e2a9c7d1f43
+Revises: 8c41e5f2d9b7
+Create Date: 2026-10-19 14:21:07.513844
+
+"""
+
+import sqlalchemy as sa
+
+from alembic import op  # type: ignore[attr-defined]
+
+# revision identifiers, used by Alembic.
+revision: str = "5e2a9c7d1f43"
+down_revision: str | None = "8c41e5f2d9b7"
+branch_labels: str | list[str] | None = None
+depends_on: str | list[str] | None = None
+
+
+def upgrade() -> None:
+    op.create_table(
+        "idempotencykey",
+        sa.Column("id", sa.Uuid(), nullable=False),
+        sa.Column("device_id", sa.Uuid(), nullable=False),
+        sa.Column("key", sa.String(255), nullable=False),
+        sa.Column("data_id", sa.Uuid(), nullable=False),
+        sa.Column(
+            "created_date",
+            sa.DateTime(timezone=True),
+            server_default=sa.text("now()"),
+            nullable=False,
+        ),
+        sa.Column(
+            "updated_date",
+            sa.DateTime(timezone=True),
+            server_default=sa.text("now()"),
+            nullable=False,
+        ),
+        sa.ForeignKeyConstraint(["device_id"], ["device.id"], ondelete="CASCADE"),
+        sa.PrimaryKeyConstraint("id"),
+        sa.UniqueConstraint("device_id", "key"),
+    )
+    op.create_index(
+        "ix_idempotencykey_created_date", "idempotencykey", ["created_date"]
+    )
+
+
+def downgrade() -> None:
+    op.drop_index("ix_idempotencykey_created_date", table_name="idempotencykey")
+    op.drop_table("idempotencykey")
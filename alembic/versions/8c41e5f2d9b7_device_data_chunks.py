@@ -0,0 +1,84 @@
+"""compacted device data chunks
+
+Revision ID: 8c41e5f2d9b7
+Revises: 3b7d0c9e41a2
+Create Date: 2026-10-19 10:03:51.402117
+
+"""
+
+import sqlalchemy as sa
+
+from alembic import op  # type: ignore[attr-defined]
+
+# revision identifiers, used by Alembic.
+revision: str = "8c41e5f2d9b7"
+down_revision: str | None = "3b7d0c9e41a2"
+branch_labels: str | list[str] | None = None
+depends_on: str | list[str] | None = None
+
+
+def upgrade() -> None:
+    op.create_table(
+        "devicedatachunk",
+        sa.Column("id", sa.Uuid(), nullable=False),
+        sa.Column("device_id", sa.Uuid(), nullable=False),
+        sa.Column("start", sa.DateTime(timezone=True), nullable=False),
+        sa.Column("count", sa.Integer(), nullable=False),
+        sa.Column("ids", sa.LargeBinary(), nullable=False),
+        sa.Column("timestamps", sa.LargeBinary(), nullable=False),
+        sa.Column("payload", sa.LargeBinary(), nullable=False),
+        sa.Column(
+            "created_date",
+            sa.DateTime(timezone=True),
+            server_default=sa.text("now()"),
+            nullable=False,
+        ),
+        sa.Column(
+            "updated_date",
+            sa.DateTime(timezone=True),
+            server_default=sa.text("now()"),
+            nullable=False,
+        ),
+        sa.ForeignKeyConstraint(["device_id"], ["device.id"], ondelete="CASCADE"),
+        sa.PrimaryKeyConstraint("id"),
+    )
+    op.create_index(
+        "ix_devicedatachunk_device_id_start",
+        "devicedatachunk",
+        ["device_id", "start"],
+    )
+
+    # Typed values outlive their devicedata row once it is compacted, so they
+    # cascade from the device instead.
+    op.drop_constraint(
+        "devicedatavalue_data_id_fkey", "devicedatavalue", type_="foreignkey"
+    )
+    op.create_foreign_key(
+        "devicedatavalue_device_id_fkey",
+        "devicedatavalue",
+        "device",
+        ["device_id"],
+        ["id"],
+        ondelete="CASCADE",
+    )
+
+
+def downgrade() -> None:
+    # Readings still packed in devicedatachunk are lost by this downgrade.
+    op.drop_constraint(
+        "devicedatavalue_device_id_fkey", "devicedatavalue", type_="foreignkey"
+    )
+    op.execute(
+        "DELETE FROM devicedatavalue v WHERE NOT EXISTS "
+        "(SELECT 1 FROM devicedata d WHERE d.id = v.data_id)"
+    )
+    op.create_foreign_key(
+        "devicedatavalue_data_id_fkey",
+        "devicedatavalue",
+        "devicedata",
+        ["data_id"],
+        ["id"],
+        ondelete="CASCADE",
+    )
+    op.drop_index("ix_devicedatachunk_device_id_start", table_name="devicedatachunk")
+    op.drop_table("devicedatachunk")
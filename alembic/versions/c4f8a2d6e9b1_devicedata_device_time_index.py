@@ -0,0 +1,37 @@
+"""index devicedata by device and time
+
+Revision ID: c4f8a2d6e9b1
+Revises: a7d3e1b9c6f2
+Create Date: 2026-10-19 17:48:12.530917
+
+"""
+
+from alembic import op  # type: ignore[attr-defined]
+
+# revision identifiers, used by Alembic.
+revision: str = "c4f8a2d6e9b1"
+down_revision: str | None = "a7d3e1b9c6f2"
+branch_labels: str | list[str] | None = None
+depends_on: str | list[str] | None = None
+
+
+def upgrade() -> None:
+    # Built without blocking ingest; CONCURRENTLY cannot run in a transaction.
+    with op.get_context().autocommit_block():
+        op.create_index(
+            "ix_devicedata_device_id_created_date",
+            "devicedata",
+            ["device_id", "created_date"],
+            postgresql_concurrently=True,
+            if_not_exists=True,
+        )
+
+
+def downgrade() -> None:
+    with op.get_context().autocommit_block():
+        op.drop_index(
+            "ix_devicedata_device_id_created_date",
+            table_name="devicedata",
+            postgresql_concurrently=True,
+            if_exists=True,
+        )
@@ -0,0 +1,28 @@
+"""device data version for cached responses
+
+Revision ID: e1b5c7a3f8d2
+Revises: c4f8a2d6e9b1
+Create Date: 2026-10-19 19:10:31.204786
+
+"""
+
+import sqlalchemy as sa
+
+from alembic import op  # type: ignore[attr-defined]
+
+# revision identifiers, used by Alembic.
+revision: str = "e1b5c7a3f8d2"
+down_revision: str | None = "c4f8a2d6e9b1"
+branch_labels: str | list[str] | None = None
+depends_on: str | list[str] | None = None
+
+
+def upgrade() -> None:
+    op.add_column(
+        "device",
+        sa.Column("data_version", sa.BigInteger(), server_default="0", nullable=False),
+    )
+
+
+def downgrade() -> None:
+    op.drop_column("device", "data_version")
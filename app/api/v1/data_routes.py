@@ -1,42 +1,117 @@
+from collections.abc import AsyncGenerator
+from datetime import datetime
 from typing import Any, Literal
 from uuid import UUID
 
-from fastapi import APIRouter, Depends, Query, status
+from fastapi import (
+    APIRouter,
+    BackgroundTasks,
+    Depends,
+    Header,
+    Query,
+    Request,
+    Response,
+    status,
+)
 from loguru import logger
 from sqlalchemy.ext.asyncio import AsyncSession
 
 from app.models.api_key import ApiKey
-from app.schemas.data_schema import DeviceDataRead
-from app.services.data_service import DataService
+from app.schemas.data_schema import (
+    DeleteJobRead,
+    DeviceDataAggregate,
+    DeviceDataRead,
+    DeviceFieldRead,
+)
+from app.services.data_service import DataService, backfill_promoted_field
+from app.services.delete_job_service import DeleteJobService, run_delete_job
 from app.utils.auth import require_admin, verify_api_key
-from app.utils.database import get_session
+from app.utils.compaction import utc
+from app.utils.database import get_read_session, get_session
+from app.utils.payload import read_ingest_payload
+from app.utils.rate_limit import rate_limit_ingest
+from app.utils.window_cache import cached_json, sealed
 
 data_routes = APIRouter(prefix="/v1/data")
 
 _DATA_EXCLUDE = {"device"}
 
 
-def get_data_service(session: AsyncSession = Depends(get_session)) -> DataService:
-    return DataService(session=session)
+async def get_data_service(
+    session: AsyncSession = Depends(get_session),
+) -> AsyncGenerator[DataService, None]:
+    service = DataService(session=session)
+    try:
+        yield service
+    finally:
+        await service.close()
+
+
+def get_delete_job_service(
+    session: AsyncSession = Depends(get_session),
+) -> DeleteJobService:
+    return DeleteJobService(session=session)
+
+
+async def get_read_data_service(
+    session: AsyncSession = Depends(get_read_session),
+) -> AsyncGenerator[DataService, None]:
+    service = DataService(session=session)
+    try:
+        yield service
+    finally:
+        await service.close()
 
 
 @data_routes.post(
-    "/", response_model=dict[str, str], status_code=status.HTTP_201_CREATED
+    "/",
+    dependencies=[Depends(rate_limit_ingest)],
+    response_model=dict[str, str],
+    status_code=status.HTTP_201_CREATED,
+    openapi_extra={
+        "requestBody": {
+            "required": True,
+            "content": {
+                media_type: {"schema": {"type": "object"}}
+                for media_type in (
+                    "application/json",
+                    "application/msgpack",
+                    "application/cbor",
+                )
+            },
+        }
+    },
 )
 async def data_create(
-    data_in: dict[str, Any],
+    response: Response,
     api_key: ApiKey = Depends(verify_api_key),
+    data_in: dict[str, Any] = Depends(read_ingest_payload),
+    idempotency_key: str | None = Header(
+        default=None, alias="Idempotency-Key", min_length=1, max_length=255
+    ),
     service: DataService = Depends(get_data_service),
 ) -> dict[str, str]:
     """
-    Route to create a new device data entry.
-    :param data_in: A dictionary containing the device data to create.
+    Route to create a new device data entry. A reading spooled while the
+    database is unavailable is answered with 202 instead of 201. A retry with
+    an Idempotency-Key already used by the device, and a reading skipped by
+    the device's deadband, are answered with 200 and the ID of the stored entry.
+    :param response: The response, to set its status code.
     :param api_key: The API key for authentication, obtained from the verify_api_key dependency.
+    :param data_in: The device data, read within the INGEST_MAX_* limits by read_ingest_payload.
+    :param idempotency_key: Optional key identifying retries of the same reading.
     :param service: DataService; services.data_service.DataService
     :return: A dictionary containing the status and ID of the created device data entry.
     """
     logger.info("Creating device data for device id: {}", api_key.device_id)
-    return await service.create(data_in=data_in, api_key=api_key)
+    created = await service.create(
+        data_in=data_in, api_key=api_key, idempotency_key=idempotency_key
+    )
+    if created["status"] == "spooled":
+        response.status_code = status.HTTP_202_ACCEPTED
+    elif created["status"] in ("duplicate", "skipped"):
+        response.status_code = status.HTTP_200_OK
+    return created
 
 
 @data_routes.get(
@@ -44,18 +119,25 @@ async def data_create(
     response_model=list[DeviceDataRead],
 )
 async def data_list(
+    request: Request,
     device_id: UUID,
     skip: int = Query(default=0, ge=0),
     limit: int = Query(default=50, ge=1, le=200),
     order: Literal["asc", "desc"] = Query(default="desc"),
-    service: DataService = Depends(get_data_service),
-) -> list[DeviceDataRead]:
+    start: datetime | None = Query(default=None),
+    end: datetime | None = Query(default=None),
+    service: DataService = Depends(get_read_data_service),
+) -> list[DeviceDataRead] | Response:
     """
-    Route to list device data entries for a specific device.
+    Route to list device data entries for a specific device. Ranges ending in
+    the sealed past are answered from the window cache.
+    :param request: The request; keys the window cache.
     :param device_id: The ID of the device to list data for.
     :param skip: The number of entries to skip (for pagination).
     :param limit: The maximum number of entries to return (for pagination).
     :param order: Sort order for results by created_date; "asc" or "desc" (default).
+    :param start: Only entries created at or after this time.
+    :param end: Only entries created before this time.
     :param service: DataService; services.data_service.DataService
     :return: A list of DeviceDataRead objects representing the device data entries.
     """
@@ -66,20 +148,227 @@ async def data_list(
         limit,
         order,
     )
-    db_data_list = await service.list(
-        device_id=device_id, skip=skip, limit=limit, order=order
+
+    async def build() -> list[DeviceDataRead]:
+        db_data_list = await service.list(
+            device_id=device_id,
+            skip=skip,
+            limit=limit,
+            order=order,
+            start=start,
+            end=end,
+        )
+        return [
+            DeviceDataRead(**db_data.model_dump(exclude=_DATA_EXCLUDE))
+            for db_data in db_data_list
+        ]
+
+    if sealed(end):
+        return await cached_json(
+            request, await service.data_versions([device_id]), build
+        )
+    return await build()
+
+
+@data_routes.get(
+    "/devices",
+    response_model=list[DeviceDataRead] | dict[UUID, list[DeviceDataRead]],
+)
+async def data_list_many(
+    request: Request,
+    device_id: list[UUID] = Query(..., min_length=1, max_length=100),
+    limit: int = Query(default=50, ge=1, le=200),
+    order: Literal["asc", "desc"] = Query(default="desc"),
+    start: datetime | None = Query(default=None),
+    end: datetime | None = Query(default=None),
+    group: Literal["merged", "device"] = Query(default="merged"),
+    service: DataService = Depends(get_read_data_service),
+) -> list[DeviceDataRead] | dict[UUID, list[DeviceDataRead]] | Response:
+    """
+    Route to list device data entries of several devices in one request.
+    Ranges ending in the sealed past are answered from the window cache.
+    :param request: The request; keys the window cache.
+    :param device_id: The IDs of the devices, as a repeated query parameter.
+    :param limit: The maximum number of entries to return per device.
+    :param order: Sort order for results by created_date; "asc" or "desc" (default).
+    :param start: Only entries created at or after this time.
+    :param end: Only entries created before this time.
+    :param group: "merged" for one list in time order, "device" for a list per device ID.
+    :param service: DataService; services.data_service.DataService
+    :return: DeviceDataRead objects, merged or grouped by device.
+    """
+    logger.info(
+        "Listing device data for {} devices, limit: {}, order: {}",
+        len(device_id),
+        limit,
+        order,
     )
 
-    return [
-        DeviceDataRead(**db_data.model_dump(exclude=_DATA_EXCLUDE))
-        for db_data in db_data_list
-    ]
+    async def build() -> list[DeviceDataRead] | dict[UUID, list[DeviceDataRead]]:
+        readings = await service.list_many(
+            device_ids=device_id, limit=limit, order=order, start=start, end=end
+        )
+        grouped = {
+            key: [
+                DeviceDataRead(**db_data.model_dump(exclude=_DATA_EXCLUDE))
+                for db_data in db_data_list
+            ]
+            for key, db_data_list in readings.items()
+        }
+        if group == "device":
+            return grouped
+        return sorted(
+            (entry for entries in grouped.values() for entry in entries),
+            key=lambda entry: utc(entry.created_date),
+            reverse=order == "desc",
+        )
+
+    if sealed(end):
+        return await cached_json(request, await service.data_versions(device_id), build)
+    return await build()
+
+
+@data_routes.delete(
+    "/device/{device_id}",
+    dependencies=[Depends(require_admin)],
+    response_model=DeleteJobRead,
+    status_code=status.HTTP_202_ACCEPTED,
+)
+async def data_delete_range(
+    device_id: UUID,
+    background_tasks: BackgroundTasks,
+    start: datetime = Query(...),
+    end: datetime = Query(...),
+    service: DeleteJobService = Depends(get_delete_job_service),
+) -> DeleteJobRead:
+    """
+    Route to delete a device's data entries in a time range, in batches in
+    the background; poll /v1/data/jobs/{job_id} for progress.
+    :param device_id: The ID of the device.
+    :param background_tasks: Runs the deletion after the response is sent.
+    :param start: Delete entries created at or after this time.
+    :param end: Delete entries created before this time.
+    :param service: DeleteJobService; services.delete_job_service.DeleteJobService
+    :return: DeleteJobRead of the queued job.
+    """
+    logger.info(
+        "Deleting device data for device id: {} from {} to {}", device_id, start, end
+    )
+    job = await service.create(device_id=device_id, kind="range", start=start, end=end)
+    background_tasks.add_task(run_delete_job, job.id)
+    return DeleteJobRead(**job.model_dump())
+
+
+@data_routes.get(
+    "/jobs/{job_id}",
+    dependencies=[Depends(require_admin)],
+    response_model=DeleteJobRead,
+)
+async def data_job_read(
+    job_id: UUID,
+    service: DeleteJobService = Depends(get_delete_job_service),
+) -> DeleteJobRead:
+    """
+    Route to get the progress of a delete job.
+    :param job_id: The ID of the job.
+    :param service: DeleteJobService; services.delete_job_service.DeleteJobService
+    :return: DeleteJobRead; status is pending, running, done or failed.
+    """
+    logger.info("Getting delete job with id: {}", job_id)
+    job = await service.read(job_id=job_id)
+    return DeleteJobRead(**job.model_dump())
+
+
+@data_routes.get(
+    "/device/{device_id}/aggregate",
+    response_model=DeviceDataAggregate,
+)
+async def data_aggregate(
+    request: Request,
+    device_id: UUID,
+    field: str = Query(..., max_length=255),
+    start: datetime | None = Query(default=None),
+    end: datetime | None = Query(default=None),
+    service: DataService = Depends(get_read_data_service),
+) -> DeviceDataAggregate | Response:
+    """
+    Route to aggregate a numeric field over a device's data entries. Ranges
+    ending in the sealed past are answered from the window cache.
+    :param request: The request; keys the window cache.
+    :param device_id: The ID of the device to aggregate data for.
+    :param field: The top-level key to aggregate.
+    :param start: Only entries created at or after this time.
+    :param end: Only entries created before this time.
+    :param service: DataService; services.data_service.DataService
+    :return: DeviceDataAggregate with the count, min, max and mean of the field.
+    """
+    logger.info("Aggregating field {} for device id: {}", field, device_id)
+
+    async def build() -> DeviceDataAggregate:
+        return DeviceDataAggregate(
+            **await service.aggregate(
+                device_id=device_id, key=field, start=start, end=end
+            )
+        )
+
+    if sealed(end):
+        return await cached_json(
+            request, await service.data_versions([device_id]), build
+        )
+    return await build()
+
+
+@data_routes.get(
+    "/device/{device_id}/fields",
+    dependencies=[Depends(require_admin)],
+    response_model=list[DeviceFieldRead],
+)
+async def data_fields(
+    device_id: UUID,
+    service: DataService = Depends(get_data_service),
+) -> list[DeviceFieldRead]:
+    """
+    Route to list the keys seen in a device's data entries.
+    :param device_id: The ID of the device.
+    :param service: DataService; services.data_service.DataService
+    :return: A list of DeviceFieldRead objects, most frequent first.
+    """
+    logger.info("Listing data fields for device id: {}", device_id)
+    db_fields = await service.fields(device_id=device_id)
+    return [DeviceFieldRead(**db_field.model_dump()) for db_field in db_fields]
+
+
+@data_routes.post(
+    "/device/{device_id}/fields/{key}/promote",
+    dependencies=[Depends(require_admin)],
+    response_model=DeviceFieldRead,
+    status_code=status.HTTP_202_ACCEPTED,
+)
+async def data_field_promote(
+    device_id: UUID,
+    key: str,
+    background_tasks: BackgroundTasks,
+    service: DataService = Depends(get_data_service),
+) -> DeviceFieldRead:
+    """
+    Route to promote a key to typed values and backfill existing entries.
+    :param device_id: The ID of the device.
+    :param key: The top-level key to promote.
+    :param background_tasks: Runs the backfill after the response is sent.
+    :param service: DataService; services.data_service.DataService
+    :return: DeviceFieldRead; backfilled_at is set once the backfill finishes.
+    """
+    logger.info("Promoting data field {} for device id: {}", key, device_id)
+    db_field = await service.promote_field(device_id=device_id, key=key)
+    if db_field.backfilled_at is None:
+        background_tasks.add_task(backfill_promoted_field, device_id, key)
+    return DeviceFieldRead(**db_field.model_dump())
 
 
 @data_routes.get("/{data_id}", response_model=DeviceDataRead)
 async def data_read(
     data_id: UUID,
-    service: DataService = Depends(get_data_service),
+    service: DataService = Depends(get_read_data_service),
 ) -> DeviceDataRead:
     """
     Route to get a device data entry by its ID.
@@ -1,13 +1,21 @@
 from uuid import UUID
 
-from fastapi import APIRouter, Depends, Query, status
+from fastapi import APIRouter, BackgroundTasks, Depends, Query, status
 from loguru import logger
 from sqlalchemy.ext.asyncio import AsyncSession
 
-from app.schemas.device_schema import DeviceCreate, DeviceRead, DeviceUpdate
+from app.schemas.data_schema import DeleteJobRead
+from app.schemas.device_schema import (
+    DeviceBulk,
+    DeviceBulkResult,
+    DeviceCreate,
+    DeviceRead,
+    DeviceUpdate,
+)
+from app.services.delete_job_service import DeleteJobService, run_delete_job
 from app.services.device_service import DeviceService
 from app.utils.auth import require_admin
-from app.utils.database import get_session
+from app.utils.database import get_read_session, get_session
 
 device_routes = APIRouter(prefix="/v1/devices")
 
@@ -18,6 +26,18 @@ def get_device_service(session: AsyncSession = Depends(get_session)) -> DeviceSe
     return DeviceService(session=session)
 
 
+def get_delete_job_service(
+    session: AsyncSession = Depends(get_session),
+) -> DeleteJobService:
+    return DeleteJobService(session=session)
+
+
+def get_read_device_service(
+    session: AsyncSession = Depends(get_read_session),
+) -> DeviceService:
+    return DeviceService(session=session)
+
+
 @device_routes.post(
     "/",
     dependencies=[Depends(require_admin)],
@@ -41,11 +61,38 @@ async def device_create(
     return DeviceRead(**new_device.model_dump(exclude=_DEVICE_EXCLUDE))
 
 
+@device_routes.post(
+    "/bulk",
+    dependencies=[Depends(require_admin)],
+    response_model=list[DeviceBulkResult],
+    status_code=status.HTTP_200_OK,
+)
+async def devices_bulk(
+    bulk_in: DeviceBulk,
+    service: DeviceService = Depends(get_device_service),
+) -> list[DeviceBulkResult]:
+    """
+    Route to create devices, update devices and issue API keys in one
+    transaction.
+
+    :param bulk_in: DeviceBulk object; schemas.device_schema.DeviceBulk
+    :param service: DeviceService; services.device_service.DeviceService
+    :return: One DeviceBulkResult per item, with the raw API keys issued.
+    """
+    logger.info(
+        "Bulk request: {} creates, {} updates, {} API keys",
+        len(bulk_in.create),
+        len(bulk_in.update),
+        len(bulk_in.issue_keys),
+    )
+    return list(await service.bulk(bulk=bulk_in))
+
+
 @device_routes.get("/", response_model=list[DeviceRead], status_code=status.HTTP_200_OK)
 async def devices_list(
     skip: int = Query(default=0, ge=0),
     limit: int = Query(default=10, ge=1, le=200),
-    service: DeviceService = Depends(get_device_service),
+    service: DeviceService = Depends(get_read_device_service),
 ) -> list[DeviceRead]:
     """
     Route to list all devices.
@@ -66,7 +113,7 @@ async def devices_list(
 @device_routes.get("/{device_id}", response_model=DeviceRead)
 async def device_read(
     device_id: UUID,
-    service: DeviceService = Depends(get_device_service),
+    service: DeviceService = Depends(get_read_device_service),
 ) -> DeviceRead:
     """
     Route to get a device by its ID.
@@ -122,3 +169,30 @@ async def device_delete(
     logger.info("Deleting device with id: {}", device_id)
     await service.delete(device_id=device_id)
     return None
+
+
+@device_routes.post(
+    "/{device_id}/purge",
+    dependencies=[Depends(require_admin)],
+    response_model=DeleteJobRead,
+    status_code=status.HTTP_202_ACCEPTED,
+)
+async def device_purge(
+    device_id: UUID,
+    background_tasks: BackgroundTasks,
+    service: DeleteJobService = Depends(get_delete_job_service),
+) -> DeleteJobRead:
+    """
+    Route to delete a device with many data entries: the entries are deleted
+    in batches in the background, then the device. Poll
+    /v1/data/jobs/{job_id} for progress.
+
+    :param device_id: The ID of the device to purge.
+    :param background_tasks: Runs the purge after the response is sent.
+    :param service: DeleteJobService; services.delete_job_service.DeleteJobService
+    :return: DeleteJobRead of the queued job.
+    """
+    logger.info("Purging device with id: {}", device_id)
+    job = await service.create(device_id=device_id, kind="device")
+    background_tasks.add_task(run_delete_job, job.id)
+    return DeleteJobRead(**job.model_dump())
@@ -0,0 +1,289 @@
+"""
+HTTP load generator for the ingest and read endpoints.
+
+Provisions devices and API keys through the admin routes, then drives
+`POST /api/v1/data/` and `GET /api/v1/data/device/{device_id}` at a fixed
+concurrency and reports throughput and latency percentiles per phase.
+
+By default the app runs in-process against a throwaway SQLite file. Pass
+`--database-url` to run in-process against another database (e.g. a local
+Postgres) or `--base-url` to load an already running server.
+
+Usage:
+    uv run python -m app.bench.load [--devices 10] [--requests 2000] [--concurrency 20]
+        [--phases ingest list] [--database-url URL | --base-url URL]
+        [--output results.json] [--compare previous.json]
+"""
+
+import argparse
+import asyncio
+import json
+import math
+import platform
+import subprocess  # nosec B404
+import tempfile
+import time
+from dataclasses import dataclass, field
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Any
+
+import httpx
+
+PHASES = ("ingest", "list")
+
+
+@dataclass
+class PhaseResult:
+    latencies: list[float] = field(default_factory=list)
+    errors: int = 0
+    statuses: dict[str, int] = field(default_factory=dict)
+    elapsed: float = 0.0
+
+    def record(self, status: int, latency: float) -> None:
+        self.latencies.append(latency)
+        self.statuses[str(status)] = self.statuses.get(str(status), 0) + 1
+        if status >= 400:
+            self.errors += 1
+
+    def summary(self) -> dict[str, Any]:
+        ordered = sorted(self.latencies)
+        count = len(ordered)
+        return {
+            "requests": count,
+            "errors": self.errors,
+            "statuses": self.statuses,
+            "elapsed_s": round(self.elapsed, 3),
+            "throughput_rps": round(count / self.elapsed, 1) if self.elapsed else 0.0,
+            "latency_ms": {
+                "mean": round(sum(ordered) / count * 1000, 3) if count else None,
+                "p50": _percentile(ordered, 50),
+                "p95": _percentile(ordered, 95),
+                "p99": _percentile(ordered, 99),
+                "max": round(ordered[-1] * 1000, 3) if count else None,
+            },
+        }
+
+
+def _percentile(ordered: list[float], pct: float) -> float | None:
+    """Nearest-rank percentile of sorted latencies, in milliseconds."""
+    if not ordered:
+        return None
+    rank = max(math.ceil(pct / 100 * len(ordered)), 1)
+    return round(ordered[rank - 1] * 1000, 3)
+
+
+async def provision(
+    client: httpx.AsyncClient, admin_secret: str, devices: int
+) -> list[dict[str, str]]:
+    """
+    Create devices and API keys through the admin routes.
+
+    :return: Request headers authenticating each device.
+    """
+    admin = {"X-Admin-Secret": admin_secret}
+    run_id = datetime.now(timezone.utc).strftime("%Y%m%d%H%M%S%f")
+    credentials = []
+    for i in range(devices):
+        response = await client.post(
+            "/api/v1/devices/",
+            headers=admin,
+            json={"name": f"bench-{run_id}-{i}", "description": "load test device"},
+        )
+        response.raise_for_status()
+        device_id = response.json()["id"]
+
+        response = await client.post(f"/api/v1/keys/{device_id}", headers=admin)
+        response.raise_for_status()
+        credentials.append(
+            {"X-API-Key": response.json()["api_key"], "X-Device-Id": device_id}
+        )
+    return credentials
+
+
+async def _run_phase(
+    client: httpx.AsyncClient,
+    phase: str,
+    credentials: list[dict[str, str]],
+    requests: int,
+    concurrency: int,
+) -> PhaseResult:
+    result = PhaseResult()
+    counter = iter(range(requests))
+
+    async def send(i: int) -> httpx.Response:
+        headers = credentials[i % len(credentials)]
+        if phase == "ingest":
+            return await client.post(
+                "/api/v1/data/",
+                headers=headers,
+                json={"temperature": 20 + i % 10, "humidity": 50 + i % 25, "seq": i},
+            )
+        return await client.get(
+            f"/api/v1/data/device/{headers['X-Device-Id']}", params={"limit": 50}
+        )
+
+    async def worker() -> None:
+        for i in counter:
+            start = time.perf_counter()
+            try:
+                response = await send(i)
+                status = response.status_code
+            except httpx.HTTPError:
+                status = 599
+            result.record(status, time.perf_counter() - start)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    result.elapsed = time.perf_counter() - start
+    return result
+
+
+async def run_load(
+    client: httpx.AsyncClient,
+    *,
+    admin_secret: str,
+    devices: int = 10,
+    requests: int = 2000,
+    concurrency: int = 20,
+    phases: tuple[str, ...] = PHASES,
+) -> dict[str, dict[str, Any]]:
+    """
+    Provision devices, then run each phase in turn.
+
+    :param client: Client pointed at the app (in-process or over the network).
+    :param admin_secret: Value for the X-Admin-Secret header.
+    :param devices: Number of devices (and API keys) to spread requests over.
+    :param requests: Requests sent per phase.
+    :param concurrency: Requests in flight at once.
+    :param phases: Phases to run, from "ingest" and "list".
+    :return: Summary per phase.
+    """
+    credentials = await provision(client, admin_secret, devices)
+    return {
+        phase: (
+            await _run_phase(client, phase, credentials, requests, concurrency)
+        ).summary()
+        for phase in phases
+    }
+
+
+def _git_revision() -> str | None:
+    try:
+        return subprocess.run(  # nosec B603 B607
+            ["git", "rev-parse", "--short", "HEAD"],
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(current: dict[str, Any], previous: dict[str, Any]) -> list[str]:
+    """Human readable change in throughput and p95/p99 against an earlier run."""
+    lines = []
+    for phase, summary in current["phases"].items():
+        before = previous.get("phases", {}).get(phase)
+        if before is None:
+            continue
+        parts = []
+        for label, now, then in (
+            ("rps", summary["throughput_rps"], before["throughput_rps"]),
+            ("p95", summary["latency_ms"]["p95"], before["latency_ms"]["p95"]),
+            ("p99", summary["latency_ms"]["p99"], before["latency_ms"]["p99"]),
+        ):
+            if now is None or not then:
+                continue
+            parts.append(f"{label} {then} -> {now} ({(now - then) / then:+.1%})")
+        lines.append(f"  {phase}: " + ", ".join(parts))
+    return lines
+
+
+async def _in_process_client(database_url: str) -> httpx.AsyncClient:
+    from sqlalchemy.ext.asyncio import create_async_engine
+
+    from app.main import app
+    from app.utils import database, rate_limit
+    from app.utils.logger import setup_logging
+
+    setup_logging(level="WARNING")
+    database.set_engine(create_async_engine(database_url))
+    # Keep the limiter in the request path but high enough never to reject
+    rate_limit._rate_limiter = rate_limit.RateLimiter(
+        rate_limit.MemoryRateLimitBackend(), rate=1e9, burst=10**9
+    )
+    await database.create_db_and_tables()
+    return httpx.AsyncClient(
+        transport=httpx.ASGITransport(app=app), base_url="http://bench"
+    )
+
+
+async def _main(args: argparse.Namespace) -> None:
+    from app.utils.config import settings
+
+    admin_secret = args.admin_secret or settings.ADMIN_SECRET_KEY.get_secret_value()
+
+    if args.base_url:
+        target = args.base_url
+        client = httpx.AsyncClient(base_url=args.base_url, timeout=30)
+    else:
+        database_url = args.database_url or (
+            f"sqlite+aiosqlite:///{Path(tempfile.mkdtemp()) / 'bench.db'}"
+        )
+        target = f"in-process ({database_url.split('://')[0]})"
+        client = await _in_process_client(database_url)
+
+    async with client:
+        phases = await run_load(
+            client,
+            admin_secret=admin_secret,
+            devices=args.devices,
+            requests=args.requests,
+            concurrency=args.concurrency,
+            phases=tuple(args.phases),
+        )
+
+    results = {
+        "timestamp": datetime.now(timezone.utc).isoformat(),
+        "revision": _git_revision(),
+        "python": platform.python_version(),
+        "target": target,
+        "config": {
+            "devices": args.devices,
+            "requests": args.requests,
+            "concurrency": args.concurrency,
+        },
+        "phases": phases,
+    }
+
+    for phase, summary in phases.items():
+        latency = summary["latency_ms"]
+        print(
+            f"{phase:>8}: {summary['requests']} requests, {summary['errors']} errors, "
+            f"{summary['throughput_rps']} req/s, p50 {latency['p50']}ms, "
+            f"p95 {latency['p95']}ms, p99 {latency['p99']}ms"
+        )
+
+    if args.compare:
+        print(f"\nCompared with {args.compare}:")
+        print("\n".join(compare(results, json.loads(args.compare.read_text()))))
+
+    if args.output:
+        args.output.write_text(json.dumps(results, indent=2) + "\n")
+        print(f"\nResults written to {args.output}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--devices", type=int, default=10)
+    parser.add_argument("--requests", type=int, default=2000, help="per phase")
+    parser.add_argument("--concurrency", type=int, default=20)
+    parser.add_argument("--phases", nargs="+", choices=PHASES, default=list(PHASES))
+    target_group = parser.add_mutually_exclusive_group()
+    target_group.add_argument("--database-url", help="run in-process against this DB")
+    target_group.add_argument("--base-url", help="load a running server instead")
+    parser.add_argument("--admin-secret", help="default: ADMIN_SECRET_KEY")
+    parser.add_argument("--output", type=Path)
+    parser.add_argument("--compare", type=Path)
+    asyncio.run(_main(parser.parse_args()))
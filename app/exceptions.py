@@ -1,3 +1,6 @@
+from typing import Any
+
+
 class NotFoundError(Exception):
     def __init__(self, detail: str = "Not found"):
         self.detail = detail
@@ -6,3 +9,8 @@ class NotFoundError(Exception):
 class ConflictError(Exception):
     def __init__(self, detail: str = "Conflict"):
         self.detail = detail
+
+
+class InvalidDataError(Exception):
+    def __init__(self, detail: Any = "Invalid data"):
+        self.detail = detail
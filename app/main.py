@@ -1,9 +1,9 @@
+import asyncio
 from contextlib import asynccontextmanager
 
-from fastapi import FastAPI, Request, status
+from fastapi import Depends, FastAPI, Request, status
 from fastapi.encoders import jsonable_encoder
 from fastapi.exceptions import RequestValidationError
-from fastapi.middleware.cors import CORSMiddleware
 from fastapi.responses import JSONResponse, RedirectResponse
 from loguru import logger
 from sqlalchemy.exc import IntegrityError
@@ -11,48 +11,111 @@ from sqlalchemy.exc import IntegrityError
 from app.api.v1.api_key_routes import api_key_routes
 from app.api.v1.data_routes import data_routes
 from app.api.v1.device_routes import device_routes
-from app.exceptions import ConflictError, NotFoundError
-from app.utils.config import settings
-from app.utils.database import create_db_and_tables, dispose_engine
-from app.utils.logger import setup_logging
-from app.utils.middleware import RequestLoggingMiddleware
-
-setup_logging(
-    level=settings.LOG_LEVEL,
-    json=settings.LOG_JSON_FORMAT,
-    log_file=settings.LOG_NAME,
+from app.exceptions import ConflictError, InvalidDataError, NotFoundError
+from app.services.data_service import store_spooled
+from app.services.delete_job_service import fail_stale_delete_jobs
+from app.utils import metrics
+from app.utils.admission import admission_stats
+from app.utils.auth import require_admin
+from app.utils.coalesce import coalesce_stats
+from app.utils.config import get_settings
+from app.utils.database import dispose_engine, ensure_db_and_tables
+from app.utils.idempotency import run_expirer
+from app.utils.line_protocol import get_line_server, line_protocol_stats
+from app.utils.logger import log_queue_stats, setup_logging
+from app.utils.middleware import (
+    CoalescingMiddleware,
+    LoadSheddingMiddleware,
+    RequestLoggingMiddleware,
+    SettingsCORSMiddleware,
 )
+from app.utils.sharding import get_shard_map
+from app.utils.spool import get_spool, run_replayer, spool_stats
+from app.utils.window_cache import window_cache_stats
+
+
+def configure_logging() -> None:
+    settings = get_settings()
+    setup_logging(
+        level=settings.LOG_LEVEL,
+        json=settings.LOG_JSON_FORMAT,
+        log_file=settings.LOG_NAME,
+        async_sink=settings.LOG_ASYNC,
+        queue_size=settings.LOG_QUEUE_SIZE,
+        batch_size=settings.LOG_BATCH_SIZE,
+        flush_interval=settings.LOG_FLUSH_INTERVAL,
+        access_sample_rate=settings.LOG_ACCESS_SAMPLE_RATE,
+        route_levels=settings.LOG_ROUTE_LEVELS,
+    )
 
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
+    settings = get_settings()
+    # Read here rather than at import, which builds no settings.
+    app.title = settings.APP_NAME
+    configure_logging()
     if settings.ENVIRONMENT != "production":
-        logger.info("Starting up — creating database tables")
-        await create_db_and_tables()
+        if await ensure_db_and_tables():
+            logger.info("Starting up — created database tables")
+        else:
+            logger.info("Starting up — database tables already created")
+        await get_shard_map().ensure_tables()
     else:
         logger.info("Starting up — skipping create_all, schema managed by Alembic")
+    await fail_stale_delete_jobs(settings.DELETE_JOB_STALE_AFTER)
+    spool = get_spool()
+    replayer = None
+    if spool is not None:
+        replayer = asyncio.create_task(
+            run_replayer(
+                spool,
+                store_spooled,
+                batch_size=settings.SPOOL_REPLAY_BATCH,
+                interval=settings.SPOOL_REPLAY_INTERVAL,
+            )
+        )
+    expirer = asyncio.create_task(
+        run_expirer(
+            window=settings.IDEMPOTENCY_WINDOW,
+            interval=settings.IDEMPOTENCY_EXPIRE_INTERVAL,
+            batch_size=settings.IDEMPOTENCY_EXPIRE_BATCH,
+        )
+    )
+    line_server = get_line_server()
+    if line_server is not None:
+        await line_server.start(
+            settings.LINE_HOST, settings.LINE_TCP_PORT, settings.LINE_UDP_PORT
+        )
     logger.info("Startup complete")
     yield
     logger.info("Shutting down")
+    if line_server is not None:
+        await line_server.stop()
+    expirer.cancel()
+    if replayer is not None:
+        replayer.cancel()
+        await spool.seal()  # type: ignore[union-attr]
     await dispose_engine()
+    await get_shard_map().dispose()
     logger.info("Shutdown complete — engine disposed")
 
 
-app = FastAPI(
-    lifespan=lifespan,
-    title=settings.APP_NAME,
-)
+app = FastAPI(lifespan=lifespan)
 
-app.add_middleware(
-    CORSMiddleware,
-    allow_origins=settings.CORS_ORIGINS,
-    allow_credentials=True,
-    allow_methods=["*"],
-    allow_headers=["*"],
-)
+app.add_middleware(SettingsCORSMiddleware)
 
+app.add_middleware(LoadSheddingMiddleware)
+app.add_middleware(CoalescingMiddleware)
 app.add_middleware(RequestLoggingMiddleware)
 
+metrics.register("admission", admission_stats)
+metrics.register("coalescing", coalesce_stats)
+metrics.register("log_queue", log_queue_stats)
+metrics.register("spool", spool_stats)
+metrics.register("line_protocol", line_protocol_stats)
+metrics.register("window_cache", window_cache_stats)
+
 
 app.include_router(api_key_routes, prefix="/api")
 app.include_router(data_routes, prefix="/api")
@@ -69,6 +132,11 @@ async def health():
     return {"status": "ok"}
 
 
+@app.get("/metrics", dependencies=[Depends(require_admin)], include_in_schema=False)
+async def metrics_snapshot():
+    return metrics.snapshot()
+
+
 @app.exception_handler(RequestValidationError)
 async def custom_422_handler(request: Request, exc: RequestValidationError):
     return JSONResponse(
@@ -94,6 +162,14 @@ async def not_found_handler(request: Request, exc: NotFoundError):
     )
 
 
+@app.exception_handler(InvalidDataError)
+async def invalid_data_handler(request: Request, exc: InvalidDataError):
+    return JSONResponse(
+        status_code=status.HTTP_422_UNPROCESSABLE_CONTENT,
+        content={"detail": jsonable_encoder(exc.detail)},
+    )
+
+
 @app.exception_handler(ConflictError)
 async def conflict_handler(request: Request, exc: ConflictError):
     return JSONResponse(
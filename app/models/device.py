@@ -1,4 +1,5 @@
 import uuid
+from datetime import datetime
 from typing import TYPE_CHECKING, Any
 
 import sqlalchemy as sa
@@ -21,6 +22,12 @@ class Device(ModelBase, table=True):  # type: ignore
         default_factory=dict,
         sa_column=sa.Column(JSONType, nullable=False),
     )
+    # Incremented whenever readings in the sealed past change; part of the
+    # key of cached responses, see app.utils.window_cache.
+    data_version: int = Field(
+        default=0,
+        sa_column=sa.Column(sa.BigInteger, nullable=False, server_default="0"),
+    )
     api_key: "ApiKey" = Relationship(
         back_populates="device"
     )  # nullable; SQLAlchemy resolves string annotations as class names so union syntax cannot be used here
@@ -28,6 +35,10 @@ class Device(ModelBase, table=True):  # type: ignore
 
 
 class DeviceData(ModelBase, table=True):  # type: ignore
+    __table_args__ = (
+        sa.Index("ix_devicedata_device_id_created_date", "device_id", "created_date"),
+    )
+
     data: dict[str, Any] = Field(
         default_factory=dict,
         sa_column=sa.Column(JSONType, nullable=False),
@@ -40,3 +51,76 @@ class DeviceData(ModelBase, table=True):  # type: ignore
         )
     )
     device: "Device" = Relationship(back_populates="data")
+
+
+class DeviceDataChunk(ModelBase, table=True):  # type: ignore
+    """
+    Readings of one device from one hour, packed by the compaction job; see
+    app.utils.compaction for the encoding of `ids`, `timestamps` and `payload`.
+    """
+
+    __table_args__ = (
+        sa.Index("ix_devicedatachunk_device_id_start", "device_id", "start"),
+    )
+
+    device_id: uuid.UUID = Field(
+        sa_column=sa.Column(
+            sa.Uuid,
+            sa.ForeignKey("device.id", ondelete="CASCADE"),
+            nullable=False,
+        )
+    )
+    start: datetime = Field(
+        sa_column=sa.Column(sa.DateTime(timezone=True), nullable=False)
+    )
+    count: int = Field(sa_column=sa.Column(sa.Integer, nullable=False))
+    ids: bytes = Field(sa_column=sa.Column(sa.LargeBinary, nullable=False))
+    timestamps: bytes = Field(sa_column=sa.Column(sa.LargeBinary, nullable=False))
+    payload: bytes = Field(sa_column=sa.Column(sa.LargeBinary, nullable=False))
+
+
+class IdempotencyKey(ModelBase, table=True):  # type: ignore
+    """
+    An `Idempotency-Key` a device sent with a reading, and the reading it
+    produced. Lives on the primary database; see app.utils.idempotency.
+    """
+
+    __table_args__ = (
+        sa.UniqueConstraint("device_id", "key"),
+        sa.Index("ix_idempotencykey_created_date", "created_date"),
+    )
+
+    device_id: uuid.UUID = Field(
+        sa_column=sa.Column(
+            sa.Uuid,
+            sa.ForeignKey("device.id", ondelete="CASCADE"),
+            nullable=False,
+        )
+    )
+    key: str = Field(..., max_length=255)
+    # No foreign key to devicedata: the reading may live on a shard.
+    data_id: uuid.UUID = Field(sa_column=sa.Column(sa.Uuid, nullable=False))
+
+
+class DeleteJob(ModelBase, table=True):  # type: ignore
+    """
+    A background deletion of a device's readings in a time range, or of the
+    whole device when `kind` is "device"; see app.services.delete_job_service.
+    Lives on the primary database.
+    """
+
+    # No foreign key to device: the job outlives the device it purges.
+    device_id: uuid.UUID = Field(sa_column=sa.Column(sa.Uuid, nullable=False))
+    kind: str = Field(..., max_length=16)
+    start: datetime | None = Field(
+        default=None, sa_column=sa.Column(sa.DateTime(timezone=True), nullable=True)
+    )
+    end: datetime | None = Field(
+        default=None, sa_column=sa.Column(sa.DateTime(timezone=True), nullable=True)
+    )
+    status: str = Field(default="pending", max_length=16)
+    deleted: int = Field(default=0, sa_column=sa.Column(sa.BigInteger, nullable=False))
+    error: str | None = Field(default=None, max_length=1024)
+    finished_at: datetime | None = Field(
+        default=None, sa_column=sa.Column(sa.DateTime(timezone=True), nullable=True)
+    )
@@ -0,0 +1,68 @@
+import uuid
+from datetime import datetime
+
+import sqlalchemy as sa
+from sqlmodel import Field
+
+from app.models.base import ModelBase
+
+
+class DeviceField(ModelBase, table=True):  # type: ignore
+    """
+    One top-level key seen in a device's readings, with how often it was seen
+    and whether it has been promoted to typed values in `devicedatavalue`.
+    Lives on the primary database.
+    """
+
+    __table_args__ = (sa.UniqueConstraint("device_id", "key"),)
+
+    device_id: uuid.UUID = Field(
+        sa_column=sa.Column(
+            sa.Uuid,
+            sa.ForeignKey("device.id", ondelete="CASCADE"),
+            nullable=False,
+        )
+    )
+    key: str = Field(..., max_length=255)
+    count: int = Field(default=0, sa_column=sa.Column(sa.BigInteger, nullable=False))
+    numeric_count: int = Field(
+        default=0, sa_column=sa.Column(sa.BigInteger, nullable=False)
+    )
+    last_type: str = Field(..., max_length=16)
+    promoted_at: datetime | None = Field(
+        default=None, sa_column=sa.Column(sa.DateTime(timezone=True), nullable=True)
+    )
+    backfilled_at: datetime | None = Field(
+        default=None, sa_column=sa.Column(sa.DateTime(timezone=True), nullable=True)
+    )
+
+
+class DeviceDataValue(ModelBase, table=True):  # type: ignore
+    """
+    Numeric value of a promoted key of one reading. `created_date` is copied
+    from the reading so time-range aggregates never touch `devicedata`.
+    Stored next to the reading, so on its shard when sharding is configured.
+    """
+
+    __table_args__ = (
+        sa.UniqueConstraint("data_id", "key"),
+        sa.Index(
+            "ix_devicedatavalue_device_id_key_created_date",
+            "device_id",
+            "key",
+            "created_date",
+        ),
+    )
+
+    # No foreign key to devicedata: values outlive their row when the reading
+    # is compacted into a devicedatachunk.
+    data_id: uuid.UUID = Field(sa_column=sa.Column(sa.Uuid, nullable=False))
+    device_id: uuid.UUID = Field(
+        sa_column=sa.Column(
+            sa.Uuid,
+            sa.ForeignKey("device.id", ondelete="CASCADE"),
+            nullable=False,
+        )
+    )
+    key: str = Field(..., max_length=255)
+    value: float = Field(sa_column=sa.Column(sa.Float, nullable=False))
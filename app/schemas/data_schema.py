@@ -11,3 +11,34 @@ class DeviceDataRead(BaseModel):
     updated_date: datetime
     data: dict[str, Any]
     device_id: UUID
+
+
+class DeviceFieldRead(BaseModel):
+    key: str
+    count: int
+    numeric_count: int
+    last_type: str
+    promoted_at: datetime | None = None
+    backfilled_at: datetime | None = None
+
+
+class DeviceDataAggregate(BaseModel):
+    field: str
+    count: int
+    min: float | None = None
+    max: float | None = None
+    mean: float | None = None
+
+
+class DeleteJobRead(BaseModel):
+    id: UUID
+    device_id: UUID
+    kind: str
+    start: datetime | None = None
+    end: datetime | None = None
+    status: str
+    deleted: int
+    error: str | None = None
+    created_date: datetime
+    updated_date: datetime
+    finished_at: datetime | None = None
@@ -1,8 +1,114 @@
 from datetime import datetime
-from typing import Any
+from typing import Annotated, Any, Literal
 from uuid import UUID
 
-from pydantic import BaseModel, Field, model_validator
+from pydantic import (
+    BaseModel,
+    ConfigDict,
+    Field,
+    NonNegativeFloat,
+    NonNegativeInt,
+    field_validator,
+    model_validator,
+)
+
+JsonType = Literal["array", "boolean", "integer", "null", "number", "object", "string"]
+_FIELD_TYPE_PATTERN = r"^(array|boolean|integer|null|number|object|string)\??$"
+
+
+class DeadbandConfig(BaseModel):
+    """
+    Change-only storage for a device, set as `notes["deadband"]`. A reading is
+    skipped when it has the same keys as the last stored one, every numeric
+    value is within its tolerance (exact match without one) and every other
+    value is equal, unless `heartbeat_seconds` have passed since that reading.
+    """
+
+    heartbeat_seconds: float = Field(default=300.0, gt=0)
+    tolerance: dict[str, NonNegativeFloat] = Field(default_factory=dict)
+
+
+def _validate_deadband(notes: dict[str, Any] | None) -> dict[str, Any] | None:
+    if notes and "deadband" in notes:
+        DeadbandConfig.model_validate(notes["deadband"])
+    return notes
+
+
+class JsonSchema(BaseModel):
+    """
+    The subset of JSON Schema that device payload validators are compiled
+    from. Unsupported keywords are rejected rather than silently ignored.
+    """
+
+    model_config = ConfigDict(extra="forbid", populate_by_name=True)
+
+    schema_uri: str | None = Field(default=None, alias="$schema")
+    title: str | None = None
+    description: str | None = None
+    type: JsonType | list[JsonType] | None = None
+    enum: list[str | int | float | bool | None] | None = Field(
+        default=None, min_length=1
+    )
+    properties: dict[str, "JsonSchema"] = Field(default_factory=dict)
+    required: list[str] = Field(default_factory=list)
+    additional_properties: bool = Field(default=True, alias="additionalProperties")
+    items: "JsonSchema | None" = None
+    minimum: float | None = None
+    maximum: float | None = None
+    exclusive_minimum: float | None = Field(default=None, alias="exclusiveMinimum")
+    exclusive_maximum: float | None = Field(default=None, alias="exclusiveMaximum")
+    min_length: NonNegativeInt | None = Field(default=None, alias="minLength")
+    max_length: NonNegativeInt | None = Field(default=None, alias="maxLength")
+    min_items: NonNegativeInt | None = Field(default=None, alias="minItems")
+    max_items: NonNegativeInt | None = Field(default=None, alias="maxItems")
+
+
+class PayloadSchema(BaseModel):
+    """
+    Validation of a device's readings, set as `notes["schema"]`. Either
+    `fields`, a map of top-level key to JSON type with a trailing "?" for
+    optional keys (other keys are allowed unless `extra` is false), or
+    `json_schema`, a JSON Schema of an object.
+    """
+
+    model_config = ConfigDict(extra="forbid")
+
+    fields: dict[str, Annotated[str, Field(pattern=_FIELD_TYPE_PATTERN)]] | None = None
+    extra: bool = True
+    json_schema: JsonSchema | None = None
+
+    @model_validator(mode="after")
+    def require_one_spec(self) -> "PayloadSchema":
+        if (self.fields is None) == (self.json_schema is None):
+            raise ValueError("Exactly one of fields and json_schema must be given")
+        if self.json_schema is not None and self.json_schema.type not in (
+            None,
+            "object",
+        ):
+            raise ValueError("json_schema must describe an object")
+        return self
+
+    def as_json_schema(self) -> JsonSchema:
+        if self.json_schema is not None:
+            return self.json_schema
+        fields = self.fields or {}
+        return JsonSchema(
+            type="object",
+            properties={
+                key: JsonSchema(type=kind.removesuffix("?"))  # type: ignore[arg-type]
+                for key, kind in fields.items()
+            },
+            required=[key for key, kind in fields.items() if not kind.endswith("?")],
+            additionalProperties=self.extra,
+        )
+
+
+def _validate_payload_schema(
+    notes: dict[str, Any] | None,
+) -> dict[str, Any] | None:
+    if notes and "schema" in notes:
+        PayloadSchema.model_validate(notes["schema"])
+    return notes
 
 
 class DeviceCreate(BaseModel):
@@ -10,12 +116,18 @@ class DeviceCreate(BaseModel):
     description: str | None = Field(default=None, max_length=1024)
     notes: dict[str, Any] = Field(default_factory=dict)
 
+    _check_deadband = field_validator("notes")(_validate_deadband)
+    _check_payload_schema = field_validator("notes")(_validate_payload_schema)
+
 
 class DeviceUpdate(BaseModel):
     name: str | None = Field(None, max_length=255)
     description: str | None = Field(None, max_length=1024)
     notes: dict[str, Any] | None = None
 
+    _check_deadband = field_validator("notes")(_validate_deadband)
+    _check_payload_schema = field_validator("notes")(_validate_payload_schema)
+
     @model_validator(mode="after")
     def require_at_least_one_field(self) -> "DeviceUpdate":
         if all(v is None for v in (self.name, self.description, self.notes)):
@@ -30,3 +142,45 @@ class DeviceRead(BaseModel):
     name: str
     description: str | None = None
     notes: dict[str, Any]
+
+
+class DeviceBulkCreate(DeviceCreate):
+    issue_key: bool = False
+
+
+class DeviceBulkUpdate(DeviceUpdate):
+    id: UUID
+
+
+class DeviceBulk(BaseModel):
+    """
+    Devices to create, devices to update and devices to issue API keys for,
+    applied in one transaction. Devices created here get a key with
+    `issue_key`, as their IDs are not known in advance.
+    """
+
+    create: list[DeviceBulkCreate] = Field(default_factory=list, max_length=1000)
+    update: list[DeviceBulkUpdate] = Field(default_factory=list, max_length=1000)
+    issue_keys: list[UUID] = Field(default_factory=list, max_length=1000)
+
+    @model_validator(mode="after")
+    def require_at_least_one_item(self) -> "DeviceBulk":
+        if not (self.create or self.update or self.issue_keys):
+            raise ValueError("At least one item must be provided")
+        return self
+
+
+class DeviceBulkResult(BaseModel):
+    """
+    Outcome of one item of a DeviceBulk, by the list it was in and its index
+    there. `status` is the code the single-item route would have answered
+    with; items that fail are skipped and the rest applied.
+    """
+
+    action: Literal["create", "update", "issue_key"]
+    index: int
+    status: int
+    detail: str | None = None
+    device: DeviceRead | None = None
+    api_key_id: UUID | None = None
+    api_key: str | None = None
@@ -3,6 +3,7 @@ from uuid import UUID
 from loguru import logger
 from sqlalchemy import select
 from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import joinedload
 
 from app.exceptions import ConflictError, NotFoundError
 from app.models.api_key import ApiKey
@@ -48,7 +49,13 @@ class ApiKeyService:
         :param device_id: The ID of the device to retrieve the API key for.
         :return: ApiKey object; models.api_key.ApiKey
         """
-        statement = select(ApiKey).where(ApiKey.device_id == device_id)
+        # The device comes along in the same query so ingest can read its
+        # settings from the session without another round trip.
+        statement = (
+            select(ApiKey)
+            .where(ApiKey.device_id == device_id)
+            .options(joinedload(ApiKey.device))  # type: ignore[arg-type]
+        )
         result = await self._db.execute(statement)
         key = result.scalars().one_or_none()
 
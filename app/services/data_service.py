@@ -1,43 +1,435 @@
-from datetime import datetime, timezone
+import asyncio
+import json
+import time
+from collections.abc import Awaitable, Callable, Iterable, Mapping
+from datetime import datetime, timedelta, timezone
 from typing import Any, Literal, Sequence
-from uuid import UUID
+from uuid import UUID, uuid4
 
+import sqlalchemy as sa
 from loguru import logger
+from sqlalchemy import (
+    delete,
+    exists,
+    func,
+    literal,
+    true,
+    update,
+    values,
+)
+from sqlalchemy.exc import DBAPIError
 from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import aliased, object_session
 from sqlmodel import select
 
 from app.exceptions import NotFoundError
 from app.models.api_key import ApiKey
-from app.models.device import Device, DeviceData
+from app.models.device import Device, DeviceData, DeviceDataChunk
+from app.models.field import DeviceDataValue, DeviceField
+from app.utils import idempotency
+from app.utils.compaction import (
+    decode_chunk,
+    encode_chunk,
+    hour_of,
+    utc,
+)
+from app.utils.config import get_settings
+from app.utils.database import (
+    dialect_insert,
+    get_session_factory,
+    insert_ignoring_conflicts,
+)
+from app.utils.deadband import get_deadband
+from app.utils.sharding import ShardMap, get_shard_map
+from app.utils.spool import get_spool
+from app.utils.tiering import ColdStore, get_cold_store
+from app.utils.validation import get_validators
+from app.utils.window_cache import get_window_cache, sealed
+
+_MAX_KEY_LENGTH = 255
+_CHUNK_PAGE = 16
+
+
+def _json_type(value: Any) -> str:
+    if value is None:
+        return "null"
+    if isinstance(value, bool):
+        return "boolean"
+    if isinstance(value, (int, float)):
+        return "number"
+    if isinstance(value, str):
+        return "string"
+    if isinstance(value, list):
+        return "array"
+    return "object"
+
+
+def _in_range(value: datetime, start: datetime | None, end: datetime | None) -> bool:
+    value = utc(value)
+    return (start is None or value >= utc(start)) and (end is None or value < utc(end))
+
+
+def _is_number(value: Any) -> bool:
+    return isinstance(value, (int, float)) and not isinstance(value, bool)
 
 
 class DataService:
 
-    def __init__(self, session: AsyncSession):
+    def __init__(
+        self,
+        session: AsyncSession,
+        shards: ShardMap | None = None,
+        cold: ColdStore | None = None,
+    ):
         self._db = session
+        self._shards = shards if shards is not None else get_shard_map()
+        self._cold = cold if cold is not None else get_cold_store()
+        self._shard_sessions: dict[str, AsyncSession] = {}
+
+    def _shard_session(self, name: str) -> AsyncSession:
+        if name not in self._shard_sessions:
+            self._shard_sessions[name] = self._shards.session(name)
+        return self._shard_sessions[name]
+
+    def _data_session(self, device_id: UUID) -> AsyncSession:
+        """
+        Session holding the readings of a device: its shard when sharding is
+        configured, otherwise the primary session.
+        """
+        if not self._shards.enabled:
+            return self._db
+        return self._shard_session(self._shards.shard_for(device_id))
+
+    def _all_data_sessions(self) -> list[AsyncSession]:
+        if not self._shards.enabled:
+            return [self._db]
+        return [self._shard_session(name) for name in self._shards.engines]
 
-    async def create(self, data_in: dict[str, Any], api_key: ApiKey) -> dict[str, str]:
+    async def _changed(self, device_ids: Iterable[UUID]) -> None:
         """
-        Create a new device data entry in the database.
+        Bump the data_version of devices whose readings in the sealed past
+        changed, so cached responses covering them stop matching.
+        """
+        device_ids = set(device_ids)
+        if not device_ids:
+            return
+        await self._db.execute(
+            update(Device)
+            .where(Device.id.in_(device_ids))  # type: ignore[attr-defined]
+            .values(data_version=Device.data_version + 1)
+        )
+        await self._db.commit()
+        cache = get_window_cache()
+        for device_id in device_ids:
+            cache.invalidate(device_id)
+
+    async def close(self) -> None:
+        """Close any shard sessions opened by this service."""
+        for session in self._shard_sessions.values():
+            await session.close()
+        self._shard_sessions.clear()
+
+    def _dialect(self, db: AsyncSession) -> str:
+        return db.get_bind().dialect.name
+
+    async def _record_fields(
+        self, device_id: UUID, readings: Sequence[dict[str, Any]]
+    ) -> set[str]:
+        """
+        Count the top-level keys of a device's readings in the field registry.
+
+        The upsert locks the device's registry rows until the primary commits,
+        which happens after the readings themselves are committed.
+        promote_field updates the same row, so once a promotion commits every
+        reading that did not see it is already visible to the backfill.
+
+        :return: The keys of the readings that are promoted.
+        """
+        fields: dict[str, dict[str, Any]] = {}
+        for data_in in readings:
+            for key, value in data_in.items():
+                if len(key) > _MAX_KEY_LENGTH:
+                    continue
+                row = fields.setdefault(
+                    key,
+                    {
+                        "id": uuid4(),
+                        "device_id": device_id,
+                        "key": key,
+                        "count": 0,
+                        "numeric_count": 0,
+                    },
+                )
+                row["count"] += 1
+                row["numeric_count"] += int(_is_number(value))
+                row["last_type"] = _json_type(value)
+        if not fields:
+            return set()
+
+        table = DeviceField.__table__  # type: ignore[attr-defined]
+        statement = dialect_insert(table, self._dialect(self._db)).values(
+            [*fields.values()]
+        )
+        statement = statement.on_conflict_do_update(
+            index_elements=[table.c.device_id, table.c.key],
+            set_={
+                "count": table.c.count + statement.excluded.count,
+                "numeric_count": table.c.numeric_count
+                + statement.excluded.numeric_count,
+                "last_type": statement.excluded.last_type,
+            },
+        ).returning(table.c.key, table.c.promoted_at)
+        result = await self._db.execute(statement)
+        return {
+            str(key) for key, promoted_at in result.all() if promoted_at is not None
+        }
+
+    async def create(
+        self,
+        data_in: dict[str, Any],
+        api_key: ApiKey,
+        idempotency_key: str | None = None,
+    ) -> dict[str, str]:
+        """
+        Create a new device data entry in the database. With a spool
+        configured, a reading the database cannot take in time is spooled.
+        A reading whose idempotency key the device already used within
+        IDEMPOTENCY_WINDOW is not stored again.
         :param data_in: A dictionary containing the device data to create.
         :param api_key: The API key for authentication, obtained from the verify_api_key dependency
-        :return: A dictionary containing the status and ID of the created device data entry.
+        :param idempotency_key: The Idempotency-Key header, if the device sent one.
+        :return: A dictionary with the status ("ok", "skipped", "spooled" or "duplicate") and entry ID.
         """
+        spool = get_spool()
+        # A key without a session comes from verify_api_key's cache, which it
+        # only falls back to when the database is unreachable.
+        cached = spool is not None and object_session(api_key) is None
+        # verify_api_key loads the device with the key, so this is an
+        # identity map hit rather than a query
+        device = (
+            api_key.device if cached else await self._db.get(Device, api_key.device_id)
+        )
+        if device is not None:
+            validator = get_validators().get(
+                device.id, device.updated_date, device.notes
+            )
+            if validator is not None:
+                validator.validate(data_in)
+        deadband = (
+            get_deadband().config(device.id, device.updated_date, device.notes)
+            if device is not None
+            else None
+        )
+        now = time.monotonic()
+        if deadband is not None:
+            last_id = get_deadband().unchanged(
+                api_key.device_id, data_in, deadband, now
+            )
+            if last_id is not None:
+                if not cached:
+                    api_key.last_used_at = datetime.now(timezone.utc)
+                    self._db.add(api_key)
+                    await self._db.commit()
+                logger.debug(
+                    "Skipped unchanged reading for device id: {}", api_key.device_id
+                )
+                return {"status": "skipped", "id": str(last_id)}
+
         device_data = DeviceData(data=data_in, device_id=api_key.device_id)
-        self._db.add(device_data)
+        status = "ok"
+        original = None
+        if spool is None:
+            original = await self._store(device_data, api_key, idempotency_key)
+        elif cached:
+            await spool.append(device_data, idempotency_key)
+            status = "spooled"
+        else:
+            try:
+                async with asyncio.timeout(get_settings().SPOOL_DB_TIMEOUT):
+                    original = await self._store(device_data, api_key, idempotency_key)
+            except (DBAPIError, OSError, TimeoutError) as exc:
+                logger.warning(
+                    "Database unavailable, spooling reading for device id: {}: {}",
+                    api_key.device_id,
+                    exc,
+                )
+                await spool.append(device_data, idempotency_key)
+                status = "spooled"
+        if original is not None:
+            logger.info(
+                "Duplicate of device data {} for device id: {}",
+                original,
+                api_key.device_id,
+            )
+            return {"status": "duplicate", "id": str(original)}
+        if deadband is not None:
+            get_deadband().remember(api_key.device_id, device_data.id, data_in, now)
+
+        logger.info(
+            "Created device data {} for device id: {} ({})",
+            device_data.id,
+            api_key.device_id,
+            status,
+        )
+        return {"status": status, "id": str(device_data.id)}
+
+    async def _store(
+        self,
+        device_data: DeviceData,
+        api_key: ApiKey,
+        idempotency_key: str | None = None,
+    ) -> UUID | None:
+        """
+        Store a reading, unless its idempotency key is already claimed.
+
+        :return: None when stored, otherwise the ID of the original reading.
+        """
+        if idempotency_key is not None:
+            original = await idempotency.claim(
+                self._db,
+                api_key.device_id,
+                idempotency_key,
+                device_data.id,
+                get_settings().IDEMPOTENCY_WINDOW,
+            )
+            if original is not None:
+                # Nothing was written; end the transaction to release the
+                # row lock PostgreSQL takes on the conflicting key.
+                await self._db.commit()
+                return original
+
+        db = self._data_session(api_key.device_id)
+        db.add(device_data)
+
+        data_in = device_data.data
+        for key in await self._record_fields(api_key.device_id, [data_in]):
+            if _is_number(data_in[key]):
+                db.add(
+                    DeviceDataValue(
+                        data_id=device_data.id,
+                        device_id=api_key.device_id,
+                        key=key,
+                        value=data_in[key],
+                        created_date=device_data.created_date,
+                    )
+                )
 
         api_key.last_used_at = datetime.now(timezone.utc)
         self._db.add(api_key)
 
+        if db is not self._db:
+            await db.commit()
         await self._db.commit()
-        await self._db.refresh(device_data)
+        await db.refresh(device_data)
+        return None
 
-        logger.info(
-            "Created device data {} for device id: {}",
-            device_data.id,
-            api_key.device_id,
+    async def store_many(
+        self,
+        readings: Sequence[DeviceData],
+        idempotency_keys: Mapping[UUID, str] | None = None,
+    ) -> int:
+        """
+        Insert readings in bulk, e.g. replayed from the spool. Readings whose
+        ID is already stored are skipped, so a batch can be stored twice, and
+        readings of deleted devices are dropped.
+        :param readings: Transient DeviceData objects.
+        :param idempotency_keys: Idempotency-Key headers by reading ID; a
+            reading whose key another reading has claimed is dropped.
+        :return: The number of readings stored.
+        """
+        keys = idempotency_keys or {}
+        devices: dict[UUID, list[DeviceData]] = {}
+        for reading in readings:
+            devices.setdefault(reading.device_id, []).append(reading)
+        result = await self._db.execute(
+            select(Device.id).where(Device.id.in_(devices))  # type: ignore[attr-defined]
         )
-        return {"status": "ok", "id": str(device_data.id)}
+        existing = set(result.scalars().all())
+        for device_id in devices.keys() - existing:
+            logger.warning(
+                "Dropping {} readings of deleted device id: {}",
+                len(devices[device_id]),
+                device_id,
+            )
+
+        data_table = DeviceData.__table__  # type: ignore[attr-defined]
+        values_table = DeviceDataValue.__table__  # type: ignore[attr-defined]
+        now = datetime.now(timezone.utc)
+        stored = 0
+        late: set[UUID] = set()
+        for device_id in existing:
+            db = self._data_session(device_id)
+            dialect = self._dialect(db)
+            group = []
+            for reading in devices[device_id]:
+                key = keys.get(reading.id)
+                if key is not None:
+                    original = await idempotency.claim(
+                        self._db,
+                        device_id,
+                        key,
+                        reading.id,
+                        get_settings().IDEMPOTENCY_WINDOW,
+                    )
+                    if original is not None and original != reading.id:
+                        logger.info(
+                            "Dropping spooled duplicate of device data {} "
+                            "for device id: {}",
+                            original,
+                            device_id,
+                        )
+                        continue
+                group.append(reading)
+            if not group:
+                continue
+            result = await db.execute(
+                insert_ignoring_conflicts(data_table, dialect)
+                .values(
+                    [
+                        {
+                            "id": reading.id,
+                            "device_id": device_id,
+                            "data": reading.data,
+                            "created_date": reading.created_date,
+                            "updated_date": now,
+                        }
+                        for reading in group
+                    ]
+                )
+                .returning(data_table.c.id)
+            )
+            inserted = set(result.scalars().all())
+            new = [reading for reading in group if reading.id in inserted]
+            if not new:
+                continue
+            promoted = await self._record_fields(device_id, [r.data for r in new])
+            values = [
+                {
+                    "id": uuid4(),
+                    "data_id": reading.id,
+                    "device_id": device_id,
+                    "key": key,
+                    "value": reading.data[key],
+                    "created_date": reading.created_date,
+                    "updated_date": now,
+                }
+                for reading in new
+                for key in promoted
+                if _is_number(reading.data.get(key))
+            ]
+            if values:
+                await db.execute(
+                    insert_ignoring_conflicts(values_table, dialect), values
+                )
+            stored += len(new)
+            if any(sealed(reading.created_date) for reading in new):
+                late.add(device_id)
+
+        for db in self._shard_sessions.values():
+            await db.commit()
+        await self._db.commit()
+        await self._changed(late)
+        return stored
 
     async def read(self, data_id: UUID) -> DeviceData:
         """
@@ -45,34 +437,113 @@ class DataService:
         :param data_id: The ID of the device data entry to retrieve.
         :return: DeviceData; device_models.DeviceData
         """
-        db_data: DeviceData | None = await self._db.get(DeviceData, data_id)
-        if db_data is None:
-            raise NotFoundError(f"Device data {data_id} not found")
+        _, db_data = await self._locate(data_id)
         return db_data
 
+    async def _locate(self, data_id: UUID) -> tuple[AsyncSession, DeviceData]:
+        """
+        Find a reading row on whichever database holds it. Compacted readings
+        are not found: chunks are not indexed by reading ID, and searching
+        them would scan the chunk table for every unknown ID.
+
+        :return: (session, the reading)
+        """
+        sessions = self._all_data_sessions()
+        found = await asyncio.gather(*(db.get(DeviceData, data_id) for db in sessions))
+        for db, db_data in zip(sessions, found):
+            if db_data is not None:
+                return db, db_data
+        raise NotFoundError(f"Device data {data_id} not found")
+
+    async def _chunked_readings(
+        self,
+        db: AsyncSession,
+        device_id: UUID,
+        wanted: int,
+        order: Literal["asc", "desc"],
+        start: datetime | None = None,
+        end: datetime | None = None,
+    ) -> list[DeviceData]:
+        """
+        Decode the device's chunks in `order` until at least `wanted` readings
+        in range are collected and the hour they end in is complete.
+        """
+        chunk_start: Any = DeviceDataChunk.start
+        statement = (
+            select(DeviceDataChunk)
+            .where(DeviceDataChunk.device_id == device_id)
+            .order_by(chunk_start.desc() if order == "desc" else chunk_start.asc())
+            .limit(_CHUNK_PAGE)
+        )
+        if start is not None:
+            statement = statement.where(chunk_start >= hour_of(start))
+        if end is not None:
+            statement = statement.where(chunk_start < end)
+        readings: list[DeviceData] = []
+        last_start = None
+        page = 0
+        while True:
+            result = await db.execute(statement.offset(page * _CHUNK_PAGE))
+            chunks = result.scalars().all()
+            for chunk in chunks:
+                if len(readings) >= wanted and chunk.start != last_start:
+                    return readings
+                readings.extend(
+                    reading
+                    for reading in decode_chunk(chunk)
+                    if _in_range(reading.created_date, start, end)
+                )
+                last_start = chunk.start
+            if len(chunks) < _CHUNK_PAGE:
+                return readings
+            page += 1
+
     async def list(
         self,
         device_id: UUID,
         skip: int = 0,
         limit: int = 50,
         order: Literal["asc", "desc"] = "desc",
+        start: datetime | None = None,
+        end: datetime | None = None,
     ) -> Sequence[DeviceData]:
         """
-        Get a list of all data entries for a given device.
+        Get a list of all data entries for a given device, including compacted
+        and tiered readings.
         :param device_id: The ID of the device to retrieve data for.
         :param skip: Skip this many entries before returning.
         :param limit: Return at most this many entries.
         :param order: The order to return the entries in, either "asc" or "desc". Default is "desc".
+        :param start: Only entries created at or after this time.
+        :param end: Only entries created before this time.
         :return: A list of DeviceData objects; devices.device_models.DeviceData
         """
         device = await self._db.get(Device, device_id)
         if not device:
             raise NotFoundError(f"Device {device_id} not found")
 
+        db = self._data_session(device_id)
+        statement = self._rows_statement(device_id, order, start, end)
+        result = await db.execute(statement.offset(skip).limit(limit))
+        rows = result.scalars().all()
+        # Compaction and tiering move a device's oldest readings first, so
+        # every chunked or tiered reading is older than every row: a full
+        # newest-first page of rows cannot have any of them in it.
+        if order == "desc" and len(rows) == limit:
+            return rows
+        return await self._with_older(
+            db, device_id, statement, rows, skip, limit, order, start, end
+        )
+
+    def _rows_statement(
+        self,
+        device_id: UUID,
+        order: Literal["asc", "desc"],
+        start: datetime | None,
+        end: datetime | None,
+    ) -> Any:
         statement = (
             select(DeviceData)
-            .offset(skip)
-            .limit(limit)
             .where(DeviceData.device_id == device_id)
             .order_by(
                 DeviceData.created_date.desc()  # type: ignore[attr-defined]
@@ -80,18 +551,672 @@ class DataService:
                 else DeviceData.created_date.asc()  # type: ignore[attr-defined]
             )
         )
-        result = await self._db.execute(statement)
+        if start is not None:
+            statement = statement.where(DeviceData.created_date >= start)
+        if end is not None:
+            statement = statement.where(DeviceData.created_date < end)
+        return statement
+
+    async def _with_older(
+        self,
+        db: AsyncSession,
+        device_id: UUID,
+        statement: Any,
+        rows: Sequence[DeviceData],
+        skip: int,
+        limit: int,
+        order: Literal["asc", "desc"],
+        start: datetime | None,
+        end: datetime | None,
+    ) -> Sequence[DeviceData]:
+        """Merge the device's compacted and tiered readings into a page of rows."""
+        wanted = skip + limit
+        older = await self._chunked_readings(db, device_id, wanted, order, start, end)
+        if self._cold is not None:
+            older += await asyncio.to_thread(
+                self._cold.read,
+                device_id,
+                start=start,
+                end=end,
+                order=order,
+                wanted=wanted,
+            )
+        if not older:
+            return rows
+        result = await db.execute(statement.limit(wanted))
+        # An interrupted tiering run leaves a batch both in the database and
+        # on disk, so keep the first copy of each reading.
+        unique: dict[UUID, DeviceData] = {}
+        for reading in [*result.scalars().all(), *older]:
+            unique.setdefault(reading.id, reading)
+        readings = sorted(
+            unique.values(),
+            key=lambda r: utc(r.created_date),
+            reverse=order == "desc",
+        )
+        return readings[skip:wanted]
+
+    async def _latest_rows(
+        self,
+        db: AsyncSession,
+        device_ids: Sequence[UUID],
+        limit: int,
+        order: Literal["asc", "desc"],
+        start: datetime | None,
+        end: datetime | None,
+    ) -> Sequence[DeviceData]:
+        """
+        The first `limit` rows of each device in `order`, in one query: a
+        LATERAL join on PostgreSQL, so every device is one index range scan
+        that stops after `limit` rows, and row_number() elsewhere.
+        """
+        table = DeviceData.__table__  # type: ignore[attr-defined]
+        created = table.c.created_date
+        in_range = []
+        if start is not None:
+            in_range.append(created >= start)
+        if end is not None:
+            in_range.append(created < end)
+        ordering = created.desc() if order == "desc" else created.asc()
+
+        if self._dialect(db) == "postgresql":
+            devices = values(sa.column("id", sa.Uuid), name="devices").data(
+                [(device_id,) for device_id in device_ids]
+            )
+            page = (
+                select(table)
+                .where(table.c.device_id == devices.c.id, *in_range)
+                .order_by(ordering)
+                .limit(limit)
+                .lateral("page")
+            )
+            statement = select(aliased(DeviceData, page)).select_from(devices)
+            result = await db.execute(statement.join(page, true()))
+            return result.scalars().all()
+
+        ranked = (
+            select(
+                table,
+                func.row_number()
+                .over(partition_by=table.c.device_id, order_by=ordering)
+                .label("rank"),
+            )
+            .where(table.c.device_id.in_(device_ids), *in_range)
+            .subquery()
+        )
+        result = await db.execute(
+            select(aliased(DeviceData, ranked)).where(ranked.c.rank <= limit)
+        )
         return result.scalars().all()
 
+    async def list_many(
+        self,
+        device_ids: Sequence[UUID],
+        limit: int = 50,
+        order: Literal["asc", "desc"] = "desc",
+        start: datetime | None = None,
+        end: datetime | None = None,
+    ) -> dict[UUID, Sequence[DeviceData]]:
+        """
+        Get the data entries of several devices at once, with one query per
+        database for the rows, as `list` would return them one device at a
+        time. Compacted and tiered readings are merged in only for the
+        devices that have some in range.
+        :param device_ids: The IDs of the devices.
+        :param limit: Return at most this many entries per device.
+        :param order: The order to return the entries in, either "asc" or "desc". Default is "desc".
+        :param start: Only entries created at or after this time.
+        :param end: Only entries created before this time.
+        :return: The entries of each device, by device ID in the order given.
+        """
+        device_ids = list(dict.fromkeys(device_ids))
+        result = await self._db.execute(
+            select(Device.id).where(Device.id.in_(device_ids))  # type: ignore[attr-defined]
+        )
+        found = set(result.scalars().all())
+        missing = [str(device_id) for device_id in device_ids if device_id not in found]
+        if missing:
+            raise NotFoundError(f"Devices {', '.join(missing)} not found")
+
+        groups: dict[int, tuple[AsyncSession, list[UUID]]] = {}
+        for device_id in device_ids:
+            db = self._data_session(device_id)
+            groups.setdefault(id(db), (db, []))[1].append(device_id)
+        pages = await asyncio.gather(
+            *(
+                self._latest_rows(db, ids, limit, order, start, end)
+                for db, ids in groups.values()
+            )
+        )
+        rows: dict[UUID, list[DeviceData]] = {device_id: [] for device_id in device_ids}
+        for page in pages:
+            for reading in page:
+                rows[reading.device_id].append(reading)
+        readings: dict[UUID, Sequence[DeviceData]] = {
+            device_id: rows[device_id] for device_id in device_ids
+        }
+
+        for db, ids in groups.values():
+            # As in `list`, a full newest-first page has no older readings.
+            candidates = [
+                device_id
+                for device_id in ids
+                if order == "asc" or len(readings[device_id]) < limit
+            ]
+            if not candidates:
+                continue
+            chunked = select(DeviceDataChunk.device_id).where(
+                DeviceDataChunk.device_id.in_(candidates)  # type: ignore[attr-defined]
+            )
+            if start is not None:
+                chunked = chunked.where(DeviceDataChunk.start >= hour_of(start))
+            if end is not None:
+                chunked = chunked.where(DeviceDataChunk.start < end)
+            older = set((await db.execute(chunked.distinct())).scalars().all())
+            if self._cold is not None:
+                older.update(
+                    device_id
+                    for device_id in candidates
+                    if self._cold.has_range(device_id, start, end)
+                )
+            for device_id in candidates:
+                if device_id in older:
+                    readings[device_id] = await self._with_older(
+                        db,
+                        device_id,
+                        self._rows_statement(device_id, order, start, end),
+                        readings[device_id],
+                        0,
+                        limit,
+                        order,
+                        start,
+                        end,
+                    )
+        return readings
+
+    async def data_versions(self, device_ids: Sequence[UUID]) -> dict[UUID, int]:
+        """
+        Get the data_version of devices, which keys their cached responses.
+        :param device_ids: The IDs of the devices.
+        :return: data_version by device ID.
+        """
+        result = await self._db.execute(
+            select(Device.id, Device.data_version).where(
+                Device.id.in_(device_ids)  # type: ignore[attr-defined]
+            )
+        )
+        versions: dict[UUID, int] = {
+            device_id: version for device_id, version in result.all()
+        }
+        for device_id in device_ids:
+            if device_id not in versions:
+                raise NotFoundError(f"Device {device_id} not found")
+        return versions
+
     async def delete(self, data_id: UUID) -> None:
         """
         Delete a device data entry by its ID.
         :param data_id: The ID of the device data entry to delete.
         """
-        db_data = await self._db.get(DeviceData, data_id)
-        if db_data is None:
-            raise NotFoundError(f"Device data {data_id} not found")
+        db, db_data = await self._locate(data_id)
 
-        await self._db.delete(db_data)
-        await self._db.commit()
+        # Typed values have no foreign key to cascade from the reading
+        await db.execute(
+            delete(DeviceDataValue).where(
+                DeviceDataValue.data_id == data_id  # type: ignore[arg-type]
+            )
+        )
+        await db.delete(db_data)
+        await db.commit()
+        await self._changed([db_data.device_id])
         logger.info("Deleted device data with id: {}", data_id)
+
+    async def _delete_batches(
+        self,
+        db: AsyncSession,
+        table: Any,
+        conditions: Sequence[Any],
+        batch_size: int,
+        progress: Callable[[int], Awaitable[None]] | None,
+        count: Any = None,
+    ) -> int:
+        """
+        Delete the rows matching `conditions`, `batch_size` per transaction.
+        Counts deleted rows, or sums `count` over them when given.
+        """
+        deleted = 0
+        while True:
+            batch = (
+                await db.execute(
+                    select(table.c.id, count if count is not None else literal(1))
+                    .where(*conditions)
+                    .limit(batch_size)
+                )
+            ).all()
+            if not batch:
+                return deleted
+            await db.execute(
+                delete(table).where(table.c.id.in_([row[0] for row in batch]))
+            )
+            await db.commit()
+            deleted += sum(row[1] for row in batch)
+            if progress is not None:
+                await progress(deleted)
+            if len(batch) < batch_size:
+                return deleted
+            pause = get_settings().DELETE_BATCH_PAUSE
+            if pause:
+                await asyncio.sleep(pause)
+
+    async def delete_range(
+        self,
+        device_id: UUID,
+        start: datetime | None = None,
+        end: datetime | None = None,
+        batch_size: int | None = None,
+        progress: Callable[[int], Awaitable[None]] | None = None,
+    ) -> int:
+        """
+        Delete a device's readings in a time range, rows, compacted and tiered
+        alike, a batch per transaction so no single statement locks or logs
+        the whole range.
+        :param device_id: The ID of the device.
+        :param start: Delete readings created at or after this time; default all.
+        :param end: Delete readings created before this time; default all.
+        :param batch_size: Rows per transaction; default DELETE_BATCH_SIZE.
+        :param progress: Awaited with the running total after every batch.
+        :return: The number of readings deleted.
+        """
+        device = await self._db.get(Device, device_id)
+        if not device:
+            raise NotFoundError(f"Device {device_id} not found")
+        batch_size = batch_size or get_settings().DELETE_BATCH_SIZE
+        db = self._data_session(device_id)
+        values_table = DeviceDataValue.__table__  # type: ignore[attr-defined]
+        data_table = DeviceData.__table__  # type: ignore[attr-defined]
+        chunk_table = DeviceDataChunk.__table__  # type: ignore[attr-defined]
+
+        def in_range(column: Any) -> list[Any]:
+            conditions = [column.table.c.device_id == device_id]
+            if start is not None:
+                conditions.append(column >= start)
+            if end is not None:
+                conditions.append(column < end)
+            return conditions
+
+        deleted = 0
+
+        async def report(count: int) -> None:
+            if progress is not None:
+                await progress(deleted + count)
+
+        async def heartbeat(count: int) -> None:
+            await report(0)
+
+        # Typed values have no foreign key to cascade from the reading
+        await self._delete_batches(
+            db,
+            values_table,
+            in_range(values_table.c.created_date),
+            batch_size,
+            heartbeat,
+        )
+        deleted += await self._delete_batches(
+            db, data_table, in_range(data_table.c.created_date), batch_size, report
+        )
+
+        # Chunks hold an hour each: those inside the range go whole, the ones
+        # the range starts or ends in are rewritten without its readings.
+        whole = [chunk_table.c.device_id == device_id]
+        if start is not None:
+            whole.append(chunk_table.c.start >= start)
+        if end is not None:
+            whole.append(chunk_table.c.start <= end - timedelta(hours=1))
+        deleted += await self._delete_batches(
+            db, chunk_table, whole, batch_size, report, count=chunk_table.c.count
+        )
+        edges = {
+            hour_of(bound)
+            for bound in (start, end)
+            if bound is not None and hour_of(bound) != utc(bound)
+        }
+        for hour in sorted(edges):
+            result = await db.execute(
+                select(DeviceDataChunk).where(
+                    DeviceDataChunk.device_id == device_id,
+                    DeviceDataChunk.start == hour,
+                )
+            )
+            for chunk in result.scalars().all():
+                remaining = [
+                    r
+                    for r in decode_chunk(chunk)
+                    if not _in_range(r.created_date, start, end)
+                ]
+                deleted += chunk.count - len(remaining)
+                if remaining:
+                    for column, value in encode_chunk(chunk.start, remaining).items():
+                        setattr(chunk, column, value)
+                    db.add(chunk)
+                else:
+                    await db.delete(chunk)
+            await db.commit()
+
+        if self._cold is not None:
+            deleted += await asyncio.to_thread(
+                self._cold.delete_range, device_id, start, end
+            )
+        await self._changed([device_id])
+        await report(0)
+        logger.info(
+            "Deleted {} readings of device id {} from {} to {}",
+            deleted,
+            device_id,
+            start,
+            end,
+        )
+        return deleted
+
+    async def _get_field(self, device_id: UUID, key: str) -> DeviceField | None:
+        result = await self._db.execute(
+            select(DeviceField).where(
+                DeviceField.device_id == device_id, DeviceField.key == key
+            )
+        )
+        return result.scalars().first()
+
+    async def fields(self, device_id: UUID) -> Sequence[DeviceField]:
+        """
+        Get the field registry of a device, most frequent keys first.
+        :param device_id: The ID of the device.
+        :return: A list of DeviceField objects; models.field.DeviceField
+        """
+        device = await self._db.get(Device, device_id)
+        if not device:
+            raise NotFoundError(f"Device {device_id} not found")
+
+        result = await self._db.execute(
+            select(DeviceField)
+            .where(DeviceField.device_id == device_id)
+            .order_by(DeviceField.count.desc(), DeviceField.key)  # type: ignore[attr-defined]
+        )
+        return result.scalars().all()
+
+    async def promote_field(self, device_id: UUID, key: str) -> DeviceField:
+        """
+        Start storing a key's numeric values as typed rows on every new reading.
+        Existing readings are covered by backfill_field; aggregates keep using
+        the JSON data until the backfill has finished.
+        :param device_id: The ID of the device.
+        :param key: The top-level key to promote.
+        :return: The updated DeviceField.
+        """
+        field = await self._get_field(device_id, key)
+        if field is None:
+            raise NotFoundError(f"Field {key} not seen for device {device_id}")
+        if field.promoted_at is None:
+            field.promoted_at = datetime.now(timezone.utc)
+            self._db.add(field)
+            await self._db.commit()
+            await self._db.refresh(field)
+            logger.info("Promoted field {} for device id: {}", key, device_id)
+        return field
+
+    async def backfill_field(
+        self, device_id: UUID, key: str, batch_size: int = 1000
+    ) -> int:
+        """
+        Write typed values of a promoted key for readings stored before it was
+        promoted, one batch per transaction. Safe to re-run: values that
+        already exist are skipped.
+        :param device_id: The ID of the device.
+        :param key: A promoted key.
+        :param batch_size: Readings scanned per transaction.
+        :return: The number of values written.
+        """
+        field = await self._get_field(device_id, key)
+        if field is None or field.promoted_at is None:
+            raise NotFoundError(f"Field {key} is not promoted for device {device_id}")
+
+        db = self._data_session(device_id)
+        data_table = DeviceData.__table__  # type: ignore[attr-defined]
+        values_table = DeviceDataValue.__table__  # type: ignore[attr-defined]
+        insert = insert_ignoring_conflicts(values_table, self._dialect(db))
+        missing = ~exists().where(
+            values_table.c.data_id == data_table.c.id, values_table.c.key == key
+        )
+        written = 0
+        last_id = None
+        while True:
+            statement = (
+                select(data_table.c.id, data_table.c.data, data_table.c.created_date)
+                .where(data_table.c.device_id == device_id, missing)
+                .order_by(data_table.c.id)
+                .limit(batch_size)
+            )
+            if last_id is not None:
+                statement = statement.where(data_table.c.id > last_id)
+            rows = (await db.execute(statement)).all()
+            if not rows:
+                break
+            last_id = rows[-1].id
+
+            now = datetime.now(timezone.utc)
+            values = [
+                {
+                    "id": uuid4(),
+                    "data_id": row.id,
+                    "device_id": device_id,
+                    "key": key,
+                    "value": row.data[key],
+                    "created_date": row.created_date,
+                    "updated_date": now,
+                }
+                for row in rows
+                if _is_number(row.data.get(key))
+            ]
+            if values:
+                await db.execute(insert, values)
+            await db.commit()
+            written += len(values)
+
+        written += await self._backfill_chunks(db, device_id, key, insert)
+        field.backfilled_at = datetime.now(timezone.utc)
+        self._db.add(field)
+        await self._db.commit()
+        logger.info(
+            "Backfilled {} values of field {} for device id: {}",
+            written,
+            key,
+            device_id,
+        )
+        return written
+
+    async def _backfill_chunks(
+        self, db: AsyncSession, device_id: UUID, key: str, insert: Any
+    ) -> int:
+        """Backfill readings that were compacted into chunks; see backfill_field."""
+        statement = (
+            select(DeviceDataChunk)
+            .where(DeviceDataChunk.device_id == device_id)
+            .order_by(DeviceDataChunk.id)  # type: ignore[arg-type]
+            .limit(_CHUNK_PAGE)
+        )
+        written = 0
+        last_id = None
+        while True:
+            page = statement
+            if last_id is not None:
+                page = page.where(DeviceDataChunk.id > last_id)  # type: ignore[operator]
+            chunks = (await db.execute(page)).scalars().all()
+            if not chunks:
+                return written
+            last_id = chunks[-1].id
+
+            readings = [
+                reading
+                for chunk in chunks
+                for reading in decode_chunk(chunk)
+                if _is_number(reading.data.get(key))
+            ]
+            result = await db.execute(
+                select(DeviceDataValue.data_id).where(
+                    DeviceDataValue.key == key,
+                    DeviceDataValue.data_id.in_(  # type: ignore[attr-defined]
+                        [reading.id for reading in readings]
+                    ),
+                )
+            )
+            present = set(result.scalars().all())
+            now = datetime.now(timezone.utc)
+            values = [
+                {
+                    "id": uuid4(),
+                    "data_id": reading.id,
+                    "device_id": device_id,
+                    "key": key,
+                    "value": reading.data[key],
+                    "created_date": reading.created_date,
+                    "updated_date": now,
+                }
+                for reading in readings
+                if reading.id not in present
+            ]
+            if values:
+                await db.execute(insert, values)
+            await db.commit()
+            written += len(values)
+
+    async def _aggregate_chunks(
+        self,
+        db: AsyncSession,
+        device_id: UUID,
+        key: str,
+        start: datetime | None,
+        end: datetime | None,
+    ) -> Sequence[float]:
+        """Numeric values of a key in the device's compacted readings in range."""
+        statement = select(DeviceDataChunk).where(
+            DeviceDataChunk.device_id == device_id
+        )
+        if start is not None:
+            statement = statement.where(DeviceDataChunk.start >= hour_of(start))
+        if end is not None:
+            statement = statement.where(DeviceDataChunk.start < end)
+        result = await db.execute(statement)
+        return [
+            reading.data[key]
+            for chunk in result.scalars()
+            for reading in decode_chunk(chunk)
+            if _is_number(reading.data.get(key))
+            and _in_range(reading.created_date, start, end)
+        ]
+
+    async def aggregate(
+        self,
+        device_id: UUID,
+        key: str,
+        start: datetime | None = None,
+        end: datetime | None = None,
+    ) -> dict[str, Any]:
+        """
+        Count, min, max and mean of a numeric key over a device's readings.
+        Uses the typed values once the key is promoted and backfilled, and
+        extracts it from the JSON data otherwise, decoding compacted chunks as
+        well; tiered files in range are decoded in both cases.
+        :param device_id: The ID of the device.
+        :param key: The top-level key to aggregate.
+        :param start: Only readings created at or after this time.
+        :param end: Only readings created before this time.
+        :return: A dictionary with field, count, min, max and mean.
+        """
+        device = await self._db.get(Device, device_id)
+        if not device:
+            raise NotFoundError(f"Device {device_id} not found")
+
+        field = await self._get_field(device_id, key)
+        db = self._data_session(device_id)
+        typed = field is not None and field.backfilled_at is not None
+        if typed:
+            value: Any = DeviceDataValue.value
+            created: Any = DeviceDataValue.created_date
+            conditions: list[Any] = [
+                DeviceDataValue.device_id == device_id,
+                DeviceDataValue.key == key,
+            ]
+        else:
+            value = DeviceData.data[key].as_float()  # type: ignore[index]
+            created = DeviceData.created_date
+            conditions = [DeviceData.device_id == device_id]
+            dialect = self._dialect(db)
+            if dialect == "postgresql":
+                conditions.append(
+                    func.jsonb_typeof(DeviceData.data[key])  # type: ignore[index]
+                    == "number"
+                )
+            elif dialect == "sqlite":
+                conditions.append(
+                    func.json_type(DeviceData.data, f"$.{json.dumps(key)}").in_(
+                        ("integer", "real")
+                    )
+                )
+        if start is not None:
+            conditions.append(created >= start)
+        if end is not None:
+            conditions.append(created < end)
+
+        result = await db.execute(
+            select(
+                func.count(value), func.min(value), func.max(value), func.avg(value)
+            ).where(*conditions)
+        )
+        count, minimum, maximum, mean = result.one()
+        # Typed values cover compacted readings, but tiering moves readings
+        # out of the database with their values, so the files are read either way.
+        chunked: list[float] = []
+        if not typed:
+            chunked = list(await self._aggregate_chunks(db, device_id, key, start, end))
+        if self._cold is not None:
+            tiered = await asyncio.to_thread(
+                self._cold.read, device_id, start=start, end=end
+            )
+            chunked.extend(
+                reading.data[key]
+                for reading in tiered
+                if _is_number(reading.data.get(key))
+            )
+        if chunked:
+            total = (mean or 0.0) * count + sum(chunked)
+            count += len(chunked)
+            minimum = min(chunked) if minimum is None else min(minimum, *chunked)
+            maximum = max(chunked) if maximum is None else max(maximum, *chunked)
+            mean = total / count
+        return {
+            "field": key,
+            "count": count,
+            "min": minimum,
+            "max": maximum,
+            "mean": float(mean) if mean is not None else None,
+        }
+
+
+async def store_spooled(
+    readings: Sequence[DeviceData], idempotency_keys: Mapping[UUID, str]
+) -> int:
+    """Run DataService.store_many with its own session, for the spool replayer."""
+    async with get_session_factory()() as session:
+        service = DataService(session=session)
+        try:
+            return await service.store_many(readings, idempotency_keys)
+        finally:
+            await service.close()
+
+
+async def backfill_promoted_field(device_id: UUID, key: str) -> None:
+    """Run DataService.backfill_field with its own session, e.g. as a background task."""
+    async with get_session_factory()() as session:
+        service = DataService(session=session)
+        try:
+            await service.backfill_field(device_id, key)
+        finally:
+            await service.close()
@@ -0,0 +1,142 @@
+from datetime import datetime, timedelta, timezone
+from typing import Literal
+from uuid import UUID
+
+from loguru import logger
+from sqlalchemy import update
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.exceptions import InvalidDataError, NotFoundError
+from app.models.device import DeleteJob, Device
+from app.services.data_service import DataService
+from app.services.device_service import DeviceService
+from app.utils.compaction import utc
+from app.utils.database import get_session_factory
+
+
+class DeleteJobService:
+
+    def __init__(self, session: AsyncSession):
+        self._db = session
+
+    async def create(
+        self,
+        device_id: UUID,
+        kind: Literal["range", "device"],
+        start: datetime | None = None,
+        end: datetime | None = None,
+    ) -> DeleteJob:
+        """
+        Record a deletion to be run by run_delete_job.
+
+        :param device_id: The ID of the device.
+        :param kind: "range" to delete the readings in [start, end), "device"
+            to delete all of them and then the device.
+        :param start: Start of the range, inclusive.
+        :param end: End of the range, exclusive.
+        :return: The pending DeleteJob.
+        """
+        if await self._db.get(Device, device_id) is None:
+            raise NotFoundError(f"Device {device_id} not found")
+        if start is not None and end is not None and utc(start) >= utc(end):
+            raise InvalidDataError("start must be before end")
+        job = DeleteJob(device_id=device_id, kind=kind, start=start, end=end)
+        self._db.add(job)
+        await self._db.commit()
+        await self._db.refresh(job)
+        logger.info(
+            "Queued {} delete job {} for device id: {}", kind, job.id, device_id
+        )
+        return job
+
+    async def read(self, job_id: UUID) -> DeleteJob:
+        """
+        Get a delete job by its ID.
+
+        :param job_id: The ID of the job.
+        :return: DeleteJob; status and deleted show its progress.
+        """
+        job: DeleteJob | None = await self._db.get(DeleteJob, job_id)
+        if job is None:
+            raise NotFoundError(f"Delete job {job_id} not found")
+        return job
+
+    async def run(self, job_id: UUID) -> None:
+        """
+        Run a pending job, committing its progress after every batch. A
+        failed job records the error; deletions are idempotent, so a new job
+        for the same range picks up where it stopped.
+
+        :param job_id: The ID of the job.
+        """
+        job = await self.read(job_id)
+        job.status = "running"
+        self._db.add(job)
+        await self._db.commit()
+
+        async def progress(deleted: int) -> None:
+            # Also the heartbeat fail_stale looks for.
+            job.deleted = deleted
+            job.updated_date = datetime.now(timezone.utc)
+            self._db.add(job)
+            await self._db.commit()
+
+        data_service = DataService(session=self._db)
+        try:
+            await data_service.delete_range(
+                job.device_id, job.start, job.end, progress=progress
+            )
+            if job.kind == "device":
+                await DeviceService(session=self._db).delete(job.device_id)
+            job.status = "done"
+        except Exception as exc:
+            logger.exception("Delete job {} failed", job_id)
+            await self._db.rollback()
+            await self._db.refresh(job)
+            job.status = "failed"
+            job.error = str(exc)[:1024]
+        finally:
+            await data_service.close()
+        job.finished_at = datetime.now(timezone.utc)
+        self._db.add(job)
+        await self._db.commit()
+
+    async def fail_stale(self, stale_after: float) -> int:
+        """
+        Mark failed the jobs left pending or running by a worker that stopped,
+        i.e. without progress for `stale_after` seconds. Jobs are not resumed:
+        a new one for the same range finishes the deletion.
+
+        :param stale_after: Seconds without progress after which a job is stale.
+        :return: The number of jobs marked failed.
+        """
+        now = datetime.now(timezone.utc)
+        result = await self._db.execute(
+            update(DeleteJob)
+            .where(
+                DeleteJob.status.in_(["pending", "running"]),  # type: ignore[attr-defined]
+                DeleteJob.updated_date < now - timedelta(seconds=stale_after),  # type: ignore[arg-type]
+            )
+            .values(
+                status="failed",
+                error="Interrupted: the worker running it stopped",
+                finished_at=now,
+            )
+        )
+        await self._db.commit()
+        count: int = result.rowcount  # type: ignore[attr-defined]
+        if count:
+            logger.warning("Marked {} interrupted delete jobs failed", count)
+        return count
+
+
+async def run_delete_job(job_id: UUID) -> None:
+    """Run DeleteJobService.run with its own session, e.g. as a background task."""
+    async with get_session_factory()() as session:
+        await DeleteJobService(session=session).run(job_id)
+
+
+async def fail_stale_delete_jobs(stale_after: float) -> int:
+    """Run DeleteJobService.fail_stale with its own session, e.g. at startup."""
+    async with get_session_factory()() as session:
+        return await DeleteJobService(session=session).fail_stale(stale_after)
@@ -1,13 +1,27 @@
+import asyncio
+from datetime import datetime, timezone
 from typing import Sequence
 from uuid import UUID
 
 from loguru import logger
+from sqlalchemy import insert, update
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlmodel import select
 
 from app.exceptions import NotFoundError
+from app.models.api_key import ApiKey
 from app.models.device import Device
-from app.schemas.device_schema import DeviceCreate, DeviceUpdate
+from app.schemas.device_schema import (
+    DeviceBulk,
+    DeviceBulkResult,
+    DeviceCreate,
+    DeviceRead,
+    DeviceUpdate,
+)
+from app.utils.auth import generate_api_key, hash_api_key
+from app.utils.sharding import get_shard_map
+from app.utils.tiering import get_cold_store
+from app.utils.validation import get_validators
 
 
 class DeviceService:
@@ -60,6 +74,7 @@ class DeviceService:
         self._db.add(db_device)
         await self._db.commit()
         await self._db.refresh(db_device)
+        get_validators().invalidate(device_id)
         logger.info("Updated device {} with id: {}", db_device.name, db_device.id)
 
         return db_device
@@ -74,6 +89,13 @@ class DeviceService:
 
         await self._db.delete(db_device)
         await self._db.commit()
+        get_validators().invalidate(device_id)
+        shard_map = get_shard_map()
+        if shard_map.enabled:
+            await shard_map.delete_device_data(device_id)
+        cold_store = get_cold_store()
+        if cold_store is not None:
+            await asyncio.to_thread(cold_store.delete_device, device_id)
         logger.info("Deleted device {} with id: {}", db_device.name, db_device.id)
 
     async def list(self, skip: int = 0, limit: int = 50) -> Sequence[Device]:
@@ -89,3 +111,155 @@ class DeviceService:
         )  # type: ignore[arg-type]
         result = await self._db.execute(statement)
         return result.scalars().all()
+
+    async def bulk(self, bulk: DeviceBulk) -> Sequence[DeviceBulkResult]:
+        """
+        Create devices, update devices and issue API keys in one transaction,
+        with one multi-row statement for each. Items that the single-item
+        routes would reject (unknown device, name or key already taken) are
+        reported and skipped.
+
+        :param bulk: DeviceBulk object; schemas.device_schema.DeviceBulk
+        :return: One DeviceBulkResult per item, with the raw keys issued.
+        """
+        names = [item.name for item in bulk.create if item.name] + [
+            item.name for item in bulk.update if item.name
+        ]
+        ids = {item.id for item in bulk.update} | set(bulk.issue_keys)
+        taken: dict[str, UUID] = {}
+        if names:
+            named = await self._db.execute(
+                select(Device.name, Device.id).where(
+                    Device.name.in_(names)  # type: ignore[attr-defined]
+                )
+            )
+            taken = {name: device_id for name, device_id in named.all()}
+        existing: set[UUID] = set()
+        keyed: set[UUID] = set()
+        if ids:
+            found = await self._db.execute(
+                select(Device.id).where(Device.id.in_(ids))  # type: ignore[attr-defined]
+            )
+            existing = set(found.scalars().all())
+            with_keys = await self._db.execute(
+                select(ApiKey.device_id).where(
+                    ApiKey.device_id.in_(ids)  # type: ignore[attr-defined]
+                )
+            )
+            keyed = set(with_keys.scalars().all())
+
+        now = datetime.now(timezone.utc)
+        results: list[DeviceBulkResult] = []
+        claimed: set[str] = set()
+        created: list[dict] = []
+        updated: list[dict] = []
+        to_key: list[tuple[DeviceBulkResult, UUID]] = []
+
+        def name_conflict(name: str | None, device_id: UUID | None) -> bool:
+            if name is None:
+                return False
+            if name in claimed or taken.get(name, device_id) != device_id:
+                return True
+            claimed.add(name)
+            return False
+
+        for index, create_item in enumerate(bulk.create):
+            if name_conflict(create_item.name, None):
+                results.append(
+                    DeviceBulkResult(
+                        action="create",
+                        index=index,
+                        status=409,
+                        detail=f"Device name {create_item.name} is already taken",
+                    )
+                )
+                continue
+            device = Device(
+                **create_item.model_dump(exclude={"issue_key"}),
+                created_date=now,
+                updated_date=now,
+            )
+            created.append(device.model_dump())
+            item_result = DeviceBulkResult(
+                action="create",
+                index=index,
+                status=201,
+                device=DeviceRead(**device.model_dump()),
+            )
+            results.append(item_result)
+            if create_item.issue_key:
+                to_key.append((item_result, device.id))
+
+        seen: set[UUID] = set()
+        for index, update_item in enumerate(bulk.update):
+            detail = None
+            if update_item.id not in existing:
+                status, detail = 404, f"Device {update_item.id} not found"
+            elif update_item.id in seen:
+                status, detail = 409, f"Device {update_item.id} is updated twice"
+            elif name_conflict(update_item.name, update_item.id):
+                status, detail = 409, f"Device name {update_item.name} is already taken"
+            else:
+                status = 200
+                seen.add(update_item.id)
+                updated.append(
+                    update_item.model_dump(exclude_unset=True) | {"updated_date": now}
+                )
+            results.append(
+                DeviceBulkResult(
+                    action="update", index=index, status=status, detail=detail
+                )
+            )
+
+        for index, device_id in enumerate(bulk.issue_keys):
+            item_result = DeviceBulkResult(action="issue_key", index=index, status=201)
+            if device_id not in existing:
+                item_result.status = 404
+                item_result.detail = f"Device {device_id} not found"
+            elif device_id in keyed:
+                item_result.status = 409
+                item_result.detail = f"Device {device_id} already has an API key"
+            else:
+                keyed.add(device_id)
+                to_key.append((item_result, device_id))
+            results.append(item_result)
+
+        keys = []
+        for item_result, device_id in to_key:
+            raw_key = generate_api_key()
+            api_key = ApiKey(device_id=device_id, key_hash=hash_api_key(raw_key))
+            keys.append(api_key.model_dump())
+            item_result.api_key_id, item_result.api_key = api_key.id, raw_key
+
+        if created:
+            await self._db.execute(insert(Device), created)
+        if updated:
+            await self._db.execute(update(Device), updated)
+        if keys:
+            await self._db.execute(insert(ApiKey), keys)
+        await self._db.commit()
+
+        if updated:
+            refreshed = await self._db.execute(
+                select(Device)
+                .where(
+                    Device.id.in_([row["id"] for row in updated])  # type: ignore[attr-defined]
+                )
+                .execution_options(populate_existing=True)
+            )
+            devices = {device.id: device for device in refreshed.scalars().all()}
+            for update_item, item_result in zip(
+                bulk.update, (r for r in results if r.action == "update")
+            ):
+                if item_result.status == 200:
+                    get_validators().invalidate(update_item.id)
+                    item_result.device = DeviceRead(
+                        **devices[update_item.id].model_dump()
+                    )
+        logger.info(
+            "Bulk created {} devices, updated {} and issued {} API keys",
+            len(created),
+            len(updated),
+            len(keys),
+        )
+        return results
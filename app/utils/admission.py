@@ -0,0 +1,136 @@
+import asyncio
+from collections import deque
+from typing import Any
+
+from app.utils.config import get_settings
+
+INGEST = "ingest"
+READ = "read"
+ADMIN = "admin"
+
+
+class AdmissionGate:
+    """
+    Concurrency limit with a bounded wait queue for one class of traffic.
+
+    At most `concurrency` requests run at once and at most `queue_depth` wait
+    for a slot. A request arriving to a full queue is shed straight away; one
+    that has waited `deadline` seconds without getting a slot is shed too.
+    Slots are handed to waiters in arrival order.
+    """
+
+    def __init__(self, name: str, concurrency: int, queue_depth: int, deadline: float):
+        self.name = name
+        self.concurrency = concurrency
+        self.queue_depth = queue_depth
+        self.deadline = deadline
+        self.active = 0
+        self.admitted = 0
+        self.shed_queue_full = 0
+        self.shed_deadline = 0
+        self._waiters: deque[asyncio.Future[None]] = deque()
+
+    async def acquire(self) -> bool:
+        """
+        Wait for a slot.
+
+        :return: True if admitted (call release() when done), False if shed.
+        """
+        if self.active < self.concurrency and not self._waiters:
+            self.active += 1
+            self.admitted += 1
+            return True
+        if len(self._waiters) >= self.queue_depth:
+            self.shed_queue_full += 1
+            return False
+
+        waiter: asyncio.Future[None] = asyncio.get_running_loop().create_future()
+        self._waiters.append(waiter)
+        try:
+            async with asyncio.timeout(self.deadline):
+                await waiter
+        except TimeoutError:
+            if not waiter.done() or waiter.cancelled():
+                self._discard(waiter)
+                self.shed_deadline += 1
+                return False
+        except asyncio.CancelledError:
+            # Client went away while queued; pass on a slot we may have been given
+            if waiter.done() and not waiter.cancelled():
+                self.release()
+            self._discard(waiter)
+            raise
+        self.admitted += 1
+        return True
+
+    def release(self) -> None:
+        # Hand the slot straight to the oldest live waiter, if any
+        while self._waiters:
+            waiter = self._waiters.popleft()
+            if not waiter.done():
+                waiter.set_result(None)
+                return
+        self.active -= 1
+
+    def _discard(self, waiter: asyncio.Future[None]) -> None:
+        try:
+            self._waiters.remove(waiter)
+        except ValueError:
+            pass
+
+    def stats(self) -> dict[str, Any]:
+        return {
+            "concurrency": self.concurrency,
+            "queue_depth": self.queue_depth,
+            "active": self.active,
+            "queued": len(self._waiters),
+            "admitted": self.admitted,
+            "shed_queue_full": self.shed_queue_full,
+            "shed_deadline": self.shed_deadline,
+        }
+
+
+def classify(method: str, path: str) -> str | None:
+    """
+    Traffic class of a request, or None for routes that are never limited
+    (health checks, docs, metrics).
+    """
+    if not path.startswith("/api/"):
+        return None
+    if method == "POST" and path.rstrip("/") == "/api/v1/data":
+        return INGEST
+    if method in ("GET", "HEAD"):
+        return READ
+    return ADMIN
+
+
+_gates: dict[str, AdmissionGate] | None = None
+
+
+def get_gates() -> dict[str, AdmissionGate]:
+    global _gates
+    if _gates is None:
+        settings = get_settings()
+        deadline = settings.SHED_QUEUE_DEADLINE
+        _gates = {
+            INGEST: AdmissionGate(
+                INGEST,
+                settings.SHED_INGEST_CONCURRENCY,
+                settings.SHED_INGEST_QUEUE,
+                deadline,
+            ),
+            READ: AdmissionGate(
+                READ, settings.SHED_READ_CONCURRENCY, settings.SHED_READ_QUEUE, deadline
+            ),
+            ADMIN: AdmissionGate(
+                ADMIN,
+                settings.SHED_ADMIN_CONCURRENCY,
+                settings.SHED_ADMIN_QUEUE,
+                deadline,
+            ),
+        }
+    return _gates
+
+
+def admission_stats() -> dict[str, dict[str, Any]]:
+    return {name: gate.stats() for name, gate in get_gates().items()}
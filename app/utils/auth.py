@@ -1,16 +1,20 @@
+import asyncio
 import hashlib
 import secrets
 from typing import Annotated
 from uuid import UUID
 
 from fastapi import Depends, Header, HTTPException, status
+from loguru import logger
+from sqlalchemy.exc import DBAPIError
 from sqlalchemy.ext.asyncio import AsyncSession
 
 from app.exceptions import NotFoundError
 from app.models.api_key import ApiKey
 from app.services.api_key_service import ApiKeyService
-from app.utils.config import settings
+from app.utils.config import get_settings
 from app.utils.database import get_session
+from app.utils.spool import get_key_cache, get_spool
 
 API_KEY_LEN = 40
 
@@ -21,7 +25,7 @@ def get_api_key_service(session: AsyncSession = Depends(get_session)) -> ApiKeyS
 
 def require_admin(x_admin_secret: str | None = Header(None)):
     if not x_admin_secret or not secrets.compare_digest(
-        x_admin_secret, settings.ADMIN_SECRET_KEY.get_secret_value()
+        x_admin_secret, get_settings().ADMIN_SECRET_KEY.get_secret_value()
     ):
         raise HTTPException(
             status_code=status.HTTP_403_FORBIDDEN,
@@ -40,6 +44,7 @@ def hash_api_key(raw: str) -> str:
     :param raw: The raw API key to hash.
     :return: Hex digest of the hashed key.
     """
+    settings = get_settings()
     hashed = hashlib.new(
         settings.HASH_ALGORITHM,
         (settings.HASH_SALT.get_secret_value() + raw).encode("utf-8"),
@@ -57,13 +62,27 @@ async def verify_api_key(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Missing authentication headers",
         )
+    spool = get_spool()
     try:
-        api_key = await api_service.get_api_key(device_id=device_id)
+        if spool is None:
+            api_key = await api_service.get_api_key(device_id=device_id)
+        else:
+            async with asyncio.timeout(get_settings().SPOOL_DB_TIMEOUT):
+                api_key = await api_service.get_api_key(device_id=device_id)
+            get_key_cache().remember(api_key)
     except NotFoundError:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Invalid API key",
         )
+    except (DBAPIError, OSError, TimeoutError) as exc:
+        # With the database down, keys verified before the outage are still
+        # accepted so their readings can be spooled.
+        cached = get_key_cache().get(device_id) if spool is not None else None
+        if cached is None:
+            raise
+        logger.warning("Database unavailable, using cached API key: {}", exc)
+        api_key = cached
 
     if (
         not secrets.compare_digest(hash_api_key(raw_key), api_key.key_hash)
@@ -0,0 +1,105 @@
+"""
+Single-flight coalescing of identical concurrent reads.
+
+When many dashboards ask for the same page at the same moment, the first
+request runs and the others wait for it and get a copy of its response, so
+the database sees one query instead of hundreds. Nothing is kept once the
+request finishes: only work that is already in flight is shared.
+"""
+
+import asyncio
+import hashlib
+from collections.abc import Awaitable, Callable, Hashable
+from typing import Any, TypeVar
+
+from starlette.requests import Request
+
+T = TypeVar("T")
+
+# Headers that can change what a read route answers. X-Read-Primary asks for
+# the primary's newer data, so it must not share a replica read.
+_VARY = ("x-admin-secret", "x-api-key", "x-device-id", "x-read-primary", "accept")
+
+
+class SingleFlight:
+    """In-flight calls by key; concurrent calls with the same key share one result."""
+
+    def __init__(self) -> None:
+        self._flights: dict[Hashable, asyncio.Future[Any]] = {}
+        self.executed = 0
+        self.coalesced = 0
+
+    async def do(self, key: Hashable, fn: Callable[[], Awaitable[T]]) -> T:
+        """
+        Run `fn`, or wait for the call already running under `key`.
+
+        If the caller that is running `fn` is cancelled, e.g. because its
+        client went away, the callers waiting on it run `fn` themselves.
+
+        :return: The result of `fn`; its exception is raised to every caller.
+        """
+        flight = self._flights.get(key)
+        if flight is not None:
+            self.coalesced += 1
+            try:
+                return await asyncio.shield(flight)
+            except asyncio.CancelledError:
+                task = asyncio.current_task()
+                if not flight.cancelled() or (task is not None and task.cancelling()):
+                    raise
+            return await self.do(key, fn)
+
+        flight = asyncio.get_running_loop().create_future()
+        self._flights[key] = flight
+        self.executed += 1
+        try:
+            result = await fn()
+        except asyncio.CancelledError:
+            flight.cancel()
+            raise
+        except BaseException as exc:
+            flight.set_exception(exc)
+            # Mark it retrieved, in case nobody was waiting.
+            flight.exception()
+            raise
+        else:
+            flight.set_result(result)
+            return result
+        finally:
+            if self._flights.get(key) is flight:
+                del self._flights[key]
+
+    def stats(self) -> dict[str, int]:
+        return {
+            "in_flight": len(self._flights),
+            "executed": self.executed,
+            "coalesced": self.coalesced,
+        }
+
+
+def request_key(request: Request) -> tuple[str, ...]:
+    """
+    Key of a read request: method, path, the query with its parameters sorted
+    by name (repeated ones keep their order, which can matter), and a digest
+    of the headers that can change the response.
+    """
+    params = sorted(request.query_params.multi_items(), key=lambda item: item[0])
+    query = "&".join(f"{name}={value}" for name, value in params)
+    headers = hashlib.blake2b(digest_size=16)
+    for name in _VARY:
+        headers.update(request.headers.get(name, "").encode("utf-8") + b"\0")
+    return request.method, request.url.path, query, headers.hexdigest()
+
+
+_single_flight: SingleFlight | None = None
+
+
+def get_single_flight() -> SingleFlight:
+    global _single_flight
+    if _single_flight is None:
+        _single_flight = SingleFlight()
+    return _single_flight
+
+
+def coalesce_stats() -> dict[str, int]:
+    return get_single_flight().stats()
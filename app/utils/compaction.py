@@ -0,0 +1,281 @@
+"""
+Packing of old device readings into hourly `devicedatachunk` rows.
+
+A chunk holds the readings of one device from one hour:
+
+- `ids`: the 16-byte reading UUIDs back to back (random, so left uncompressed)
+- `timestamps`: varints of each `created_date` in microseconds, the first as an
+  offset from `start` and the rest as deltas from the previous reading,
+  followed by zigzag varints of each `updated_date - created_date`
+- `payload`: the `data` dicts as a zlib compressed JSON array
+
+Readings keep their IDs; DataService decodes chunks so `list` and the
+aggregates return them like any other reading. Reading or deleting a single
+compacted reading by ID is not supported, as chunks are not indexed by it.
+
+Usage:
+    uv run python -m app.utils.compaction [--older-than-days 30] [--device ID ...]
+        [--batch-size 5000] [--dry-run]
+"""
+
+import argparse
+import asyncio
+import itertools
+import json
+import uuid
+import zlib
+from collections.abc import Iterable, Sequence
+from datetime import datetime, timedelta, timezone
+from typing import Any
+from uuid import UUID
+
+from sqlalchemy import delete, insert, select, tuple_
+from sqlalchemy.ext.asyncio import AsyncEngine, create_async_engine
+
+from app.models.device import DeviceData, DeviceDataChunk
+from app.utils.config import get_settings
+
+_MICROSECOND = timedelta(microseconds=1)
+_ID_SIZE = 16
+# id, device_id, created_date and updated_date of a row, not counting the
+# storage engine's own per-row header and index entries
+_ROW_OVERHEAD = 16 + 16 + 8 + 8
+_CHUNK_OVERHEAD = _ROW_OVERHEAD + 8 + 4
+
+
+def utc(value: datetime) -> datetime:
+    """SQLite hands back naive datetimes; treat them as UTC."""
+    return value if value.tzinfo is not None else value.replace(tzinfo=timezone.utc)
+
+
+def hour_of(value: datetime) -> datetime:
+    return utc(value).replace(minute=0, second=0, microsecond=0)
+
+
+def _write_varint(out: bytearray, value: int) -> None:
+    while value >= 0x80:
+        out.append((value & 0x7F) | 0x80)
+        value >>= 7
+    out.append(value)
+
+
+def _read_varints(buf: bytes, count: int) -> list[int]:
+    values = []
+    pos = 0
+    for _ in range(count * 2):
+        value = shift = 0
+        while True:
+            byte = buf[pos]
+            pos += 1
+            value |= (byte & 0x7F) << shift
+            if byte < 0x80:
+                break
+            shift += 7
+        values.append(value)
+    return values
+
+
+def encode_chunk(start: datetime, readings: Sequence[Any]) -> dict[str, Any]:
+    """
+    Encode readings of one device and hour as chunk columns.
+
+    :param start: Start of the hour the readings belong to.
+    :param readings: Objects or rows with id, data, created_date and updated_date.
+    :return: count, ids, timestamps and payload column values.
+    """
+    ordered = sorted(readings, key=lambda r: (utc(r.created_date), r.id))
+    ids = b"".join(r.id.bytes for r in ordered)
+    timestamps = bytearray()
+    previous = utc(start)
+    for reading in ordered:
+        created = utc(reading.created_date)
+        _write_varint(timestamps, (created - previous) // _MICROSECOND)
+        previous = created
+    for reading in ordered:
+        offset = (utc(reading.updated_date) - utc(reading.created_date)) // _MICROSECOND
+        _write_varint(timestamps, offset * 2 if offset >= 0 else -offset * 2 - 1)
+    payload = zlib.compress(
+        json.dumps([r.data for r in ordered], separators=(",", ":")).encode("utf-8")
+    )
+    return {
+        "count": len(ordered),
+        "ids": ids,
+        "timestamps": bytes(timestamps),
+        "payload": payload,
+    }
+
+
+def chunk_ids(chunk: DeviceDataChunk) -> list[UUID]:
+    return [UUID(bytes=bytes(raw)) for raw in itertools.batched(chunk.ids, _ID_SIZE)]
+
+
+def decode_chunk(chunk: DeviceDataChunk) -> list[DeviceData]:
+    """Readings stored in a chunk, as transient DeviceData objects."""
+    ids = chunk_ids(chunk)
+    varints = _read_varints(chunk.timestamps, chunk.count)
+    data = json.loads(zlib.decompress(chunk.payload))
+    readings = []
+    created = utc(chunk.start)
+    for i in range(chunk.count):
+        created += varints[i] * _MICROSECOND
+        zigzag = varints[chunk.count + i]
+        offset = zigzag // 2 if zigzag % 2 == 0 else -(zigzag + 1) // 2
+        readings.append(
+            DeviceData(
+                id=ids[i],
+                device_id=chunk.device_id,
+                data=data[i],
+                created_date=created,
+                updated_date=created + offset * _MICROSECOND,
+            )
+        )
+    return readings
+
+
+def row_size(reading: Any) -> int:
+    """Approximate bytes a reading takes as a devicedata row."""
+    return _ROW_OVERHEAD + len(json.dumps(reading.data, separators=(",", ":")))
+
+
+def chunk_size(columns: dict[str, Any]) -> int:
+    """Approximate bytes of a devicedatachunk row built by encode_chunk."""
+    return (
+        _CHUNK_OVERHEAD
+        + len(columns["ids"])
+        + len(columns["timestamps"])
+        + len(columns["payload"])
+    )
+
+
+async def compact(
+    engine: AsyncEngine,
+    older_than: datetime,
+    *,
+    devices: Iterable[UUID] | None = None,
+    batch_size: int = 5000,
+    dry_run: bool = False,
+) -> dict[str, int]:
+    """
+    Pack readings created before `older_than` into hourly chunks, per device.
+    Each batch inserts its chunks and deletes the packed rows in one
+    transaction, so an interrupted run leaves no reading stored twice.
+
+    :param engine: The database holding the readings (the primary or a shard).
+    :param older_than: Only readings created before this time are packed.
+    :param devices: Only these devices; default is every device with old readings.
+    :param batch_size: Readings read per transaction; an hour split across
+        batches ends up in more than one chunk.
+    :param dry_run: Report the savings without writing anything.
+    :return: readings, chunks, bytes_before and bytes_after.
+    """
+    table = DeviceData.__table__  # type: ignore[attr-defined]
+    chunk_table = DeviceDataChunk.__table__  # type: ignore[attr-defined]
+    report = {"readings": 0, "chunks": 0, "bytes_before": 0, "bytes_after": 0}
+
+    if devices is None:
+        async with engine.connect() as conn:
+            result = await conn.execute(
+                select(table.c.device_id)
+                .where(table.c.created_date < older_than)
+                .distinct()
+            )
+            devices = result.scalars().all()
+
+    for device_id in devices:
+        last = None
+        while True:
+            async with engine.begin() as conn:
+                statement = (
+                    select(table)
+                    .where(
+                        table.c.device_id == device_id,
+                        table.c.created_date < older_than,
+                    )
+                    .order_by(table.c.created_date, table.c.id)
+                    .limit(batch_size)
+                )
+                if last is not None:
+                    statement = statement.where(
+                        tuple_(table.c.created_date, table.c.id) > last
+                    )
+                rows = (await conn.execute(statement)).all()
+                if not rows:
+                    break
+                last = (rows[-1].created_date, rows[-1].id)
+
+                hours: dict[datetime, list[Any]] = {}
+                for row in rows:
+                    hours.setdefault(hour_of(row.created_date), []).append(row)
+
+                now = datetime.now(timezone.utc)
+                chunks = []
+                for start, readings in hours.items():
+                    columns = encode_chunk(start, readings)
+                    chunks.append(
+                        {
+                            "id": uuid.uuid4(),
+                            "device_id": device_id,
+                            "start": start,
+                            "created_date": now,
+                            "updated_date": now,
+                            **columns,
+                        }
+                    )
+                    report["bytes_before"] += sum(row_size(r) for r in readings)
+                    report["bytes_after"] += chunk_size(columns)
+                report["readings"] += len(rows)
+                report["chunks"] += len(chunks)
+
+                if not dry_run:
+                    await conn.execute(insert(chunk_table), chunks)
+                    await conn.execute(
+                        delete(table).where(table.c.id.in_([row.id for row in rows]))
+                    )
+    return report
+
+
+async def _main(args: argparse.Namespace) -> None:
+    from app.utils.sharding import get_shard_map
+
+    shard_map = get_shard_map()
+    engines = dict(shard_map.engines)
+    primary = None
+    if not engines:
+        primary = create_async_engine(get_settings().async_database_url)
+        engines = {"(primary)": primary}
+
+    older_than = datetime.now(timezone.utc) - timedelta(days=args.older_than_days)
+    totals = {"readings": 0, "chunks": 0, "bytes_before": 0, "bytes_after": 0}
+    for name, engine in engines.items():
+        report = await compact(
+            engine,
+            older_than,
+            devices=args.device or None,
+            batch_size=args.batch_size,
+            dry_run=args.dry_run,
+        )
+        print(f"  {name}: {report['readings']} readings -> {report['chunks']} chunks")
+        for key, value in report.items():
+            totals[key] += value
+
+    await shard_map.dispose()
+    if primary is not None:
+        await primary.dispose()
+
+    verb = "Would pack" if args.dry_run else "Packed"
+    print(f"\n{verb} {totals['readings']} readings into {totals['chunks']} chunks.")
+    if totals["bytes_before"]:
+        saved = totals["bytes_before"] - totals["bytes_after"]
+        print(
+            f"Estimated size {totals['bytes_before']} -> {totals['bytes_after']} bytes "
+            f"({saved / totals['bytes_before']:.1%} saved)."
+        )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--older-than-days", type=float, default=30)
+    parser.add_argument("--device", type=UUID, action="append")
+    parser.add_argument("--batch-size", type=int, default=5000)
+    parser.add_argument("--dry-run", action="store_true")
+    asyncio.run(_main(parser.parse_args()))
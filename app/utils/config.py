@@ -1,3 +1,6 @@
+from functools import cache
+from typing import Any
+
 from pydantic import AliasChoices, Field, SecretStr
 from pydantic_settings import BaseSettings, SettingsConfigDict
 
@@ -5,13 +8,45 @@ from pydantic_settings import BaseSettings, SettingsConfigDict
 class Settings(BaseSettings):
     ADMIN_SECRET_KEY: SecretStr = Field(description="Admin secret key")
     APP_NAME: str = Field(default="Tom.Camp.Api")
+    CACHE_DIR: str | None = Field(default=None)
+    CACHE_DIR_MAX_BYTES: int = Field(default=1024 * 1024 * 1024, ge=0)
+    CACHE_MAX_AGE: int = Field(default=86_400, ge=0)
+    CACHE_MAX_BYTES: int = Field(default=64 * 1024 * 1024, ge=0)
+    CACHE_SEALED_AFTER: float = Field(default=172_800.0, ge=0.0)
+    COALESCE_READS: bool = True
     CORS_ORIGINS: list[str] = Field(default_factory=list)
+    DATA_SHARDS: dict[str, str] = Field(default_factory=dict)
+    DATABASE_REPLICA_RETRY_SECONDS: float = Field(default=30.0, ge=0.0)
+    DATABASE_REPLICA_URLS: list[str] = Field(default_factory=list)
+    DELETE_BATCH_PAUSE: float = Field(default=0.0, ge=0.0)
+    DELETE_BATCH_SIZE: int = Field(default=5000, ge=1)
+    DELETE_JOB_STALE_AFTER: float = Field(default=900.0, gt=0.0)
     ENVIRONMENT: str | None = None
     HASH_ALGORITHM: str = Field(default="blake2b", description="Hash algorithm")
     HASH_SALT: SecretStr = Field(description="Hash salt")
+    IDEMPOTENCY_EXPIRE_BATCH: int = Field(default=1000, ge=1)
+    IDEMPOTENCY_EXPIRE_INTERVAL: float = Field(default=300.0, gt=0.0)
+    IDEMPOTENCY_WINDOW: float = Field(default=86_400.0, gt=0.0)
+    INGEST_MAX_BODY_BYTES: int = Field(default=65_536, ge=1)
+    INGEST_MAX_DEPTH: int = Field(default=8, ge=1)
+    INGEST_MAX_KEYS: int = Field(default=256, ge=1)
+    LINE_AUTH_TTL: float = Field(default=60.0, ge=0.0)
+    LINE_BATCH_SIZE: int = Field(default=500, ge=1)
+    LINE_FLUSH_INTERVAL: float = Field(default=0.05, gt=0.0)
+    LINE_HOST: str = Field(default="127.0.0.1")
+    LINE_MAX_BYTES: int = Field(default=4096, ge=64)
+    LINE_MAX_SKEW: float = Field(default=86_400.0, gt=0.0)
+    LINE_TCP_PORT: int | None = Field(default=None, ge=0, le=65535)
+    LINE_UDP_PORT: int | None = Field(default=None, ge=0, le=65535)
+    LOG_ACCESS_SAMPLE_RATE: float = Field(default=1.0, ge=0.0, le=1.0)
+    LOG_ASYNC: bool = False
+    LOG_BATCH_SIZE: int = Field(default=256, ge=1)
+    LOG_FLUSH_INTERVAL: float = Field(default=0.5, gt=0.0)
     LOG_LEVEL: str = Field(default="INFO")
     LOG_NAME: str | None = Field(default=None)
     LOG_JSON_FORMAT: bool = False
+    LOG_QUEUE_SIZE: int = Field(default=10_000, ge=1)
+    LOG_ROUTE_LEVELS: dict[str, str] = Field(default_factory=dict)
     POSTGRES_DB: str = Field(description="PostgreSQL database name")
     POSTGRES_HOST: str = Field(description="PostgreSQL host")
     POSTGRES_PASS: SecretStr = Field(
@@ -20,6 +55,26 @@ class Settings(BaseSettings):
     )
     POSTGRES_PORT: int = Field(description="PostgreSQL port")
     POSTGRES_USER: str = Field(description="PostgreSQL user")
+    RATE_LIMIT_BURST: int = Field(default=20, ge=1)
+    RATE_LIMIT_DEVICE_OVERRIDES: dict[str, tuple[float, int]] = Field(
+        default_factory=dict
+    )
+    RATE_LIMIT_PER_SECOND: float = Field(default=5.0, ge=0.0)
+    RATE_LIMIT_STORE: str | None = Field(default=None)
+    SHED_ADMIN_CONCURRENCY: int = Field(default=4, ge=1)
+    SHED_ADMIN_QUEUE: int = Field(default=16, ge=0)
+    SHED_INGEST_CONCURRENCY: int = Field(default=32, ge=1)
+    SHED_INGEST_QUEUE: int = Field(default=256, ge=0)
+    SHED_QUEUE_DEADLINE: float = Field(default=5.0, gt=0.0)
+    SHED_READ_CONCURRENCY: int = Field(default=16, ge=1)
+    SHED_READ_QUEUE: int = Field(default=64, ge=0)
+    SPOOL_DB_TIMEOUT: float = Field(default=2.0, gt=0.0)
+    SPOOL_DIR: str | None = Field(default=None)
+    SPOOL_FSYNC_INTERVAL: float = Field(default=0.01, ge=0.0)
+    SPOOL_REPLAY_BATCH: int = Field(default=500, ge=1)
+    SPOOL_REPLAY_INTERVAL: float = Field(default=1.0, gt=0.0)
+    SPOOL_SEGMENT_BYTES: int = Field(default=16 * 1024 * 1024, ge=1)
+    TIER_DIR: str | None = Field(default=None)
 
     model_config = SettingsConfigDict(
         env_file=".env",
@@ -36,4 +91,15 @@ class Settings(BaseSettings):
         )
 
 
-settings = Settings()
+@cache
+def get_settings() -> Settings:
+    """Build the settings on first use rather than at import time."""
+    return Settings()
+
+
+def __getattr__(name: str) -> Any:
+    # `from app.utils.config import settings` keeps working, but only builds the
+    # Settings object when a module actually asks for it.
+    if name == "settings":
+        return get_settings()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
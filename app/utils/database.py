@@ -1,41 +1,327 @@
-from collections.abc import AsyncGenerator
+import hashlib
+import itertools
+import json
+import time
+from collections.abc import AsyncGenerator, Callable, Sequence
+from typing import Annotated, Any, Literal
 
+from fastapi import Header
+from loguru import logger
+from sqlalchemy import (
+    JSON,
+    Column,
+    Connection,
+    DateTime,
+    MetaData,
+    String,
+    Table,
+    func,
+    insert,
+    select,
+    text,
+)
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.exc import DBAPIError
 from sqlalchemy.ext.asyncio import (
     AsyncEngine,
     AsyncSession,
     async_sessionmaker,
     create_async_engine,
 )
+from sqlalchemy.schema import CreateTable
 from sqlmodel import SQLModel
 
-from app.utils.config import settings
+from app.utils.config import get_settings
 
-DATABASE_URL = settings.async_database_url
+# The engine, session factory and replica pool are built on first use so that
+# importing this module (from the app, migrate.py, alembic or the tests) does
+# not read the settings or load a database driver.
+_engine: AsyncEngine | None = None
+_session_factory: async_sessionmaker[AsyncSession] | None = None
+_replicas: "ReplicaPool | None" = None
 
-engine: AsyncEngine = create_async_engine(
-    DATABASE_URL,
-    echo=settings.ENVIRONMENT == "development",
-    pool_pre_ping=True,
-    pool_recycle=3600,
+# Schemas created by create_tables_once, by hash of their DDL. Kept out of
+# SQLModel.metadata: Alembic manages production databases, which never have it.
+schema_markers = Table(
+    "schemamarker",
+    MetaData(),
+    Column("key", String(64), primary_key=True),
+    Column("created_at", DateTime(timezone=True), server_default=func.now()),
 )
 
-AsyncSessionFactory = async_sessionmaker(
-    engine,
-    class_=AsyncSession,
-    expire_on_commit=False,
-)
+
+def get_engine() -> AsyncEngine:
+    global _engine
+    if _engine is None:
+        settings = get_settings()
+        _engine = create_async_engine(
+            settings.async_database_url,
+            echo=settings.ENVIRONMENT == "development",
+            pool_pre_ping=True,
+            pool_recycle=3600,
+        )
+    return _engine
+
+
+def set_engine(engine: AsyncEngine) -> None:
+    """
+    Use the given engine for the primary database instead of the one built
+    from the settings, e.g. SQLite in tests and tooling.
+
+    :param engine: The engine to use.
+    """
+    global _engine, _session_factory
+    _engine = engine
+    _session_factory = None
+
+
+def get_session_factory() -> async_sessionmaker[AsyncSession]:
+    global _session_factory
+    if _session_factory is None:
+        _session_factory = async_sessionmaker(
+            get_engine(),
+            class_=AsyncSession,
+            expire_on_commit=False,
+        )
+    return _session_factory
+
+
+class ReplicaPool:
+    """
+    Round-robin over read-replica engines. A replica that fails to hand out a
+    connection is skipped for `retry_after` seconds, after which it is tried
+    again on the next read.
+    """
+
+    def __init__(self, engines: Sequence[AsyncEngine], retry_after: float):
+        self.engines = list(engines)
+        self._factories = [
+            async_sessionmaker(e, class_=AsyncSession, expire_on_commit=False)
+            for e in self.engines
+        ]
+        self._retry_after = retry_after
+        self._down_until = [0.0] * len(self.engines)
+        self._next = itertools.count()
+
+    def candidates(self) -> list[int]:
+        """Indexes of replicas currently considered healthy, in round-robin order."""
+        if not self.engines:
+            return []
+        start = next(self._next) % len(self.engines)
+        now = time.monotonic()
+        order = [(start + i) % len(self.engines) for i in range(len(self.engines))]
+        return [i for i in order if self._down_until[i] <= now]
+
+    def session(self, index: int) -> AsyncSession:
+        return self._factories[index]()
+
+    def mark_unhealthy(self, index: int) -> None:
+        self._down_until[index] = time.monotonic() + self._retry_after
+
+
+def get_replicas() -> ReplicaPool:
+    global _replicas
+    if _replicas is None:
+        settings = get_settings()
+        _replicas = ReplicaPool(
+            [
+                create_async_engine(url, pool_pre_ping=True, pool_recycle=3600)
+                for url in settings.DATABASE_REPLICA_URLS
+            ],
+            retry_after=settings.DATABASE_REPLICA_RETRY_SECONDS,
+        )
+    return _replicas
+
+
+def dialect_insert(table: Table, dialect_name: str):
+    """
+    INSERT for the given dialect (PostgreSQL or SQLite), which supports the
+    ON CONFLICT clauses.
+
+    :param table: The table to insert into.
+    :param dialect_name: Name of the dialect the statement will run on.
+    :return: An Insert statement; pass rows to `.values()` or as execute parameters.
+    """
+    dialect = postgresql if dialect_name == "postgresql" else sqlite
+    return dialect.insert(table)
+
+
+def insert_ignoring_conflicts(table: Table, dialect_name: str):
+    """INSERT ... ON CONFLICT DO NOTHING for the given dialect; see dialect_insert."""
+    return dialect_insert(table, dialect_name).on_conflict_do_nothing()
+
+
+async def copy_records(
+    engine: AsyncEngine,
+    table: Table,
+    columns: Sequence[str],
+    records: Sequence[tuple[Any, ...]],
+    on_conflict: Literal["error", "ignore", "update"] = "error",
+) -> None:
+    """
+    Bulk-insert rows in one transaction: with COPY on PostgreSQL, through a
+    temporary table when existing rows are skipped or updated, and with a
+    multi-row INSERT ... ON CONFLICT elsewhere.
+
+    :param engine: The database to load into.
+    :param table: The table to load into.
+    :param columns: Names of the values in each record.
+    :param records: Rows as tuples, JSON columns as JSON text.
+    :param on_conflict: What to do with rows whose primary key exists.
+    """
+    async with engine.connect() as conn:
+        if conn.dialect.name != "postgresql":
+            decode = [isinstance(table.c[name].type, JSON) for name in columns]
+            rows = [
+                {
+                    name: json.loads(value) if is_json else value
+                    for name, value, is_json in zip(columns, record, decode)
+                }
+                for record in records
+            ]
+            statement = dialect_insert(table, conn.dialect.name)
+            if on_conflict == "ignore":
+                statement = statement.on_conflict_do_nothing()
+            elif on_conflict == "update":
+                statement = statement.on_conflict_do_update(
+                    index_elements=list(table.primary_key.columns),
+                    set_={name: statement.excluded[name] for name in columns},
+                )
+            await conn.execute(statement, rows)
+            await conn.commit()
+            return
+
+        driver = (await conn.get_raw_connection()).driver_connection
+        assert driver is not None
+        async with driver.transaction():
+            if on_conflict == "error":
+                await driver.copy_records_to_table(
+                    table.name, records=records, columns=columns
+                )
+                return
+            quote = conn.dialect.identifier_preparer.quote
+            staging = quote(f"copy_{table.name}")
+            # Every identifier below goes through identifier_preparer.quote.
+            await driver.execute(
+                f"CREATE TEMP TABLE IF NOT EXISTS {staging} "  # nosec B608
+                f"(LIKE {quote(table.name)}) ON COMMIT DELETE ROWS"
+            )
+            await driver.copy_records_to_table(
+                f"copy_{table.name}", records=records, columns=columns
+            )
+            names = ", ".join(quote(name) for name in columns)
+            keys = ", ".join(quote(column.name) for column in table.primary_key)
+            action = "NOTHING"
+            if on_conflict == "update":
+                action = "UPDATE SET " + ", ".join(  # nosec B608
+                    f"{quote(name)} = EXCLUDED.{quote(name)}" for name in columns
+                )
+            await driver.execute(
+                f"INSERT INTO {quote(table.name)} ({names}) "  # nosec B608
+                f"SELECT {names} FROM {staging} ON CONFLICT ({keys}) DO {action}"
+            )
 
 
 async def create_db_and_tables() -> None:
-    async with engine.begin() as conn:
+    async with get_engine().begin() as conn:
         await conn.run_sync(SQLModel.metadata.create_all)
 
 
+async def create_tables_once(
+    engine: AsyncEngine,
+    tables: Sequence[Table],
+    create: Callable[[Connection], None],
+) -> bool:
+    """
+    Run `create` against the engine once per schema rather than once per
+    worker. Workers serialise on a lock in the database itself (an advisory
+    lock on PostgreSQL, BEGIN IMMEDIATE on SQLite); the first one runs
+    `create` and records the hash of the DDL of `tables` in the
+    schemamarker table, in the same transaction, so the other workers and
+    restarts skip it. A schema change, or a database that was dropped and
+    recreated, has no matching row and runs it again.
+
+    :param engine: The database to create the tables in.
+    :param tables: Tables whose DDL identifies the schema version.
+    :param create: Synchronous callable receiving a connection, e.g. metadata.create_all.
+    :return: True if `create` ran, False if it had already run.
+    """
+    if engine.url.database in (None, "", ":memory:"):
+        # Nothing is shared between processes for an in-memory database
+        async with engine.begin() as conn:
+            await conn.run_sync(create)
+        return True
+
+    ddl = "\n".join(str(CreateTable(t).compile(dialect=engine.dialect)) for t in tables)
+    digest = hashlib.sha256(ddl.encode("utf-8")).digest()
+    key = digest.hex()[:32]
+
+    async with engine.connect() as conn:
+        if conn.dialect.name == "postgresql":
+            await conn.execute(
+                text("SELECT pg_advisory_xact_lock(:id)"),
+                {"id": int.from_bytes(digest[:8], "big", signed=True)},
+            )
+        elif conn.dialect.name == "sqlite":
+            await conn.exec_driver_sql("BEGIN IMMEDIATE")
+        await conn.run_sync(schema_markers.create, checkfirst=True)
+        created = await conn.scalar(
+            select(schema_markers.c.key).where(schema_markers.c.key == key)
+        )
+        if created is not None:
+            await conn.rollback()
+            return False
+        await conn.run_sync(create)
+        await conn.execute(insert(schema_markers).values(key=key))
+        await conn.commit()
+        return True
+
+
+async def ensure_db_and_tables() -> bool:
+    """Create the primary database tables once per deployment; see create_tables_once."""
+    return await create_tables_once(
+        get_engine(), SQLModel.metadata.sorted_tables, SQLModel.metadata.create_all
+    )
+
+
 async def dispose_engine() -> None:
     """Dispose of the engine and close all connections."""
-    await engine.dispose()
+    if _engine is not None:
+        await _engine.dispose()
+    if _replicas is not None:
+        for replica_engine in _replicas.engines:
+            await replica_engine.dispose()
 
 
 async def get_session() -> AsyncGenerator[AsyncSession, None]:
-    async with AsyncSessionFactory() as session:
+    async with get_session_factory()() as session:
+        yield session
+
+
+async def get_read_session(
+    read_primary: Annotated[bool, Header(alias="X-Read-Primary")] = False,
+) -> AsyncGenerator[AsyncSession, None]:
+    """
+    Session for read-only routes. Uses a healthy replica when any are
+    configured, otherwise the primary. Clients that need to read their own
+    writes immediately can send `X-Read-Primary: true` to bypass replicas.
+    """
+    if not read_primary:
+        replicas = get_replicas()
+        for index in replicas.candidates():
+            session = replicas.session(index)
+            try:
+                await session.connection()
+            except (DBAPIError, OSError) as exc:
+                logger.warning("Read replica {} unavailable: {}", index, exc)
+                replicas.mark_unhealthy(index)
+                await session.close()
+                continue
+            try:
+                yield session
+            finally:
+                await session.close()
+            return
+
+    async with get_session_factory()() as session:
         yield session
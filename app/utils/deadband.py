@@ -0,0 +1,113 @@
+import math
+from collections import OrderedDict
+from datetime import datetime
+from typing import Any
+from uuid import UUID
+
+from app.schemas.device_schema import DeadbandConfig
+
+
+def deadband_config(notes: dict[str, Any] | None) -> DeadbandConfig | None:
+    """The device's deadband settings, or None when it stores every reading."""
+    if not notes or "deadband" not in notes:
+        return None
+    return DeadbandConfig.model_validate(notes["deadband"])
+
+
+def _within(new: Any, old: Any, tolerance: float | None) -> bool:
+    numeric = (int, float)
+    if (
+        tolerance is not None
+        and isinstance(new, numeric)
+        and isinstance(old, numeric)
+        and not isinstance(new, bool)
+        and not isinstance(old, bool)
+    ):
+        return math.isfinite(new) and abs(new - old) <= tolerance
+    return type(new) is type(old) and new == old
+
+
+class DeadbandFilter:
+    """
+    The last stored reading of each deadband device, held by this worker only.
+    With several workers each one decides on its own, so a device may get up
+    to one extra stored reading per worker; no query is needed either way.
+    """
+
+    def __init__(self, max_devices: int = 100_000):
+        self._last: OrderedDict[UUID, tuple[UUID, dict[str, Any], float]] = (
+            OrderedDict()
+        )
+        self._configs: OrderedDict[UUID, tuple[datetime, DeadbandConfig | None]] = (
+            OrderedDict()
+        )
+        self._max_devices = max_devices
+
+    def config(
+        self, device_id: UUID, revision: datetime, notes: dict[str, Any] | None
+    ) -> DeadbandConfig | None:
+        """
+        The device's deadband settings, parsed once per revision like the
+        validators of ValidatorCache.
+
+        :param device_id: The ID of the device.
+        :param revision: The device's `updated_date`.
+        :param notes: The device's notes.
+        :return: None when the device stores every reading.
+        """
+        cached = self._configs.get(device_id)
+        if cached is not None and cached[0] == revision:
+            self._configs.move_to_end(device_id)
+            return cached[1]
+        config = deadband_config(notes)
+        self._configs[device_id] = (revision, config)
+        self._configs.move_to_end(device_id)
+        if len(self._configs) > self._max_devices:
+            self._configs.popitem(last=False)
+        return config
+
+    def unchanged(
+        self,
+        device_id: UUID,
+        data: dict[str, Any],
+        config: DeadbandConfig,
+        now: float,
+    ) -> UUID | None:
+        """
+        Check a reading against the last one stored for the device.
+
+        :param device_id: The ID of the device.
+        :param data: The incoming reading.
+        :param config: The device's deadband settings.
+        :param now: Current time.monotonic().
+        :return: The ID of the last stored reading if this one can be skipped, else None.
+        """
+        last = self._last.get(device_id)
+        if last is None:
+            return None
+        self._last.move_to_end(device_id)
+        data_id, stored, stored_at = last
+        if now - stored_at >= config.heartbeat_seconds or data.keys() != stored.keys():
+            return None
+        for key, value in data.items():
+            if not _within(value, stored[key], config.tolerance.get(key)):
+                return None
+        return data_id
+
+    def remember(
+        self, device_id: UUID, data_id: UUID, data: dict[str, Any], now: float
+    ) -> None:
+        self._last.pop(device_id, None)
+        self._last[device_id] = (data_id, data, now)
+        if len(self._last) > self._max_devices:
+            self._last.popitem(last=False)
+
+
+_deadband: DeadbandFilter | None = None
+
+
+def get_deadband() -> DeadbandFilter:
+    global _deadband
+    if _deadband is None:
+        _deadband = DeadbandFilter()
+    return _deadband
@@ -0,0 +1,109 @@
+"""
+Deduplication of ingest retries by `Idempotency-Key`.
+
+A device that retries `POST /api/v1/data/` after a timeout can send the same
+`Idempotency-Key` header with every attempt. The first attempt claims the key
+for the device in `idempotencykey`, in the same transaction that stores the
+reading; a later attempt finds the key taken and gets the original reading's
+ID back without writing anything. Keys are remembered for
+`IDEMPOTENCY_WINDOW` seconds: a claim takes over an expired key in place, and
+a task in every worker deletes expired keys in batches through the index on
+`created_date`, so the table stays the size of one window.
+"""
+
+import asyncio
+from datetime import datetime, timedelta, timezone
+from uuid import UUID, uuid4
+
+from loguru import logger
+from sqlalchemy import delete
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlmodel import select
+
+from app.models.device import IdempotencyKey
+from app.utils.database import dialect_insert, get_session_factory
+
+
+async def claim(
+    db: AsyncSession, device_id: UUID, key: str, data_id: UUID, window: float
+) -> UUID | None:
+    """
+    Claim an idempotency key of a device for a reading, unless it was claimed
+    within the last `window` seconds. The claim commits with `db`; a
+    concurrent claim of the same key waits for it on PostgreSQL.
+
+    :param db: Session on the primary database.
+    :param device_id: The device sending the reading.
+    :param key: The `Idempotency-Key` header.
+    :param data_id: The ID the new reading will get.
+    :param window: Seconds a claimed key is remembered.
+    :return: None when claimed, otherwise the ID of the reading that claimed it.
+    """
+    now = datetime.now(timezone.utc)
+    table = IdempotencyKey.__table__  # type: ignore[attr-defined]
+    statement = dialect_insert(table, db.get_bind().dialect.name).values(
+        id=uuid4(),
+        device_id=device_id,
+        key=key,
+        data_id=data_id,
+        created_date=now,
+        updated_date=now,
+    )
+    statement = statement.on_conflict_do_update(
+        index_elements=[table.c.device_id, table.c.key],
+        set_={
+            "data_id": statement.excluded.data_id,
+            "created_date": statement.excluded.created_date,
+            "updated_date": statement.excluded.updated_date,
+        },
+        where=table.c.created_date < now - timedelta(seconds=window),
+    ).returning(table.c.data_id)
+    result = await db.execute(statement)
+    if result.scalar_one_or_none() is not None:
+        return None
+    result = await db.execute(
+        select(IdempotencyKey.data_id).where(
+            IdempotencyKey.device_id == device_id, IdempotencyKey.key == key
+        )
+    )
+    return result.scalar_one()
+
+
+async def expire(db: AsyncSession, window: float, batch_size: int) -> int:
+    """
+    Delete keys claimed more than `window` seconds ago, `batch_size` rows per
+    transaction so the sweep never holds many locks at once.
+
+    :return: The number of keys deleted.
+    """
+    before = datetime.now(timezone.utc) - timedelta(seconds=window)
+    deleted = 0
+    while True:
+        expired = (
+            select(IdempotencyKey.id)
+            .where(IdempotencyKey.created_date < before)
+            .limit(batch_size)
+        )
+        result = await db.execute(
+            delete(IdempotencyKey).where(
+                IdempotencyKey.id.in_(expired.scalar_subquery())  # type: ignore[attr-defined]
+            )
+        )
+        await db.commit()
+        count: int = result.rowcount  # type: ignore[attr-defined]
+        deleted += count
+        if count < batch_size:
+            return deleted
+
+
+async def run_expirer(window: float, interval: float, batch_size: int) -> None:
+    """Delete expired keys every `interval` seconds until cancelled."""
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            async with get_session_factory()() as db:
+                deleted = await expire(db, window, batch_size)
+            if deleted:
+                logger.debug("Expired {} idempotency keys", deleted)
+        except Exception as exc:
+            logger.warning("Expiring idempotency keys failed, retrying: {}", exc)
@@ -0,0 +1,497 @@
+"""
+Line protocol ingest over TCP and UDP, for devices that cannot afford HTTPS
+and a JSON body per reading.
+
+One reading per line:
+
+    <device id> <api key> <timestamp> <field>=<value>[,<field>=<value>...]
+
+- timestamp: Unix seconds with an optional fraction, or `-` for the time the
+  line arrives
+- value: an integer, a float, `true`, `false` or a double-quoted JSON string
+
+For example:
+
+    3f1c0a6e-5b1d-4c8e-9a57-2d0b6c1e42aa Zq3v...9w 1760860800.5 temperature=21.5,door=false,mode="eco"
+
+Over TCP each line is answered, in order, with `ok <reading id>`,
+`skipped <id of the last stored reading>` or `error <reason>` once the reading
+is stored; lines may be sent without waiting for the answers. Over UDP nothing
+is answered. Keys are checked like `X-API-Key`, and the device's rate limit,
+payload schema and deadband apply as for `POST /api/v1/data/`. Readings are
+written in batches through DataService.store_many.
+"""
+
+import asyncio
+import json
+import math
+import re
+import secrets
+import time
+from collections import OrderedDict
+from collections.abc import Awaitable, Callable, Sequence
+from datetime import datetime, timedelta, timezone
+from typing import Any
+from uuid import UUID
+
+from loguru import logger
+from sqlalchemy import update
+from sqlalchemy.exc import DBAPIError
+
+from app.exceptions import InvalidDataError, NotFoundError
+from app.models.api_key import ApiKey
+from app.models.device import DeviceData
+from app.services.api_key_service import ApiKeyService
+from app.services.data_service import DataService
+from app.utils.auth import hash_api_key
+from app.utils.config import get_settings
+from app.utils.database import get_session_factory
+from app.utils.deadband import get_deadband
+from app.utils.rate_limit import get_rate_limiter
+from app.utils.spool import get_spool
+from app.utils.validation import PayloadValidator, get_validators
+
+# Lines of one TCP connection being handled at once
+_TCP_PIPELINE = 256
+_FIELD = re.compile(r'([A-Za-z_][\w.-]*)=("(?:[^"\\]|\\.)*"|[^,"]+)(,|$)')
+
+
+class LineError(ValueError):
+    pass
+
+
+def _value(raw: str) -> Any:
+    if raw.startswith('"'):
+        return json.loads(raw)
+    if raw in ("true", "false"):
+        return raw == "true"
+    try:
+        return int(raw)
+    except ValueError:
+        pass
+    try:
+        value = float(raw)
+    except ValueError:
+        raise LineError(f"invalid value {raw!r}") from None
+    if not math.isfinite(value):
+        raise LineError(f"invalid value {raw!r}")
+    return value
+
+
+def parse_line(line: str, now: datetime) -> tuple[UUID, str, datetime, dict[str, Any]]:
+    """
+    Parse one line of the protocol.
+
+    :param line: The line without its line ending.
+    :param now: The timestamp of a line sent with `-`.
+    :return: (device ID, raw API key, timestamp, fields)
+    :raises LineError: If the line is malformed.
+    """
+    parts = line.split(" ", 3)
+    if len(parts) != 4:
+        raise LineError("expected <device id> <api key> <timestamp> <fields>")
+    raw_device_id, raw_key, raw_timestamp, raw_fields = parts
+    try:
+        device_id = UUID(raw_device_id)
+    except ValueError:
+        raise LineError("invalid device id") from None
+    if raw_timestamp == "-":
+        timestamp = now
+    else:
+        try:
+            timestamp = datetime.fromtimestamp(float(raw_timestamp), timezone.utc)
+        except (ValueError, OverflowError, OSError):
+            raise LineError("invalid timestamp") from None
+
+    fields: dict[str, Any] = {}
+    pos = 0
+    while pos < len(raw_fields):
+        match = _FIELD.match(raw_fields, pos)
+        if match is None:
+            raise LineError(f"invalid field at position {pos}")
+        key, raw, separator = match.groups()
+        fields[key] = _value(raw)
+        pos = match.end()
+        if separator and pos == len(raw_fields):
+            raise LineError("trailing comma")
+    if not fields:
+        raise LineError("no fields")
+    return device_id, raw_key, timestamp, fields
+
+
+class KeyLookup:
+    """
+    API keys, with their devices, by device ID. Each is read from the
+    database at most once per `ttl` seconds, by one query however many lines
+    are waiting for it, so a revoked key keeps working for up to `ttl` seconds
+    on this protocol.
+    """
+
+    def __init__(self, ttl: float, max_keys: int = 100_000):
+        self._keys: OrderedDict[UUID, tuple[float, ApiKey | None]] = OrderedDict()
+        self._loading: dict[UUID, asyncio.Task[ApiKey | None]] = {}
+        self._ttl = ttl
+        self._max_keys = max_keys
+
+    async def _load(self, device_id: UUID) -> ApiKey | None:
+        async with get_session_factory()() as session:
+            try:
+                return await ApiKeyService(session).get_api_key(device_id)
+            except NotFoundError:
+                return None
+
+    async def verify(self, device_id: UUID, key_hash: str) -> ApiKey | None:
+        """
+        :param device_id: The device the key claims to belong to.
+        :param key_hash: The key hashed with hash_api_key.
+        :return: The API key if it matches and is not revoked, else None.
+        """
+        now = time.monotonic()
+        cached = self._keys.get(device_id)
+        if cached is None or now - cached[0] > self._ttl:
+            loading = self._loading.get(device_id)
+            if loading is None:
+                loading = asyncio.create_task(self._load(device_id))
+                self._loading[device_id] = loading
+                loading.add_done_callback(lambda _: self._loading.pop(device_id))
+            cached = (now, await asyncio.shield(loading))
+            self._keys[device_id] = cached
+            if len(self._keys) > self._max_keys:
+                self._keys.popitem(last=False)
+        self._keys.move_to_end(device_id)
+
+        api_key = cached[1]
+        if (
+            api_key is None
+            or api_key.revoked
+            or not secrets.compare_digest(key_hash, api_key.key_hash)
+        ):
+            return None
+        return api_key
+
+
+# A reading waiting in a batch, its device's validator and its waiter.
+_Pending = tuple[DeviceData, PayloadValidator | None, asyncio.Future[None]]
+
+
+class BatchWriter:
+    """
+    Collects readings and stores them every `interval` seconds, or as soon as
+    `batch_size` are waiting. With a spool configured, a batch the database
+    cannot take is spooled instead.
+    """
+
+    def __init__(
+        self,
+        store: Callable[[Sequence[DeviceData]], Awaitable[Any]],
+        batch_size: int,
+        interval: float,
+    ):
+        self._store = store
+        self._batch_size = batch_size
+        self._interval = interval
+        self._pending: list[_Pending] = []
+        self._full = asyncio.Event()
+        self._task: asyncio.Task[None] | None = None
+        self._stopping = False
+
+    def start(self) -> None:
+        self._stopping = False
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        """Store what is waiting and stop."""
+        if self._task is not None:
+            self._stopping = True
+            self._full.set()
+            await self._task
+            self._task = None
+        await self.flush()
+
+    async def submit(
+        self, reading: DeviceData, validator: PayloadValidator | None = None
+    ) -> None:
+        """
+        Return once the reading is stored (or spooled).
+
+        :param validator: The device's payload validator; readings of a
+            device are validated together when their batch is flushed.
+        :raises InvalidDataError: When the reading does not match it.
+        """
+        waiter = asyncio.get_running_loop().create_future()
+        self._pending.append((reading, validator, waiter))
+        if len(self._pending) >= self._batch_size:
+            self._full.set()
+        await waiter
+
+    async def _run(self) -> None:
+        while not self._stopping:
+            try:
+                await asyncio.wait_for(self._full.wait(), self._interval)
+            except TimeoutError:
+                pass
+            self._full.clear()
+            await self.flush()
+
+    def _validate(self, batch: list[_Pending]) -> list[_Pending]:
+        """Reject the invalid readings of a batch, one call per device."""
+        valid = []
+        devices: dict[PayloadValidator, list[_Pending]] = {}
+        for entry in batch:
+            if entry[1] is None:
+                valid.append(entry)
+            else:
+                devices.setdefault(entry[1], []).append(entry)
+        for validator, entries in devices.items():
+            rejected = validator.validate_many(
+                [reading.data for reading, _, _ in entries]
+            )
+            for index, error in rejected.items():
+                entries[index][2].set_exception(error)
+            valid.extend(e for i, e in enumerate(entries) if i not in rejected)
+        return valid
+
+    async def flush(self) -> None:
+        batch, self._pending = self._pending, []
+        batch = self._validate(batch)
+        if not batch:
+            return
+        readings = [reading for reading, _, _ in batch]
+        try:
+            await self._store(readings)
+        except Exception as exc:
+            spool = get_spool()
+            try:
+                if spool is None or not isinstance(exc, (DBAPIError, OSError)):
+                    raise
+                logger.warning("Database unavailable, spooling line readings: {}", exc)
+                await asyncio.gather(*(spool.append(r) for r in readings))
+            except Exception as failure:
+                logger.error("Storing {} line readings failed: {}", len(batch), failure)
+                for _, _, waiter in batch:
+                    if not waiter.done():
+                        waiter.set_exception(failure)
+                return
+        for _, _, waiter in batch:
+            if not waiter.done():
+                waiter.set_result(None)
+
+
+async def store_lines(readings: Sequence[DeviceData]) -> None:
+    """Store a batch with its own session and mark the devices' keys as used."""
+    async with get_session_factory()() as session:
+        service = DataService(session=session)
+        try:
+            await service.store_many(readings)
+        finally:
+            await service.close()
+        await session.execute(
+            update(ApiKey)
+            .where(ApiKey.device_id.in_({r.device_id for r in readings}))  # type: ignore[attr-defined]
+            .values(last_used_at=datetime.now(timezone.utc))
+        )
+        await session.commit()
+
+
+class _UDPProtocol(asyncio.DatagramProtocol):
+    def __init__(self, server: "LineProtocolServer"):
+        self._server = server
+
+    def datagram_received(self, data: bytes, addr: tuple[str, int]) -> None:
+        for line in data.splitlines():
+            if line.strip():
+                self._server.spawn(line)
+
+
+class LineProtocolServer:
+    """The TCP and UDP listeners of one worker, sharing a batch writer."""
+
+    def __init__(
+        self,
+        writer: BatchWriter,
+        keys: KeyLookup,
+        max_line_bytes: int,
+        max_skew: float,
+    ):
+        self._writer = writer
+        self._keys = keys
+        self._max_line_bytes = max_line_bytes
+        self._max_skew = timedelta(seconds=max_skew)
+        self._max_in_flight = 10_000
+        self._tcp: asyncio.Server | None = None
+        self._udp: asyncio.DatagramTransport | None = None
+        self._in_flight: set[asyncio.Task[str]] = set()
+        self.counters = {"lines": 0, "stored": 0, "skipped": 0, "errors": 0}
+
+    async def start(
+        self, host: str, tcp_port: int | None, udp_port: int | None
+    ) -> None:
+        """Listen on the given ports; several workers can share them."""
+        self._writer.start()
+        if tcp_port is not None:
+            self._tcp = await asyncio.start_server(
+                self._serve_tcp,
+                host,
+                tcp_port,
+                limit=self._max_line_bytes,
+                reuse_port=True,
+            )
+        if udp_port is not None:
+            self._udp, _ = await asyncio.get_running_loop().create_datagram_endpoint(
+                lambda: _UDPProtocol(self),
+                local_addr=(host, udp_port),
+                reuse_port=True,
+            )
+        logger.info("Line protocol listening on tcp {} / udp {}", tcp_port, udp_port)
+
+    async def stop(self) -> None:
+        if self._tcp is not None:
+            self._tcp.close()
+            self._tcp.close_clients()
+        if self._udp is not None:
+            self._udp.close()
+        await self._writer.stop()
+        if self._in_flight:
+            await asyncio.wait(self._in_flight)
+
+    def sockets(self) -> dict[str, tuple[Any, ...]]:
+        """Bound addresses, e.g. to find the ports picked for port 0."""
+        addresses = {}
+        if self._tcp is not None:
+            addresses["tcp"] = self._tcp.sockets[0].getsockname()
+        if self._udp is not None:
+            addresses["udp"] = self._udp.get_extra_info("sockname")
+        return addresses
+
+    def spawn(self, line: bytes) -> asyncio.Task[str] | None:
+        """Handle a line in the background; None when too many are in flight."""
+        if len(self._in_flight) >= self._max_in_flight:
+            self.counters["errors"] += 1
+            return None
+        task = asyncio.create_task(self.handle(line))
+        self._in_flight.add(task)
+        task.add_done_callback(self._in_flight.discard)
+        return task
+
+    async def handle(self, line: bytes) -> str:
+        """
+        Authenticate, check and store one line.
+
+        :return: The answer to send back, without a line ending.
+        """
+        self.counters["lines"] += 1
+        answer = await self._handle(line)
+        kind = answer.split(" ", 1)[0]
+        self.counters[{"ok": "stored", "skipped": "skipped"}.get(kind, "errors")] += 1
+        return answer
+
+    async def _handle(self, line: bytes) -> str:
+        now = datetime.now(timezone.utc)
+        try:
+            device_id, raw_key, created, data = parse_line(
+                line.decode("utf-8").strip(), now
+            )
+        except (LineError, UnicodeDecodeError) as exc:
+            return f"error {exc}"
+        if abs(created - now) > self._max_skew:
+            return "error timestamp out of range"
+
+        key_hash = hash_api_key(raw_key)
+        retry_after = await get_rate_limiter().check(key_hash, str(device_id))
+        if retry_after > 0:
+            return "error rate limit exceeded"
+        try:
+            api_key = await self._keys.verify(device_id, key_hash)
+        except (DBAPIError, OSError) as exc:
+            logger.warning("API key lookup failed: {}", exc)
+            return "error database unavailable"
+        if api_key is None:
+            return "error invalid api key"
+
+        device = api_key.device
+        validator = get_validators().get(device.id, device.updated_date, device.notes)
+        deadband = get_deadband().config(device.id, device.updated_date, device.notes)
+        monotonic = time.monotonic()
+        if deadband is not None:
+            last_id = get_deadband().unchanged(device_id, data, deadband, monotonic)
+            if last_id is not None:
+                return f"skipped {last_id}"
+
+        reading = DeviceData(
+            device_id=device_id, data=data, created_date=created, updated_date=created
+        )
+        try:
+            await self._writer.submit(reading, validator)
+        except InvalidDataError as exc:
+            first = exc.detail[0]
+            location = ".".join(str(part) for part in first["loc"])
+            return f"error invalid data: {location}: {first['msg']}"
+        except Exception:
+            return "error storage unavailable"
+        if deadband is not None:
+            get_deadband().remember(device_id, reading.id, data, monotonic)
+        return f"ok {reading.id}"
+
+    async def _serve_tcp(
+        self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter
+    ) -> None:
+        # Lines are handled concurrently so they can share a batch; answers
+        # are written in the order the lines came in.
+        answers: asyncio.Queue[asyncio.Task[str] | None] = asyncio.Queue(
+            maxsize=_TCP_PIPELINE
+        )
+
+        async def respond() -> None:
+            while (task := await answers.get()) is not None:
+                writer.write((await task).encode("utf-8") + b"\n")
+                await writer.drain()
+
+        responder = asyncio.create_task(respond())
+        try:
+            while True:
+                try:
+                    line = await reader.readline()
+                except ValueError:
+                    writer.write(b"error line too long\n")
+                    break
+                if not line:
+                    break
+                if line.strip():
+                    await answers.put(asyncio.create_task(self.handle(line)))
+            await answers.put(None)
+            await responder
+        except ConnectionError:
+            responder.cancel()
+        finally:
+            writer.close()
+            try:
+                await writer.wait_closed()
+            except ConnectionError:
+                pass
+
+
+_line_server: LineProtocolServer | None = None
+
+
+def get_line_server() -> LineProtocolServer | None:
+    """The listener configured by `LINE_*`, or None when no port is set."""
+    global _line_server
+    if _line_server is None:
+        settings = get_settings()
+        if settings.LINE_TCP_PORT is not None or settings.LINE_UDP_PORT is not None:
+            _line_server = LineProtocolServer(
+                BatchWriter(
+                    store_lines,
+                    batch_size=settings.LINE_BATCH_SIZE,
+                    interval=settings.LINE_FLUSH_INTERVAL,
+                ),
+                KeyLookup(ttl=settings.LINE_AUTH_TTL),
+                max_line_bytes=settings.LINE_MAX_BYTES,
+                max_skew=settings.LINE_MAX_SKEW,
+            )
+    return _line_server
+
+
+def line_protocol_stats() -> dict[str, int] | None:
+    """Line counters, or None when the listener is off."""
+    return _line_server.counters if _line_server is not None else None
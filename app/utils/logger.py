@@ -1,7 +1,11 @@
 import logging
+import queue
+import random
 import sys
-from collections.abc import Iterator
+import threading
+from collections.abc import Iterator, Mapping
 from contextlib import contextmanager
+from typing import Any, TextIO
 
 from loguru import logger
 
@@ -30,11 +34,172 @@ class _InterceptHandler(logging.Handler):
         )
 
 
+# ---------------------------------------------------------------------------
+# Non-blocking, batched stdout sink
+# ---------------------------------------------------------------------------
+# A plain stdout sink performs a blocking write for every record, on the event
+# loop thread. In async mode records are formatted by Loguru as usual, pushed
+# onto a bounded queue and written in batches by a background thread. When the
+# queue is full the record is dropped rather than blocking the request, and the
+# drop count is written to the stream on the writer's next pass.
+
+_STOP = object()
+
+
+class _BatchingSink:
+    def __init__(
+        self,
+        stream: TextIO,
+        *,
+        queue_size: int,
+        batch_size: int,
+        flush_interval: float,
+    ) -> None:
+        self._stream = stream
+        self._queue: queue.Queue[Any] = queue.Queue(maxsize=queue_size)
+        self._batch_size = batch_size
+        self._flush_interval = flush_interval
+        self._dropped = 0
+        self._reported = 0
+        self._written = 0
+        self._thread = threading.Thread(
+            target=self._run, name="log-writer", daemon=True
+        )
+        self._thread.start()
+
+    def write(self, message: str) -> None:
+        # Loguru serialises calls to a sink, so the counter needs no lock.
+        try:
+            self._queue.put_nowait(message)
+        except queue.Full:
+            self._dropped += 1
+
+    def stop(self) -> None:
+        """Flush everything still queued and stop the writer thread."""
+        self._queue.put(_STOP)
+        self._thread.join()
+
+    def stats(self) -> dict[str, int]:
+        return {
+            "queued": self._queue.qsize(),
+            "written": self._written,
+            "dropped": self._dropped,
+        }
+
+    def _run(self) -> None:
+        stopping = False
+        while not stopping:
+            batch: list[str] = []
+            try:
+                item = self._queue.get(timeout=self._flush_interval)
+                while True:
+                    if item is _STOP:
+                        stopping = True
+                        break
+                    batch.append(item)
+                    if len(batch) >= self._batch_size:
+                        break
+                    item = self._queue.get_nowait()
+            except queue.Empty:
+                pass
+            self._write_batch(batch)
+
+    def _write_batch(self, batch: list[str]) -> None:
+        dropped = self._dropped
+        if dropped != self._reported:
+            batch.append(
+                f"log queue overflow: dropped {dropped - self._reported} messages "
+                f"({dropped} total)\n"
+            )
+            self._reported = dropped
+        if not batch:
+            return
+        try:
+            self._stream.write("".join(batch))
+            self._stream.flush()
+        except (OSError, ValueError):
+            return
+        self._written += len(batch)
+
+
+_async_sink: _BatchingSink | None = None
+_applied_config: tuple[Any, ...] | None = None
+
+
+def log_queue_stats() -> dict[str, int] | None:
+    """
+    Counters for the async stdout sink, or None when logging synchronously.
+    """
+    return _async_sink.stats() if _async_sink is not None else None
+
+
+# ---------------------------------------------------------------------------
+# Per-route levels and access log sampling
+# ---------------------------------------------------------------------------
+# RequestLoggingMiddleware contextualises every record with the request path
+# and binds access=True on the access log line. Routes can override the
+# minimum level by path prefix (longest prefix wins), and successful access
+# logs can be sampled. Warnings and errors are never sampled out.
+
+
+class _RecordFilter:
+    def __init__(
+        self,
+        level: str,
+        route_levels: Mapping[str, str],
+        access_sample_rate: float,
+    ) -> None:
+        self._default = logger.level(level.upper()).no
+        self._routes = sorted(
+            (
+                (prefix, logger.level(route_level.upper()).no)
+                for prefix, route_level in route_levels.items()
+            ),
+            key=lambda item: len(item[0]),
+            reverse=True,
+        )
+        self._sample_rate = access_sample_rate
+        self._warning = logger.level("WARNING").no
+
+    @property
+    def min_level(self) -> int:
+        return min([self._default, *(no for _, no in self._routes)])
+
+    def __call__(self, record: Any) -> bool:
+        level = record["level"].no
+        extra = record["extra"]
+
+        minimum = self._default
+        path = extra.get("path")
+        if path is not None:
+            for prefix, route_level in self._routes:
+                if path.startswith(prefix):
+                    minimum = route_level
+                    break
+        if level < minimum:
+            return False
+
+        if (
+            self._sample_rate < 1.0
+            and level < self._warning
+            and extra.get("access")
+            and extra.get("status", 0) < 400
+        ):
+            return random.random() < self._sample_rate  # nosec B311
+        return True
+
+
 def setup_logging(
     *,
     level: str = "INFO",
     json: bool = False,
     log_file: str | None = None,
+    async_sink: bool = False,
+    queue_size: int = 10_000,
+    batch_size: int = 256,
+    flush_interval: float = 0.5,
+    access_sample_rate: float = 1.0,
+    route_levels: Mapping[str, str] | None = None,
 ) -> None:
     """
     Configure Loguru as the single logging backend for the entire application.
@@ -42,13 +207,54 @@ def setup_logging(
     :param level:    Minimum log level ("DEBUG", "INFO", "WARNING", …).
     :param json:     Emit structured JSON lines instead of pretty text (set True in prod).
     :param log_file: Optional path for a rotating file sink alongside stdout.
+    :param async_sink: Write stdout through a bounded queue and a background writer thread.
+    :param queue_size: Maximum records waiting in the async queue before dropping.
+    :param batch_size: Maximum records written to stdout per batch in async mode.
+    :param flush_interval: Seconds the async writer waits for more records before flushing.
+    :param access_sample_rate: Fraction of successful access logs to keep (0.0–1.0).
+    :param route_levels: Minimum level per request path prefix, e.g. {"/health": "WARNING"}.
+
+    Calling it again with the same arguments is a no-op, so every worker and
+    test client can call it on startup without rebuilding the sinks.
     """
+    global _async_sink, _applied_config
+
+    config = (
+        level,
+        json,
+        log_file,
+        async_sink,
+        queue_size,
+        batch_size,
+        flush_interval,
+        access_sample_rate,
+        tuple(sorted((route_levels or {}).items())),
+    )
+    if config == _applied_config:
+        return
+    _applied_config = config
+
     logger.remove()
+    _async_sink = None
+
+    record_filter = _RecordFilter(level, route_levels or {}, access_sample_rate)
+    sink_level = record_filter.min_level
+
+    stdout: Any = sys.stdout
+    if async_sink:
+        _async_sink = _BatchingSink(
+            sys.stdout,
+            queue_size=queue_size,
+            batch_size=batch_size,
+            flush_interval=flush_interval,
+        )
+        stdout = _async_sink
 
     if json:
         logger.add(
-            sys.stdout,
-            level=level,
+            stdout,
+            level=sink_level,
+            filter=record_filter,
             serialize=True,
             backtrace=False,
             diagnose=False,
@@ -61,9 +267,10 @@ def setup_logging(
             "<level>{message}</level>"
         )
         logger.add(
-            sys.stdout,
+            stdout,
             format=fmt,
-            level=level,
+            level=sink_level,
+            filter=record_filter,
             colorize=True,
             backtrace=True,
             diagnose=True,
@@ -72,7 +279,8 @@ def setup_logging(
     if log_file:
         logger.add(
             log_file,
-            level=level,
+            level=sink_level,
+            filter=record_filter,
             rotation="10 MB",
             retention="14 days",
             compression="gz",
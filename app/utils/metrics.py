@@ -0,0 +1,31 @@
+from collections.abc import Callable
+from typing import Any
+
+from loguru import logger
+
+# Components register a callable returning their current counters; the admin
+# /metrics endpoint returns a snapshot of all of them.
+_collectors: dict[str, Callable[[], Any]] = {}
+
+
+def register(name: str, collector: Callable[[], Any]) -> None:
+    """
+    Expose a component's counters under `name` in the metrics snapshot.
+
+    :param name: Section name in the snapshot.
+    :param collector: Callable returning JSON-serialisable counters, or None to omit the section.
+    """
+    _collectors[name] = collector
+
+
+def snapshot() -> dict[str, Any]:
+    metrics = {}
+    for name, collector in _collectors.items():
+        try:
+            value = collector()
+        except Exception:
+            logger.exception("Metrics collector {} failed", name)
+            continue
+        if value is not None:
+            metrics[name] = value
+    return metrics
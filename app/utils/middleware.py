@@ -2,13 +2,35 @@ import time
 from collections.abc import Awaitable, Callable
 from uuid import uuid4
 
-from fastapi import Request, Response
+from fastapi import Request, Response, status
+from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import JSONResponse
 from loguru import logger
 from starlette.middleware.base import BaseHTTPMiddleware
+from starlette.types import ASGIApp
 
+from app.utils.admission import READ, classify, get_gates
+from app.utils.coalesce import get_single_flight, request_key
+from app.utils.config import get_settings
 from app.utils.logger import log_context
 
 
+class SettingsCORSMiddleware(CORSMiddleware):
+    """
+    CORSMiddleware taking its origins from CORS_ORIGINS when the middleware
+    stack is built, on the first request, instead of when the app is imported.
+    """
+
+    def __init__(self, app: ASGIApp) -> None:
+        super().__init__(
+            app,
+            allow_origins=get_settings().CORS_ORIGINS,
+            allow_credentials=True,
+            allow_methods=["*"],
+            allow_headers=["*"],
+        )
+
+
 class RequestLoggingMiddleware(BaseHTTPMiddleware):
     """
     Attaches a unique request_id to every log record produced during the
@@ -36,7 +58,7 @@ class RequestLoggingMiddleware(BaseHTTPMiddleware):
                 raise
 
             elapsed_ms = (time.perf_counter() - start) * 1000
-            logger.info(
+            logger.bind(access=True).info(
                 "Request completed | status={status} elapsed={elapsed:.1f}ms",
                 status=response.status_code,
                 elapsed=elapsed_ms,
@@ -44,3 +66,67 @@ class RequestLoggingMiddleware(BaseHTTPMiddleware):
 
             response.headers["X-Request-ID"] = request_id
             return response
+
+
+class LoadSheddingMiddleware(BaseHTTPMiddleware):
+    """
+    Admits API requests through a separate concurrency budget and wait queue
+    per traffic class (ingest, dashboard reads, admin), so a slow database
+    cannot pile up unbounded work. Requests that find their queue full, or
+    wait in it past the deadline, are shed with 503.
+    """
+
+    async def dispatch(
+        self,
+        request: Request,
+        call_next: Callable[[Request], Awaitable[Response]],
+    ) -> Response:
+        traffic_class = classify(request.method, request.url.path)
+        if traffic_class is None:
+            return await call_next(request)
+
+        gate = get_gates()[traffic_class]
+        if not await gate.acquire():
+            logger.warning("Shedding {} request", traffic_class)
+            return JSONResponse(
+                status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                content={"detail": "Server busy, retry later"},
+                headers={"Retry-After": "1"},
+            )
+        try:
+            return await call_next(request)
+        finally:
+            gate.release()
+
+
+class CoalescingMiddleware(BaseHTTPMiddleware):
+    """
+    Runs concurrent identical read requests once and answers all of them with
+    the same serialised response; see app.utils.coalesce. It sits outside
+    load shedding so the requests that wait take no read slot.
+    """
+
+    async def dispatch(
+        self,
+        request: Request,
+        call_next: Callable[[Request], Awaitable[Response]],
+    ) -> Response:
+        if (
+            not get_settings().COALESCE_READS
+            or classify(request.method, request.url.path) != READ
+        ):
+            return await call_next(request)
+
+        async def fetch() -> tuple[int, list[tuple[bytes, bytes]], bytes]:
+            response = await call_next(request)
+            body = b"".join(
+                [chunk async for chunk in response.body_iterator]  # type: ignore[attr-defined]
+            )
+            return response.status_code, response.raw_headers, body
+
+        status_code, raw_headers, body = await get_single_flight().do(
+            request_key(request), fetch
+        )
+        response = Response(content=body, status_code=status_code)
+        response.raw_headers = list(raw_headers)
+        return response
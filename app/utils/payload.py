@@ -0,0 +1,253 @@
+import importlib
+import json
+import math
+import re
+import zlib
+from typing import Any
+
+from fastapi import HTTPException, Request, status
+
+from app.utils.config import get_settings
+
+# Content types decoded by a binary codec instead of as JSON, mapped to the
+# optional module that decodes them.
+_BINARY_TYPES = {
+    "application/msgpack": "msgpack",
+    "application/vnd.msgpack": "msgpack",
+    "application/x-msgpack": "msgpack",
+    "application/cbor": "cbor2",
+}
+_MEDIA_TYPES = {"msgpack": "application/msgpack", "cbor2": "application/cbor"}
+
+# Bytes that can change the scanner's state: quotes, backslashes, brackets and
+# the colon that follows every object key. Everything else is skipped by the
+# regex engine rather than looked at in Python.
+_STRUCTURAL = re.compile(rb'["\\\[\]{}:]')
+
+
+class PayloadLimitExceeded(Exception):
+    def __init__(self, detail: str):
+        super().__init__(detail)
+        self.detail = detail
+
+
+class JSONLimitScanner:
+    """
+    Tracks nesting depth and object key count of a JSON document fed to it in
+    chunks, without parsing it. Raises as soon as a limit is crossed, so a
+    deeply nested or key-heavy body is refused before it is fully received.
+    """
+
+    def __init__(self, max_depth: int, max_keys: int):
+        self.max_depth = max_depth
+        self.max_keys = max_keys
+        self.depth = 0
+        self.keys = 0
+        self._in_string = False
+        self._escaped = False
+
+    def feed(self, chunk: bytes) -> None:
+        skip = -1
+        if self._escaped:
+            self._escaped = False
+            skip = 0
+        for match in _STRUCTURAL.finditer(chunk):
+            pos = match.start()
+            if pos == skip:
+                continue
+            char = chunk[pos]
+            if self._in_string:
+                if char == 0x5C:  # backslash escapes the next byte
+                    skip = pos + 1
+                    self._escaped = skip == len(chunk)
+                elif char == 0x22:
+                    self._in_string = False
+            elif char == 0x22:
+                self._in_string = True
+            elif char in (0x7B, 0x5B):  # { [
+                self.depth += 1
+                if self.depth > self.max_depth:
+                    raise PayloadLimitExceeded(
+                        f"Payload nesting exceeds {self.max_depth} levels"
+                    )
+            elif char in (0x7D, 0x5D):  # } ]
+                self.depth -= 1
+            else:  # ':' outside a string ends an object key
+                self.keys += 1
+                if self.keys > self.max_keys:
+                    raise PayloadLimitExceeded(
+                        f"Payload has more than {self.max_keys} keys"
+                    )
+
+
+def check_limits(value: Any, max_depth: int, max_keys: int) -> None:
+    """
+    Check a decoded MessagePack or CBOR document against the same depth and key
+    limits JSONLimitScanner applies to JSON, and that it holds only values JSON
+    can represent, so it can be stored as is.
+
+    :raises PayloadLimitExceeded: When a limit is crossed.
+    :raises ValueError: When the document holds a value JSON cannot represent.
+    """
+    keys = 0
+
+    def walk(node: Any, depth: int) -> None:
+        nonlocal keys
+        if isinstance(node, dict | list):
+            depth += 1
+            if depth > max_depth:
+                raise PayloadLimitExceeded(
+                    f"Payload nesting exceeds {max_depth} levels"
+                )
+            if isinstance(node, list):
+                for item in node:
+                    walk(item, depth)
+                return
+            keys += len(node)
+            if keys > max_keys:
+                raise PayloadLimitExceeded(f"Payload has more than {max_keys} keys")
+            for key, item in node.items():
+                if not isinstance(key, str):
+                    raise ValueError("object keys must be strings")
+                walk(item, depth)
+        elif isinstance(node, float):
+            if not math.isfinite(node):
+                raise ValueError("numbers must be finite")
+        elif node is not None and not isinstance(node, str | int):
+            raise ValueError(f"{type(node).__name__} values are not supported")
+
+    walk(value, 0)
+
+
+def _too_large(detail: str) -> HTTPException:
+    return HTTPException(
+        status_code=status.HTTP_413_CONTENT_TOO_LARGE,
+        detail=detail,
+    )
+
+
+def _unsupported(detail: str) -> HTTPException:
+    return HTTPException(
+        status_code=status.HTTP_415_UNSUPPORTED_MEDIA_TYPE,
+        detail=detail,
+    )
+
+
+def _unprocessable(detail: str) -> HTTPException:
+    return HTTPException(
+        status_code=status.HTTP_422_UNPROCESSABLE_CONTENT,
+        detail=detail,
+    )
+
+
+def _optional_module(name: str, feature: str) -> Any:
+    try:
+        return importlib.import_module(name)
+    except ImportError:
+        raise _unsupported(f"{feature} is not supported by this server") from None
+
+
+def _decompressor(encoding: str) -> tuple[Any, type[Exception]]:
+    """
+    A streaming decompressor for a Content-Encoding, None for identity, and the
+    exception it raises on corrupt input. Both kinds take
+    `decompress(data, max_length)` and report `eof` and `unused_data`.
+    """
+    if encoding in ("", "identity"):
+        return None, zlib.error
+    if encoding in ("gzip", "x-gzip"):
+        return zlib.decompressobj(16 + zlib.MAX_WBITS), zlib.error
+    if encoding == "zstd":
+        zstd = _optional_module("compression.zstd", "Content-Encoding zstd")
+        return zstd.ZstdDecompressor(), zstd.ZstdError
+    raise _unsupported(f"Content-Encoding {encoding} is not supported")
+
+
+def _decode_binary(body: bytes, module: str, max_depth: int, max_keys: int) -> Any:
+    codec = _optional_module(module, f"Content-Type {_MEDIA_TYPES[module]}")
+    try:
+        if module == "msgpack":
+            payload = codec.unpackb(body, raw=False, strict_map_key=True)
+        else:
+            payload = codec.loads(body)
+        check_limits(payload, max_depth, max_keys)
+    except PayloadLimitExceeded as exc:
+        raise _too_large(exc.detail) from None
+    except (ValueError, TypeError, RecursionError):
+        raise _unprocessable(
+            f"Request body is not valid {_MEDIA_TYPES[module]}"
+        ) from None
+    return payload
+
+
+async def read_ingest_payload(request: Request) -> dict[str, Any]:
+    """
+    Read a device data body as an object within the INGEST_MAX_* limits.
+
+    A Content-Length over the size limit is refused before anything is read.
+    Otherwise the body is streamed, decompressed as it arrives when it has a
+    gzip or zstd Content-Encoding, and each chunk is checked against the size
+    limit, both on the wire and decompressed; JSON chunks are also checked for
+    nesting depth and key count. The first limit crossed ends the request with
+    413 and the rest of the body is never buffered. MessagePack and CBOR
+    bodies, chosen by Content-Type, are checked for depth and keys once
+    decoded and may hold only values JSON can represent.
+
+    :param request: The incoming request.
+    :return: The decoded object.
+    """
+    settings = get_settings()
+    max_bytes = settings.INGEST_MAX_BODY_BYTES
+
+    content_length = request.headers.get("content-length")
+    if content_length is not None and content_length.isdigit():
+        if int(content_length) > max_bytes:
+            raise _too_large(f"Payload exceeds {max_bytes} bytes")
+
+    encoding = request.headers.get("content-encoding", "").strip().lower()
+    decompressor, corrupt = _decompressor(encoding)
+    content_type = request.headers.get("content-type", "")
+    binary = _BINARY_TYPES.get(content_type.split(";")[0].strip().lower())
+    scanner = (
+        None
+        if binary
+        else JSONLimitScanner(settings.INGEST_MAX_DEPTH, settings.INGEST_MAX_KEYS)
+    )
+    received = 0
+    body = bytearray()
+    try:
+        async for chunk in request.stream():
+            received += len(chunk)
+            if received > max_bytes:
+                raise _too_large(f"Payload exceeds {max_bytes} bytes")
+            if decompressor is not None:
+                # Never inflate more than one byte past the limit, so a
+                # decompression bomb costs no more memory than a plain body.
+                chunk = decompressor.decompress(chunk, max_bytes - len(body) + 1)
+            if len(body) + len(chunk) > max_bytes:
+                raise _too_large(f"Payload exceeds {max_bytes} bytes")
+            if scanner is not None:
+                scanner.feed(chunk)
+            body += chunk
+    except PayloadLimitExceeded as exc:
+        raise _too_large(exc.detail) from None
+    except corrupt:
+        raise _unprocessable(f"Request body is not valid {encoding}") from None
+    if decompressor is not None and (not decompressor.eof or decompressor.unused_data):
+        raise _unprocessable(f"Request body is not valid {encoding}")
+
+    if binary:
+        payload = _decode_binary(
+            bytes(body), binary, settings.INGEST_MAX_DEPTH, settings.INGEST_MAX_KEYS
+        )
+        if not isinstance(payload, dict):
+            raise _unprocessable("Request body must be an object")
+        return payload
+
+    try:
+        payload = json.loads(body)
+    except ValueError:
+        raise _unprocessable("Request body is not valid JSON") from None
+    if not isinstance(payload, dict):
+        raise _unprocessable("Request body must be a JSON object")
+    return payload
@@ -0,0 +1,191 @@
+import asyncio
+import math
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from collections.abc import Mapping
+from typing import Annotated, Protocol
+from uuid import UUID
+
+from fastapi import Header, HTTPException, status
+from loguru import logger
+
+from app.utils.auth import hash_api_key
+from app.utils.config import get_settings
+
+
+def _take(
+    tokens: float, updated: float, rate: float, burst: int, now: float
+) -> tuple[float, float]:
+    """
+    Refill a token bucket up to `now` and take one token.
+
+    :return: (tokens left, seconds until a token is available; 0.0 if one was taken)
+    """
+    tokens = min(float(burst), tokens + max(now - updated, 0.0) * rate)
+    if tokens >= 1.0:
+        return tokens - 1.0, 0.0
+    return tokens, (1.0 - tokens) / rate
+
+
+class RateLimitBackend(Protocol):
+    async def acquire(self, key: str, rate: float, burst: int, now: float) -> float:
+        """Take a token for `key`; return 0.0 if allowed, else seconds to wait."""
+        ...
+
+
+class MemoryRateLimitBackend:
+    """
+    Buckets held in this process only. Used when no shared store is configured
+    and as the stand-in in tests; with several workers each one enforces the
+    limit separately.
+    """
+
+    def __init__(self, max_keys: int = 100_000):
+        self._buckets: OrderedDict[str, tuple[float, float]] = OrderedDict()
+        self._max_keys = max_keys
+
+    async def acquire(self, key: str, rate: float, burst: int, now: float) -> float:
+        tokens, updated = self._buckets.pop(key, (float(burst), now))
+        tokens, retry_after = _take(tokens, updated, rate, burst, now)
+        self._buckets[key] = (tokens, now)
+        if len(self._buckets) > self._max_keys:
+            self._buckets.popitem(last=False)
+        return retry_after
+
+
+class SQLiteRateLimitBackend:
+    """
+    Buckets in a SQLite file shared by every worker on the host. Put the file on
+    a tmpfs such as /dev/shm so an acquire never touches the disk; each one is a
+    single short IMMEDIATE transaction, run off the event loop.
+    """
+
+    _PRUNE_EVERY = 10_000
+
+    def __init__(self, path: str, idle_seconds: float = 3600.0):
+        self._path = path
+        self._idle_seconds = idle_seconds
+        self._conn: sqlite3.Connection | None = None
+        self._lock = threading.Lock()
+        self._calls = 0
+
+    def _connect(self) -> sqlite3.Connection:
+        if self._conn is None:
+            conn = sqlite3.connect(
+                self._path, timeout=5.0, isolation_level=None, check_same_thread=False
+            )
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=OFF")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS bucket "
+                "(key TEXT PRIMARY KEY, tokens REAL NOT NULL, updated REAL NOT NULL)"
+            )
+            self._conn = conn
+        return self._conn
+
+    def _acquire(self, key: str, rate: float, burst: int, now: float) -> float:
+        with self._lock:
+            conn = self._connect()
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                row = conn.execute(
+                    "SELECT tokens, updated FROM bucket WHERE key = ?", (key,)
+                ).fetchone()
+                tokens, updated = row if row is not None else (float(burst), now)
+                tokens, retry_after = _take(tokens, updated, rate, burst, now)
+                conn.execute(
+                    "INSERT OR REPLACE INTO bucket (key, tokens, updated) VALUES (?, ?, ?)",
+                    (key, tokens, now),
+                )
+                self._calls += 1
+                if self._calls % self._PRUNE_EVERY == 0:
+                    conn.execute(
+                        "DELETE FROM bucket WHERE updated < ?",
+                        (now - self._idle_seconds,),
+                    )
+                conn.execute("COMMIT")
+            except BaseException:
+                conn.execute("ROLLBACK")
+                raise
+            return retry_after
+
+    async def acquire(self, key: str, rate: float, burst: int, now: float) -> float:
+        return await asyncio.to_thread(self._acquire, key, rate, burst, now)
+
+
+class RateLimiter:
+
+    def __init__(
+        self,
+        backend: RateLimitBackend,
+        rate: float,
+        burst: int,
+        overrides: Mapping[str, tuple[float, int]] | None = None,
+    ):
+        self.backend = backend
+        self._default = (rate, burst)
+        self._overrides = {
+            str(UUID(device_id)): limits
+            for device_id, limits in (overrides or {}).items()
+        }
+
+    def limits_for(self, device_id: str) -> tuple[float, int]:
+        """(tokens per second, burst) for a device; a rate of 0 disables limiting."""
+        return self._overrides.get(device_id, self._default)
+
+    async def check(self, key: str, device_id: str) -> float:
+        """
+        Take a token for an API key.
+
+        :param key: Identifies the bucket; the hashed API key.
+        :param device_id: The device the key claims to belong to, for overrides.
+        :return: 0.0 if the request may proceed, else seconds until it may retry.
+        """
+        rate, burst = self.limits_for(device_id)
+        if rate <= 0:
+            return 0.0
+        return await self.backend.acquire(key, rate, burst, time.time())
+
+
+_rate_limiter: RateLimiter | None = None
+
+
+def get_rate_limiter() -> RateLimiter:
+    global _rate_limiter
+    if _rate_limiter is None:
+        settings = get_settings()
+        backend: RateLimitBackend = (
+            SQLiteRateLimitBackend(settings.RATE_LIMIT_STORE)
+            if settings.RATE_LIMIT_STORE
+            else MemoryRateLimitBackend()
+        )
+        _rate_limiter = RateLimiter(
+            backend,
+            rate=settings.RATE_LIMIT_PER_SECOND,
+            burst=settings.RATE_LIMIT_BURST,
+            overrides=settings.RATE_LIMIT_DEVICE_OVERRIDES,
+        )
+    return _rate_limiter
+
+
+async def rate_limit_ingest(
+    raw_key: Annotated[str | None, Header(alias="X-API-Key")] = None,
+    device_id: Annotated[UUID | None, Header(alias="X-Device-Id")] = None,
+) -> None:
+    """
+    Reject a device that is over its ingest rate with 429 before any database
+    work is done. Requests without credentials are left to verify_api_key.
+    """
+    if raw_key is None or device_id is None:
+        return
+
+    retry_after = await get_rate_limiter().check(hash_api_key(raw_key), str(device_id))
+    if retry_after > 0:
+        logger.warning("Rate limit exceeded for device id: {}", device_id)
+        raise HTTPException(
+            status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+            detail="Rate limit exceeded",
+            headers={"Retry-After": str(math.ceil(retry_after))},
+        )
@@ -0,0 +1,273 @@
+"""
+Hash-based placement of device readings across several databases.
+
+Device metadata and API keys always live on the primary database. When
+`DATA_SHARDS` is set, every `devicedata` row is stored on the shard that
+`ShardMap.shard_for` picks for its device instead, together with its compacted
+`devicedatachunk` rows and the typed `devicedatavalue` rows of its promoted keys.
+
+Usage:
+    uv run python -m app.utils.sharding init
+    uv run python -m app.utils.sharding rebalance [--include-primary] [--device ID ...]
+        [--batch-size 1000] [--dry-run]
+"""
+
+import argparse
+import asyncio
+import hashlib
+from collections.abc import Iterable, Mapping
+from uuid import UUID
+
+from sqlalchemy import Connection, Table, delete, func, select
+from sqlalchemy.ext.asyncio import (
+    AsyncEngine,
+    AsyncSession,
+    async_sessionmaker,
+    create_async_engine,
+)
+from sqlalchemy.schema import CreateIndex, CreateTable
+
+from app.models.device import DeviceData, DeviceDataChunk
+from app.models.field import DeviceDataValue
+from app.utils.config import get_settings
+from app.utils.database import create_tables_once, insert_ignoring_conflicts
+
+PRIMARY = "(primary)"
+
+# Tables that are placed by device_id. Shards hold no `device` table, so these
+# are created without their foreign keys. Parents come before children.
+SHARDED_TABLES: list[Table] = [
+    DeviceData.__table__,  # type: ignore[attr-defined]
+    DeviceDataChunk.__table__,  # type: ignore[attr-defined]
+    DeviceDataValue.__table__,  # type: ignore[attr-defined]
+]
+
+
+def _weight(shard: str, device_id: UUID) -> int:
+    digest = hashlib.blake2b(
+        shard.encode("utf-8") + device_id.bytes, digest_size=8
+    ).digest()
+    return int.from_bytes(digest, "big")
+
+
+def create_shard_tables(conn: Connection) -> None:
+    for table in SHARDED_TABLES:
+        conn.execute(
+            CreateTable(table, include_foreign_key_constraints=[], if_not_exists=True)
+        )
+        for index in table.indexes:
+            conn.execute(CreateIndex(index, if_not_exists=True))
+
+
+class ShardMap:
+
+    def __init__(self, engines: Mapping[str, AsyncEngine]):
+        self.engines = dict(engines)
+        self._factories = {
+            name: async_sessionmaker(
+                engine, class_=AsyncSession, expire_on_commit=False
+            )
+            for name, engine in self.engines.items()
+        }
+
+    @classmethod
+    def from_urls(cls, urls: Mapping[str, str]) -> "ShardMap":
+        return cls(
+            {
+                name: create_async_engine(url, pool_pre_ping=True, pool_recycle=3600)
+                for name, url in urls.items()
+            }
+        )
+
+    @property
+    def enabled(self) -> bool:
+        return bool(self.engines)
+
+    def shard_for(self, device_id: UUID) -> str:
+        """
+        Pick the shard for a device with rendezvous (highest random weight)
+        hashing. Adding or removing a shard only moves the devices that land
+        on, or were on, that shard.
+
+        :param device_id: The ID of the device.
+        :return: The name of the shard that holds the device's readings.
+        """
+        return max(self.engines, key=lambda name: _weight(name, device_id))
+
+    def session(self, name: str) -> AsyncSession:
+        return self._factories[name]()
+
+    async def create_tables(self) -> None:
+        for engine in self.engines.values():
+            async with engine.begin() as conn:
+                await conn.run_sync(create_shard_tables)
+
+    async def ensure_tables(self) -> None:
+        """Create the sharded tables once per deployment; see create_tables_once."""
+        for engine in self.engines.values():
+            await create_tables_once(engine, SHARDED_TABLES, create_shard_tables)
+
+    async def delete_device_data(self, device_id: UUID) -> None:
+        """
+        Delete every sharded row of a device. Shards have no foreign key to
+        `device`, so this replaces the ON DELETE CASCADE of the primary.
+
+        :param device_id: The ID of the device whose readings should be removed.
+        """
+        async with self.session(self.shard_for(device_id)) as session:
+            for table in reversed(SHARDED_TABLES):
+                await session.execute(
+                    delete(table).where(table.c.device_id == device_id)
+                )
+            await session.commit()
+
+    async def dispose(self) -> None:
+        for engine in self.engines.values():
+            await engine.dispose()
+
+
+_shard_map: ShardMap | None = None
+
+
+def get_shard_map() -> ShardMap:
+    """The shard map built from `DATA_SHARDS`, created on first use."""
+    global _shard_map
+    if _shard_map is None:
+        _shard_map = ShardMap.from_urls(get_settings().DATA_SHARDS)
+    return _shard_map
+
+
+async def _move_device(
+    device_id: UUID,
+    source: AsyncEngine,
+    target: AsyncEngine,
+    batch_size: int,
+) -> int:
+    """
+    Copy a device's rows to the target in batches, deleting each batch from the
+    source once the target has committed it. Re-running after an interruption
+    is safe: rows already on the target are skipped by ON CONFLICT DO NOTHING.
+    """
+    moved = 0
+    for table in SHARDED_TABLES:
+        while True:
+            async with source.connect() as conn:
+                result = await conn.execute(
+                    select(table)
+                    .where(table.c.device_id == device_id)
+                    .order_by(table.c.id)
+                    .limit(batch_size)
+                )
+                rows = [dict(row) for row in result.mappings()]
+            if not rows:
+                break
+
+            async with target.begin() as conn:
+                await conn.execute(
+                    insert_ignoring_conflicts(table, conn.dialect.name), rows
+                )
+            async with source.begin() as conn:
+                await conn.execute(
+                    delete(table).where(table.c.id.in_([row["id"] for row in rows]))
+                )
+            moved += len(rows)
+    return moved
+
+
+async def rebalance(
+    shards: ShardMap,
+    sources: Mapping[str, AsyncEngine],
+    *,
+    devices: Iterable[UUID] | None = None,
+    batch_size: int = 1000,
+    dry_run: bool = False,
+) -> dict[UUID, tuple[str, str, int]]:
+    """
+    Move every device whose rows sit on a database other than the one the shard
+    map assigns it to.
+
+    :param shards: The shard map that decides where each device belongs.
+    :param sources: Databases to scan for misplaced rows, by name.
+    :param devices: Only consider these devices; default is all devices found.
+    :param batch_size: Rows copied and deleted per transaction.
+    :param dry_run: Report what would move without writing anything.
+    :return: Mapping of device ID to (source, target, row count).
+    """
+    only = set(devices) if devices is not None else None
+    moves: dict[UUID, tuple[str, str, int]] = {}
+
+    for source_name, source in sources.items():
+        counts: dict[UUID, int] = {}
+        async with source.connect() as conn:
+            for table in SHARDED_TABLES:
+                result = await conn.execute(
+                    select(table.c.device_id, func.count()).group_by(table.c.device_id)
+                )
+                for device_id, count in result.all():
+                    counts[device_id] = counts.get(device_id, 0) + count
+
+        for device_id, count in counts.items():
+            if only is not None and device_id not in only:
+                continue
+            target_name = shards.shard_for(device_id)
+            if target_name == source_name:
+                continue
+            if not dry_run:
+                count = await _move_device(
+                    device_id, source, shards.engines[target_name], batch_size
+                )
+            moves[device_id] = (source_name, target_name, count)
+            print(f"  {device_id}: {source_name} -> {target_name} ({count} rows)")
+
+    return moves
+
+
+async def _main(args: argparse.Namespace) -> None:
+    shard_map = get_shard_map()
+    if not shard_map.enabled:
+        raise SystemExit("DATA_SHARDS is not configured")
+
+    await shard_map.create_tables()
+    if args.command == "init":
+        print(f"Created sharded tables on {len(shard_map.engines)} shard(s).")
+        await shard_map.dispose()
+        return
+
+    sources = dict(shard_map.engines)
+    primary = None
+    if args.include_primary:
+        primary = create_async_engine(get_settings().async_database_url)
+        sources[PRIMARY] = primary
+
+    moves = await rebalance(
+        shard_map,
+        sources,
+        devices=args.device or None,
+        batch_size=args.batch_size,
+        dry_run=args.dry_run,
+    )
+    total = sum(count for _, _, count in moves.values())
+    verb = "Would move" if args.dry_run else "Moved"
+    print(f"\n{verb} {total} rows for {len(moves)} device(s).")
+
+    await shard_map.dispose()
+    if primary is not None:
+        await primary.dispose()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    subparsers.add_parser("init", help="Create the sharded tables on every shard")
+    rebalance_parser = subparsers.add_parser(
+        "rebalance", help="Move devices to the shard the current map assigns them"
+    )
+    rebalance_parser.add_argument(
+        "--include-primary",
+        action="store_true",
+        help="Also move readings still stored on the primary database",
+    )
+    rebalance_parser.add_argument("--device", type=UUID, action="append")
+    rebalance_parser.add_argument("--batch-size", type=int, default=1000)
+    rebalance_parser.add_argument("--dry-run", action="store_true")
+    asyncio.run(_main(parser.parse_args()))
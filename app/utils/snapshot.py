@@ -0,0 +1,492 @@
+"""
+Parallel logical snapshots of the database, and their restore.
+
+A snapshot is a directory under the snapshot root, named after the time it was
+taken, holding gzip-compressed JSON-lines files and a `manifest.json` that is
+written last. `device`, `apikey` and `devicefield` are small and saved whole
+every time. The per-device tables (`devicedata`, `devicedatachunk` and
+`devicedatavalue`) are split by device and into `--chunk-days` windows of
+their timestamp, and the chunks are exported by `--workers` connections in
+parallel, each from the device's shard when `DATA_SHARDS` is set. On
+PostgreSQL all workers read one exported snapshot, as `pg_dump --jobs` does,
+so the files of a database are consistent with each other.
+
+An incremental snapshot holds only the per-device rows updated since the
+previous snapshot was taken, less `--overlap-minutes` for transactions that
+were still open then. Restoring one applies the chain from the last full
+snapshot in order: the full snapshot's files with COPY, the later ones
+through an upsert, the files of each snapshot in parallel. Devices deleted
+since the full snapshot are left out; other deletions (of readings, or of rows
+packed by compaction) are not recorded, so take a full snapshot after those.
+
+Restore into an empty database whose schema is already created (`alembic
+upgrade head`, and `python -m app.utils.sharding init` when sharded).
+
+Usage:
+    uv run python -m app.utils.snapshot create DIR [--incremental] [--workers 4]
+        [--chunk-days 30] [--overlap-minutes 10] [--database-url URL]
+    uv run python -m app.utils.snapshot restore DIR [--snapshot ID] [--workers 4]
+        [--database-url URL]
+"""
+
+import argparse
+import asyncio
+import base64
+import gzip
+import json
+import re
+from collections.abc import AsyncIterator, Awaitable, Callable, Sequence
+from contextlib import AsyncExitStack, asynccontextmanager
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+from typing import IO, Any
+from uuid import UUID
+
+import sqlalchemy as sa
+from sqlalchemy import Table, func, select, text
+from sqlalchemy.ext.asyncio import AsyncConnection, AsyncEngine, create_async_engine
+
+from app.models.api_key import ApiKey
+from app.models.device import Device, DeviceData, DeviceDataChunk
+from app.models.field import DeviceDataValue, DeviceField
+from app.utils.compaction import utc
+from app.utils.config import get_settings
+from app.utils.database import copy_records
+from app.utils.sharding import SHARDED_TABLES, ShardMap, get_shard_map
+
+MANIFEST = "manifest.json"
+# Saved whole on the primary, parents first.
+WHOLE_TABLES: list[Table] = [
+    Device.__table__,  # type: ignore[attr-defined]
+    ApiKey.__table__,  # type: ignore[attr-defined]
+    DeviceField.__table__,  # type: ignore[attr-defined]
+]
+# Saved per device and time window, cut on this column.
+WINDOW_COLUMNS = {
+    DeviceData.__tablename__: "created_date",
+    DeviceDataChunk.__tablename__: "start",
+    DeviceDataValue.__tablename__: "created_date",
+}
+_TABLES = {table.name: table for table in [*WHOLE_TABLES, *SHARDED_TABLES]}
+_EPOCH = datetime(1970, 1, 1, tzinfo=timezone.utc)
+_PAGE = 5000
+_PG_SNAPSHOT_ID = re.compile(r"^[0-9A-F-]+$")
+
+
+def _encoders(table: Table) -> list[Callable[[Any], Any]]:
+    """Per column, a function turning a value into something JSON can hold."""
+    encoders: list[Callable[[Any], Any]] = []
+    for column in table.columns:
+        if isinstance(column.type, sa.Uuid):
+            encoders.append(lambda value: value and str(value))
+        elif isinstance(column.type, sa.DateTime):
+            encoders.append(lambda value: value and utc(value).isoformat())
+        elif isinstance(column.type, sa.LargeBinary):
+            encoders.append(lambda value: value and base64.b64encode(value).decode())
+        else:
+            encoders.append(lambda value: value)
+    return encoders
+
+
+def _decoders(table: Table, columns: Sequence[str]) -> list[Callable[[Any], Any]]:
+    """Per saved column, the inverse of its encoder, giving a COPY-ready value."""
+    decoders: list[Callable[[Any], Any]] = []
+    for name in columns:
+        kind = table.c[name].type
+        if isinstance(kind, sa.Uuid):
+            decoders.append(lambda value: value and UUID(value))
+        elif isinstance(kind, sa.DateTime):
+            decoders.append(lambda value: value and datetime.fromisoformat(value))
+        elif isinstance(kind, sa.LargeBinary):
+            decoders.append(lambda value: value and base64.b64decode(value))
+        elif isinstance(kind, sa.JSON):
+            decoders.append(lambda value: json.dumps(value, separators=(",", ":")))
+        else:
+            decoders.append(lambda value: value)
+    return decoders
+
+
+def _write_lines(
+    file: IO[str], encoders: list[Callable[[Any], Any]], rows: Sequence[Any]
+) -> None:
+    file.writelines(
+        json.dumps(
+            [encode(value) for encode, value in zip(encoders, row)],
+            separators=(",", ":"),
+        )
+        + "\n"
+        for row in rows
+    )
+
+
+def _read_lines(
+    path: Path, positions: list[int], decoders: list[Callable[[Any], Any]]
+) -> list[tuple]:
+    """Read a file back, keeping the saved columns that still exist."""
+    with gzip.open(path, "rt", encoding="utf-8") as file:
+        rows = []
+        for line in file:
+            values = json.loads(line)
+            rows.append(
+                tuple(
+                    decode(values[position])
+                    for decode, position in zip(decoders, positions)
+                )
+            )
+        return rows
+
+
+@asynccontextmanager
+async def _exported_snapshot(engine: AsyncEngine) -> AsyncIterator[str | None]:
+    """
+    On PostgreSQL, hold a transaction open and yield the ID of its snapshot
+    for the workers to share; elsewhere yield None.
+    """
+    if engine.dialect.name != "postgresql":
+        yield None
+        return
+    async with engine.connect() as conn:
+        await conn.execution_options(isolation_level="REPEATABLE READ")
+        result = await conn.execute(text("SELECT pg_export_snapshot()"))
+        yield result.scalar_one()
+
+
+@asynccontextmanager
+async def _reading(
+    engine: AsyncEngine, snapshot_id: str | None
+) -> AsyncIterator[AsyncConnection]:
+    async with engine.connect() as conn:
+        if snapshot_id is not None:
+            if not _PG_SNAPSHOT_ID.match(snapshot_id):
+                raise ValueError(f"Unexpected snapshot ID {snapshot_id!r}")
+            await conn.execution_options(isolation_level="REPEATABLE READ")
+            await conn.execute(text(f"SET TRANSACTION SNAPSHOT '{snapshot_id}'"))
+        yield conn
+
+
+async def _export(
+    conn: AsyncConnection, statement: sa.Select, table: Table, path: Path
+) -> int:
+    """Write the rows of a query to a gzip file, created only if there are any."""
+    encoders = _encoders(table)
+    file = None
+    rows = 0
+    try:
+        result = await conn.stream(statement)
+        async for page in result.partitions(_PAGE):
+            if file is None:
+                path.parent.mkdir(parents=True, exist_ok=True)
+                file = gzip.open(path, "wt", encoding="utf-8", compresslevel=6)
+            await asyncio.to_thread(_write_lines, file, encoders, page)
+            rows += len(page)
+    finally:
+        if file is not None:
+            file.close()
+    return rows
+
+
+async def _run_jobs(jobs: Sequence[Callable[[], Awaitable[Any]]], workers: int) -> list:
+    """Run jobs on at most `workers` at a time, keeping their order in the results."""
+    results: list[Any] = [None] * len(jobs)
+    queue = iter(enumerate(jobs))
+
+    async def work() -> None:
+        for index, job in queue:
+            results[index] = await job()
+
+    async with asyncio.TaskGroup() as group:
+        for _ in range(min(workers, len(jobs))):
+            group.create_task(work())
+    return results
+
+
+def _windows(
+    first: datetime, last: datetime, period: timedelta
+) -> list[tuple[datetime, datetime]]:
+    start = _EPOCH + (utc(first) - _EPOCH) // period * period
+    windows = []
+    while start <= utc(last):
+        windows.append((start, start + period))
+        start += period
+    return windows
+
+
+def _snapshots(root: Path) -> list[dict[str, Any]]:
+    """Manifests of the complete snapshots under `root`, oldest first."""
+    return [
+        json.loads((path / MANIFEST).read_text())
+        for path in sorted(root.iterdir())
+        if (path / MANIFEST).exists()
+    ]
+
+
+async def create(
+    root: Path,
+    primary: AsyncEngine,
+    shards: ShardMap,
+    *,
+    incremental: bool = False,
+    workers: int = 4,
+    chunk_days: float = 30,
+    overlap: timedelta = timedelta(minutes=10),
+) -> dict[str, Any]:
+    """
+    Take a snapshot into a new directory under `root`.
+
+    :param root: Directory holding the snapshots.
+    :param primary: The primary database.
+    :param shards: Where the per-device tables live when sharding is configured.
+    :param incremental: Only save per-device rows updated since the last snapshot.
+    :param workers: Chunks exported at once.
+    :param chunk_days: Length of the time windows per-device tables are split into.
+    :param overlap: How far before the last snapshot an incremental one starts.
+    :return: The manifest.
+    """
+    root.mkdir(parents=True, exist_ok=True)
+    parent = None
+    if incremental:
+        previous = _snapshots(root)
+        if not previous:
+            raise SystemExit(f"No snapshot in {root} to take an incremental one from")
+        parent = previous[-1]
+    taken_at = datetime.now(timezone.utc)
+    since = (
+        datetime.fromisoformat(parent["taken_at"]) - overlap
+        if parent is not None
+        else None
+    )
+    snapshot_id = taken_at.strftime("%Y%m%dT%H%M%S%fZ")
+    directory = root / snapshot_id
+    directory.mkdir()
+    period = timedelta(days=chunk_days)
+    sources = dict(shards.engines) if shards.enabled else {"primary": primary}
+
+    async with _exported_snapshot(primary) as primary_snapshot:
+        async with _reading(primary, primary_snapshot) as conn:
+            query = select(Device.id)  # type: ignore[call-overload]
+            devices: Sequence[UUID] = (await conn.execute(query)).scalars().all()
+        jobs: list[Callable[[], Awaitable[Any]]] = []
+        files: list[dict[str, Any]] = []
+
+        def add(engine, snapshot, statement, table, path, **meta) -> None:
+            async def job() -> int:
+                async with _reading(engine, snapshot) as conn:
+                    return await _export(conn, statement, table, directory / path)
+
+            jobs.append(job)
+            files.append({"table": table.name, "path": path, **meta})
+
+        for table in WHOLE_TABLES:
+            add(
+                primary,
+                primary_snapshot,
+                select(table),
+                table,
+                f"{table.name}.jsonl.gz",
+            )
+
+        async with AsyncExitStack() as stack:
+            # Unsharded, the per-device tables are read from the primary's
+            # snapshot too, so they match the whole tables.
+            snapshots = {
+                name: (
+                    primary_snapshot
+                    if engine is primary
+                    else await stack.enter_async_context(_exported_snapshot(engine))
+                )
+                for name, engine in sources.items()
+            }
+            for name, engine in sources.items():
+                for table in SHARDED_TABLES:
+                    when = table.c[WINDOW_COLUMNS[table.name]]
+                    bounds = select(table.c.device_id, func.min(when), func.max(when))
+                    if since is not None:
+                        bounds = bounds.where(table.c.updated_date >= since)
+                    async with _reading(engine, snapshots[name]) as conn:
+                        result = await conn.execute(bounds.group_by(table.c.device_id))
+                    for device_id, first, last in result.all():
+                        for start, end in _windows(first, last, period):
+                            statement = select(table).where(
+                                table.c.device_id == device_id,
+                                when >= start,
+                                when < end,
+                            )
+                            if since is not None:
+                                statement = statement.where(
+                                    table.c.updated_date >= since
+                                )
+                            add(
+                                engine,
+                                snapshots[name],
+                                statement.order_by(when),
+                                table,
+                                f"{table.name}/{device_id}/"
+                                f"{start.strftime('%Y%m%dT%H%M%S')}.jsonl.gz",
+                                device_id=str(device_id),
+                                start=start.isoformat(),
+                                end=end.isoformat(),
+                            )
+            counts = await _run_jobs(jobs, workers)
+
+    for meta, rows in zip(files, counts):
+        meta["rows"] = rows
+    manifest = {
+        "id": snapshot_id,
+        "taken_at": taken_at.isoformat(),
+        "parent": parent["id"] if parent is not None else None,
+        "since": since.isoformat() if since is not None else None,
+        "dialect": primary.dialect.name,
+        "tables": {
+            name: [column.name for column in table.columns]
+            for name, table in _TABLES.items()
+        },
+        "devices": [str(device_id) for device_id in devices],
+        "files": [meta for meta in files if meta["rows"]],
+    }
+    (directory / MANIFEST).write_text(json.dumps(manifest, indent=1))
+    return manifest
+
+
+def chain(root: Path, snapshot_id: str | None = None) -> list[dict[str, Any]]:
+    """The manifests from the last full snapshot up to the given one (default latest)."""
+    manifests = {manifest["id"]: manifest for manifest in _snapshots(root)}
+    if not manifests:
+        raise SystemExit(f"No snapshot in {root}")
+    current = manifests.get(snapshot_id or max(manifests))
+    if current is None:
+        raise SystemExit(f"No snapshot {snapshot_id} in {root}")
+    result = [current]
+    while current["parent"] is not None:
+        if current["parent"] not in manifests:
+            raise SystemExit(f"Snapshot {current['parent']} is missing from {root}")
+        current = manifests[current["parent"]]
+        result.append(current)
+    return result[::-1]
+
+
+async def restore(
+    root: Path,
+    primary: AsyncEngine,
+    shards: ShardMap,
+    *,
+    snapshot_id: str | None = None,
+    workers: int = 4,
+) -> int:
+    """
+    Load a snapshot, with the snapshots it builds on, into an empty database.
+
+    :param root: Directory holding the snapshots.
+    :param primary: The primary database.
+    :param shards: Where per-device tables go when sharding is configured.
+    :param snapshot_id: The snapshot to restore; default is the latest.
+    :param workers: Files loaded at once.
+    :return: The number of rows loaded.
+    """
+    manifests = chain(root, snapshot_id)
+    latest = manifests[-1]
+    devices = set(latest["devices"])
+    loaded = 0
+
+    def engine_for(device_id: str) -> AsyncEngine:
+        if not shards.enabled:
+            return primary
+        return shards.engines[shards.shard_for(UUID(device_id))]
+
+    async def load(manifest, meta, engine, on_conflict) -> int:
+        table = _TABLES[meta["table"]]
+        saved = manifest["tables"][table.name]
+        columns = [name for name in saved if name in table.c]
+        records = await asyncio.to_thread(
+            _read_lines,
+            root / manifest["id"] / meta["path"],
+            [saved.index(name) for name in columns],
+            _decoders(table, columns),
+        )
+        for start in range(0, len(records), _PAGE):
+            end = start + _PAGE
+            await copy_records(
+                engine, table, columns, records[start:end], on_conflict=on_conflict
+            )
+        return len(records)
+
+    whole = {meta["table"]: meta for meta in latest["files"] if "device_id" not in meta}
+    for table in WHOLE_TABLES:
+        if table.name in whole:
+            loaded += await load(latest, whole[table.name], primary, "error")
+
+    for position, manifest in enumerate(manifests):
+        jobs = [
+            (
+                lambda manifest=manifest, meta=meta: load(
+                    manifest,
+                    meta,
+                    engine_for(meta["device_id"]),
+                    "update" if position else "error",
+                )
+            )
+            for meta in manifest["files"]
+            if meta.get("device_id") in devices
+        ]
+        loaded += sum(await _run_jobs(jobs, workers))
+    return loaded
+
+
+async def _main(args: argparse.Namespace) -> None:
+    url = args.database_url or get_settings().async_database_url
+    primary = create_async_engine(url, pool_size=args.workers + 1)
+    shard_map = get_shard_map()
+    root = Path(args.directory)
+    try:
+        if args.command == "create":
+            manifest = await create(
+                root,
+                primary,
+                shard_map,
+                incremental=args.incremental,
+                workers=args.workers,
+                chunk_days=args.chunk_days,
+                overlap=timedelta(minutes=args.overlap_minutes),
+            )
+            rows = sum(meta["rows"] for meta in manifest["files"])
+            kind = "Incremental snapshot" if manifest["parent"] else "Snapshot"
+            print(
+                f"{kind} {manifest['id']}: {rows} rows in "
+                f"{len(manifest['files'])} files."
+            )
+        else:
+            loaded = await restore(
+                root,
+                primary,
+                shard_map,
+                snapshot_id=args.snapshot,
+                workers=args.workers,
+            )
+            print(f"Restored {loaded} rows.")
+    finally:
+        await shard_map.dispose()
+        await primary.dispose()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    create_parser = subparsers.add_parser("create", help="Take a snapshot")
+    create_parser.add_argument("directory")
+    create_parser.add_argument(
+        "--incremental",
+        action="store_true",
+        help="Only save readings updated since the last snapshot",
+    )
+    create_parser.add_argument("--chunk-days", type=float, default=30)
+    create_parser.add_argument("--overlap-minutes", type=float, default=10)
+    restore_parser = subparsers.add_parser("restore", help="Restore a snapshot")
+    restore_parser.add_argument("directory")
+    restore_parser.add_argument("--snapshot", help="Snapshot ID; default the latest")
+    for subparser in (create_parser, restore_parser):
+        subparser.add_argument("--workers", type=int, default=4)
+        subparser.add_argument(
+            "--database-url",
+            help="Primary database, e.g. sqlite+aiosqlite:///data.db; "
+            "default from the POSTGRES_* settings",
+        )
+    asyncio.run(_main(parser.parse_args()))
@@ -0,0 +1,310 @@
+"""
+Write-ahead spool for readings the database cannot take right now.
+
+With `SPOOL_DIR` set, a reading whose write fails or takes longer than
+`SPOOL_DB_TIMEOUT` is appended to a local segment file instead and the device
+gets `202 Accepted` once the record is synced to disk. Appends arriving within
+`SPOOL_FSYNC_INTERVAL` of each other share one fsync. A task in every worker
+replays sealed segments into `devicedata` in batches while the database is
+reachable; readings keep the ID they were acknowledged with and are inserted
+with ON CONFLICT DO NOTHING, so replaying a segment twice stores nothing twice.
+A reading sent with an `Idempotency-Key` keeps the key in its record, and the
+key is claimed when it is replayed, so a retry is still stored once.
+
+Segments are named `<created ns>-<pid>.seg` and hold records framed as
+`<length:u32><crc32:u32><json>`. The worker writing a segment holds an flock on
+it; a segment that can be locked is sealed, whichever worker wrote it, so the
+segments of a crashed worker are replayed by the others or after a restart. A
+torn record at the end of a segment was never acknowledged and is dropped.
+"""
+
+import asyncio
+import fcntl
+import itertools
+import json
+import os
+import struct
+import time
+import zlib
+from collections import OrderedDict
+from collections.abc import Awaitable, Callable, Mapping, Sequence
+from datetime import datetime
+from pathlib import Path
+from typing import IO, Any
+from uuid import UUID
+
+from loguru import logger
+
+from app.models.api_key import ApiKey
+from app.models.device import Device, DeviceData
+from app.utils.config import get_settings
+
+_HEADER = struct.Struct("<II")
+
+
+def _frame(reading: DeviceData, idempotency_key: str | None = None) -> bytes:
+    record = {
+        "id": str(reading.id),
+        "device_id": str(reading.device_id),
+        "created_date": reading.created_date.isoformat(),
+        "data": reading.data,
+    }
+    if idempotency_key is not None:
+        record["idempotency_key"] = idempotency_key
+    body = json.dumps(record, separators=(",", ":")).encode("utf-8")
+    return _HEADER.pack(len(body), zlib.crc32(body)) + body
+
+
+def read_segment(data: bytes) -> list[DeviceData]:
+    """Readings of a segment, up to the first torn or corrupt record."""
+    return [reading for reading, _ in read_records(data)]
+
+
+def read_records(data: bytes) -> list[tuple[DeviceData, str | None]]:
+    """Readings of a segment with their idempotency keys; see read_segment."""
+    records = []
+    pos = 0
+    while pos + _HEADER.size <= len(data):
+        length, crc = _HEADER.unpack_from(data, pos)
+        start = pos + _HEADER.size
+        end = start + length
+        body = data[start:end]
+        if len(body) < length or zlib.crc32(body) != crc:
+            break
+        record = json.loads(body)
+        created = datetime.fromisoformat(record["created_date"])
+        reading = DeviceData(
+            id=UUID(record["id"]),
+            device_id=UUID(record["device_id"]),
+            data=record["data"],
+            created_date=created,
+            updated_date=created,
+        )
+        records.append((reading, record.get("idempotency_key")))
+        pos = end
+    return records
+
+
+class Spool:
+    """The segment files under one directory, written by this worker."""
+
+    def __init__(
+        self, directory: str | Path, segment_bytes: int, fsync_interval: float
+    ):
+        self.directory = Path(directory)
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self._segment_bytes = segment_bytes
+        self._fsync_interval = fsync_interval
+        self._file: IO[bytes] | None = None
+        self._path: Path | None = None
+        self._size = 0
+        self._pending: list[bytes] = []
+        self._waiters: list[asyncio.Future[None]] = []
+        self._flusher: asyncio.Task[None] | None = None
+        self._write_lock = asyncio.Lock()
+        self.appended = 0
+        self.replayed = 0
+
+    async def append(
+        self, reading: DeviceData, idempotency_key: str | None = None
+    ) -> None:
+        """Return once the reading, and its idempotency key, is synced to disk."""
+        waiter = asyncio.get_running_loop().create_future()
+        self._pending.append(_frame(reading, idempotency_key))
+        self._waiters.append(waiter)
+        if self._flusher is None:
+            self._flusher = asyncio.create_task(self._flush())
+        await waiter
+
+    async def _flush(self) -> None:
+        if self._fsync_interval:
+            await asyncio.sleep(self._fsync_interval)
+        frames, waiters = self._pending, self._waiters
+        self._pending, self._waiters, self._flusher = [], [], None
+        try:
+            async with self._write_lock:
+                await asyncio.to_thread(self._write, b"".join(frames))
+        except Exception as exc:
+            for waiter in waiters:
+                waiter.set_exception(exc)
+            return
+        self.appended += len(frames)
+        for waiter in waiters:
+            waiter.set_result(None)
+
+    def _write(self, data: bytes) -> None:
+        if self._file is None:
+            # Locked under a name replay() does not look at, then renamed: an
+            # unlocked, empty `.seg` could be replayed and unlinked before
+            # this worker writes into it.
+            path = self.directory / f"{time.time_ns()}-{os.getpid()}.seg"
+            partial = path.with_suffix(".tmp")
+            self._file = open(partial, "ab")
+            fcntl.flock(self._file, fcntl.LOCK_EX)
+            os.rename(partial, path)
+            self._path = path
+            self._size = 0
+        self._file.write(data)
+        self._file.flush()
+        os.fsync(self._file.fileno())
+        self._size += len(data)
+        if self._size >= self._segment_bytes:
+            self._seal()
+
+    def _seal(self) -> None:
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+            self._path = None
+
+    async def seal(self) -> None:
+        """Close the active segment so it can be replayed."""
+        async with self._write_lock:
+            self._seal()
+
+    def segments(self) -> list[Path]:
+        """Segments not being written by this worker, oldest first."""
+        return sorted(
+            (path for path in self.directory.glob("*.seg") if path != self._path),
+            key=lambda path: int(path.name.split("-")[0]),
+        )
+
+    def stats(self) -> dict[str, Any]:
+        sizes = {}
+        for path in self.directory.glob("*.seg"):
+            try:
+                sizes[path] = path.stat().st_size
+            except FileNotFoundError:  # replayed in the meantime
+                continue
+        oldest = min((int(path.name.split("-")[0]) for path in sizes), default=None)
+        return {
+            "segments": len(sizes),
+            "bytes": sum(sizes.values()),
+            "lag_seconds": (
+                round((time.time_ns() - oldest) / 1e9, 3) if oldest is not None else 0.0
+            ),
+            "appended": self.appended,
+            "replayed": self.replayed,
+        }
+
+
+async def replay(
+    spool: Spool,
+    store: Callable[[Sequence[DeviceData], Mapping[UUID, str]], Awaitable[int]],
+    batch_size: int,
+) -> int:
+    """
+    Replay every sealed segment that no other worker is replaying, deleting
+    each one once all its readings are stored. A failing batch stops the run
+    and leaves its segment for the next one.
+
+    :param spool: The spool to drain.
+    :param store: Stores a batch, skipping readings already stored, given the
+        idempotency keys by reading ID; returns how many were new.
+    :param batch_size: Readings per call of `store`.
+    :return: The number of readings stored.
+    """
+    # Seal this worker's segment once the older ones are drained; while the
+    # database is down new readings keep going to the same segment.
+    if not spool.segments():
+        await spool.seal()
+    stored = 0
+    for path in spool.segments():
+        try:
+            segment = open(path, "rb")
+        except FileNotFoundError:
+            continue
+        with segment:
+            try:
+                fcntl.flock(segment, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                continue
+            if not path.exists():
+                continue
+            records = read_records(segment.read())
+            for batch in itertools.batched(records, batch_size):
+                stored += await store(
+                    [reading for reading, _ in batch],
+                    {reading.id: key for reading, key in batch if key is not None},
+                )
+            path.unlink()
+            spool.replayed += len(records)
+            logger.info("Replayed {} spooled readings from {}", len(records), path.name)
+    return stored
+
+
+class KeyCache:
+    """
+    Copies of the API keys, with their devices, verified by this worker, so
+    devices keep being authenticated while the database is unreachable.
+    """
+
+    def __init__(self, max_keys: int = 100_000):
+        self._keys: OrderedDict[UUID, ApiKey] = OrderedDict()
+        self._max_keys = max_keys
+
+    def remember(self, api_key: ApiKey) -> None:
+        cached = self._keys.get(api_key.device_id)
+        if (
+            cached is not None
+            and cached.key_hash == api_key.key_hash
+            and cached.revoked == api_key.revoked
+            and cached.device.updated_date == api_key.device.updated_date
+        ):
+            self._keys.move_to_end(api_key.device_id)
+            return
+        copy = ApiKey(**api_key.model_dump())
+        copy.device = Device(**api_key.device.model_dump())
+        self._keys.pop(api_key.device_id, None)
+        self._keys[api_key.device_id] = copy
+        if len(self._keys) > self._max_keys:
+            self._keys.popitem(last=False)
+
+    def get(self, device_id: UUID) -> ApiKey | None:
+        return self._keys.get(device_id)
+
+
+_spool: Spool | None = None
+_keys: KeyCache | None = None
+
+
+def get_spool() -> Spool | None:
+    """The spool under `SPOOL_DIR`, created on first use; None when spooling is off."""
+    global _spool
+    if _spool is None:
+        settings = get_settings()
+        if settings.SPOOL_DIR:
+            _spool = Spool(
+                settings.SPOOL_DIR,
+                segment_bytes=settings.SPOOL_SEGMENT_BYTES,
+                fsync_interval=settings.SPOOL_FSYNC_INTERVAL,
+            )
+    return _spool
+
+
+def get_key_cache() -> KeyCache:
+    global _keys
+    if _keys is None:
+        _keys = KeyCache()
+    return _keys
+
+
+def spool_stats() -> dict[str, Any] | None:
+    """Depth and lag of the spool, or None when spooling is off."""
+    spool = get_spool()
+    return spool.stats() if spool is not None else None
+
+
+async def run_replayer(
+    spool: Spool,
+    store: Callable[[Sequence[DeviceData], Mapping[UUID, str]], Awaitable[int]],
+    batch_size: int,
+    interval: float,
+) -> None:
+    """Replay the spool every `interval` seconds until cancelled."""
+    while True:
+        try:
+            await replay(spool, store, batch_size)
+        except Exception as exc:
+            logger.warning("Spool replay failed, retrying: {}", exc)
+        await asyncio.sleep(interval)
@@ -0,0 +1,411 @@
+"""
+Tiering of old device readings to Parquet files on local disk.
+
+Readings older than a cutoff, rows and compacted chunks alike, are written to
+`<TIER_DIR>/device_id=<id>/month=<YYYY-MM>/part-<uuid>.parquet` and deleted
+from the database together with their typed values. `DataService.list` merges
+them back in, reading only the months in the requested range and pushing the
+time filter down to the row groups. Requires the optional `pyarrow` dependency.
+
+Usage:
+    uv run python -m app.utils.tiering [--older-than-days 90] [--device ID ...]
+        [--batch-size 10000] [--dry-run]
+"""
+
+import argparse
+import asyncio
+import functools
+import itertools
+import json
+import os
+import shutil
+import uuid
+from collections.abc import Iterable, Sequence
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+from typing import Any, Literal
+from uuid import UUID
+
+from sqlalchemy import delete, exists, select, tuple_
+from sqlalchemy.ext.asyncio import AsyncConnection, AsyncEngine, create_async_engine
+
+from app.models.device import DeviceData, DeviceDataChunk
+from app.models.field import DeviceDataValue
+from app.utils.compaction import decode_chunk, hour_of, utc
+from app.utils.config import get_settings
+
+_HOUR = timedelta(hours=1)
+# IDs per `IN (...)` list: asyncpg takes at most 32767 bind parameters a query.
+_IDS_PER_STATEMENT = 10_000
+
+
+def _month(value: datetime) -> str:
+    return utc(value).strftime("%Y-%m")
+
+
+class ColdStore:
+    """Parquet files of tiered readings, partitioned by device and month."""
+
+    def __init__(self, root: str | Path):
+        try:
+            import pyarrow as pa
+            import pyarrow.compute as pc
+            import pyarrow.parquet as pq
+        except ImportError as exc:
+            raise RuntimeError(
+                "TIER_DIR is set but pyarrow is not installed; "
+                "install the 'tiering' extra"
+            ) from exc
+        self._pa = pa
+        self._pc = pc
+        self._pq = pq
+        self.root = Path(root)
+        self._schema = pa.schema(
+            [
+                ("id", pa.binary(16)),
+                ("created_date", pa.timestamp("us", tz="UTC")),
+                ("updated_date", pa.timestamp("us", tz="UTC")),
+                ("data", pa.string()),
+            ]
+        )
+
+    def _device_dir(self, device_id: UUID) -> Path:
+        return self.root / f"device_id={device_id}"
+
+    def write(self, device_id: UUID, readings: Sequence[Any]) -> int:
+        """
+        Write readings of one device, one new part file per month.
+
+        Each file is written under a temporary name and renamed into place, so
+        readers never see a partial file.
+
+        :param readings: Objects or rows with id, data, created_date and updated_date.
+        :return: The number of files written.
+        """
+        months: dict[str, list[Any]] = {}
+        for reading in readings:
+            months.setdefault(_month(reading.created_date), []).append(reading)
+
+        for month, batch in months.items():
+            batch.sort(key=lambda r: utc(r.created_date))
+            table = self._pa.Table.from_pydict(
+                {
+                    "id": [r.id.bytes for r in batch],
+                    "created_date": [utc(r.created_date) for r in batch],
+                    "updated_date": [utc(r.updated_date) for r in batch],
+                    "data": [json.dumps(r.data, separators=(",", ":")) for r in batch],
+                },
+                schema=self._schema,
+            )
+            directory = self._device_dir(device_id) / f"month={month}"
+            directory.mkdir(parents=True, exist_ok=True)
+            name = f"part-{uuid.uuid4()}.parquet"
+            partial = directory / f".{name}.tmp"
+            self._pq.write_table(table, partial, compression="zstd")
+            with open(partial, "rb") as f:
+                os.fsync(f.fileno())
+            partial.rename(directory / name)
+        return len(months)
+
+    def _months(
+        self, device_id: UUID, start: datetime | None, end: datetime | None
+    ) -> list[Path]:
+        device_dir = self._device_dir(device_id)
+        if not device_dir.is_dir():
+            return []
+        return [
+            path
+            for path in sorted(device_dir.iterdir())
+            if path.name.startswith("month=")
+            and (start is None or path.name.removeprefix("month=") >= _month(start))
+            and (end is None or path.name.removeprefix("month=") <= _month(end))
+        ]
+
+    def has_range(
+        self, device_id: UUID, start: datetime | None, end: datetime | None
+    ) -> bool:
+        """Whether the device has tiered months overlapping the range."""
+        return bool(self._months(device_id, start, end))
+
+    def read(
+        self,
+        device_id: UUID,
+        *,
+        start: datetime | None = None,
+        end: datetime | None = None,
+        order: Literal["asc", "desc"] = "desc",
+        wanted: int | None = None,
+    ) -> list[DeviceData]:
+        """
+        Tiered readings of a device in a time range, month by month in `order`,
+        stopping after the month in which `wanted` readings are reached.
+
+        :param start: Only readings created at or after this time.
+        :param end: Only readings created before this time.
+        :param order: "asc" or "desc" by created_date.
+        :param wanted: Stop once this many readings are collected.
+        :return: Transient DeviceData objects.
+        """
+        months = self._months(device_id, start, end)
+        if order == "desc":
+            months.reverse()
+        filters = []
+        if start is not None:
+            filters.append(("created_date", ">=", utc(start)))
+        if end is not None:
+            filters.append(("created_date", "<", utc(end)))
+
+        readings: list[DeviceData] = []
+        for month_dir in months:
+            files = sorted(month_dir.glob("part-*.parquet"))
+            if not files:
+                continue
+            table = self._pq.read_table(files, filters=filters or None)
+            rows = sorted(
+                table.to_pylist(),
+                key=lambda row: row["created_date"],
+                reverse=order == "desc",
+            )
+            readings.extend(
+                DeviceData(
+                    id=UUID(bytes=row["id"]),
+                    device_id=device_id,
+                    data=json.loads(row["data"]),
+                    created_date=row["created_date"],
+                    updated_date=row["updated_date"],
+                )
+                for row in rows
+            )
+            if wanted is not None and len(readings) >= wanted:
+                break
+        return readings
+
+    def delete_range(
+        self, device_id: UUID, start: datetime | None, end: datetime | None
+    ) -> int:
+        """
+        Delete the tiered readings of a device in a time range. Part files
+        holding readings on both sides of the range are rewritten without them;
+        the new file is in place before the old one is removed, so a crash in
+        between leaves duplicates, which readers drop.
+
+        :param start: Delete readings created at or after this time.
+        :param end: Delete readings created before this time.
+        :return: The number of readings deleted.
+        """
+        deleted = 0
+        for month_dir in self._months(device_id, start, end):
+            for path in sorted(month_dir.glob("part-*.parquet")):
+                table = self._pq.read_table(path)
+                created = table.column("created_date")
+                outside = []
+                if start is not None:
+                    outside.append(self._pc.less(created, utc(start)))
+                if end is not None:
+                    outside.append(self._pc.greater_equal(created, utc(end)))
+                if outside:
+                    kept = table.filter(functools.reduce(self._pc.or_, outside))
+                else:
+                    kept = table.slice(0, 0)
+                if kept.num_rows == table.num_rows:
+                    continue
+                if kept.num_rows:
+                    name = f"part-{uuid.uuid4()}.parquet"
+                    partial = month_dir / f".{name}.tmp"
+                    self._pq.write_table(kept, partial, compression="zstd")
+                    with open(partial, "rb") as f:
+                        os.fsync(f.fileno())
+                    partial.rename(month_dir / name)
+                path.unlink()
+                deleted += table.num_rows - kept.num_rows
+        return deleted
+
+    def delete_device(self, device_id: UUID) -> None:
+        shutil.rmtree(self._device_dir(device_id), ignore_errors=True)
+
+
+_cold_store: ColdStore | None = None
+
+
+def get_cold_store() -> ColdStore | None:
+    """The store under `TIER_DIR`, created on first use; None when tiering is off."""
+    global _cold_store
+    if _cold_store is None:
+        root = get_settings().TIER_DIR
+        if root:
+            _cold_store = ColdStore(root)
+    return _cold_store
+
+
+async def _delete_ids(conn: AsyncConnection, column: Any, ids: Sequence[UUID]) -> None:
+    """Delete the rows whose `column` is in `ids`, a bounded list at a time."""
+    for part in itertools.batched(ids, _IDS_PER_STATEMENT):
+        await conn.execute(delete(column.table).where(column.in_(part)))
+
+
+async def tier(
+    engine: AsyncEngine,
+    store: ColdStore,
+    older_than: datetime,
+    *,
+    devices: Iterable[UUID] | None = None,
+    batch_size: int = 10_000,
+    dry_run: bool = False,
+) -> dict[str, int]:
+    """
+    Move readings created before `older_than` from the database to Parquet.
+
+    Each batch is written and synced to disk before its rows and their typed
+    values are deleted. A crash in between leaves the batch in both places;
+    DataService.list drops the duplicates by ID and the next run moves the
+    rows again. Typed values left behind by earlier runs are deleted as well,
+    since DataService.aggregate reads the files for tiered readings.
+
+    :param engine: The database holding the readings (the primary or a shard).
+    :param store: Where to write the files.
+    :param older_than: Only readings created before this time are moved;
+        chunks are moved when their whole hour is before it.
+    :param devices: Only these devices; default is every device with old readings.
+    :param batch_size: Rows read per batch.
+    :param dry_run: Count what would move without writing anything.
+    :return: readings and files.
+    """
+    table = DeviceData.__table__  # type: ignore[attr-defined]
+    chunk_table = DeviceDataChunk.__table__  # type: ignore[attr-defined]
+    values_table = DeviceDataValue.__table__  # type: ignore[attr-defined]
+    report = {"readings": 0, "files": 0}
+
+    if devices is None:
+        async with engine.connect() as conn:
+            result = await conn.execute(
+                select(table.c.device_id)
+                .where(table.c.created_date < older_than)
+                .union(
+                    select(chunk_table.c.device_id).where(
+                        chunk_table.c.start <= older_than - _HOUR
+                    )
+                )
+            )
+            devices = result.scalars().all()
+
+    for device_id in devices:
+        last = None
+        while True:
+            async with engine.connect() as conn:
+                statement = (
+                    select(table)
+                    .where(
+                        table.c.device_id == device_id,
+                        table.c.created_date < older_than,
+                    )
+                    .order_by(table.c.created_date, table.c.id)
+                    .limit(batch_size)
+                )
+                if last is not None:
+                    statement = statement.where(
+                        tuple_(table.c.created_date, table.c.id) > last
+                    )
+                rows = (await conn.execute(statement)).all()
+            if not rows:
+                break
+            last = (rows[-1].created_date, rows[-1].id)
+            report["readings"] += len(rows)
+            if dry_run:
+                continue
+            report["files"] += await asyncio.to_thread(store.write, device_id, rows)
+            ids = [row.id for row in rows]
+            async with engine.begin() as conn:
+                await _delete_ids(conn, values_table.c.data_id, ids)
+                await _delete_ids(conn, table.c.id, ids)
+
+        async with engine.connect() as conn:
+            result = await conn.execute(
+                select(chunk_table.c.id).where(
+                    chunk_table.c.device_id == device_id,
+                    chunk_table.c.start <= older_than - _HOUR,
+                )
+            )
+            chunk_ids: Sequence[UUID] = result.scalars().all()
+        for chunk_id in chunk_ids:
+            async with engine.connect() as conn:
+                result = await conn.execute(
+                    select(chunk_table).where(chunk_table.c.id == chunk_id)
+                )
+                chunk = DeviceDataChunk(**result.one()._mapping)
+            readings = decode_chunk(chunk)
+            report["readings"] += len(readings)
+            if dry_run:
+                continue
+            report["files"] += await asyncio.to_thread(store.write, device_id, readings)
+            async with engine.begin() as conn:
+                await _delete_ids(
+                    conn, values_table.c.data_id, [r.id for r in readings]
+                )
+                await conn.execute(
+                    delete(chunk_table).where(chunk_table.c.id == chunk.id)
+                )
+
+        if dry_run:
+            continue
+        # Every reading before the hour of the cutoff is now in the files,
+        # short of rows that arrived late; keep the values of those.
+        orphaned = [
+            values_table.c.device_id == device_id,
+            values_table.c.created_date < hour_of(older_than),
+            ~exists().where(table.c.id == values_table.c.data_id),
+        ]
+        while True:
+            async with engine.begin() as conn:
+                result = await conn.execute(
+                    select(values_table.c.id).where(*orphaned).limit(batch_size)
+                )
+                value_ids: Sequence[UUID] = result.scalars().all()
+                await _delete_ids(conn, values_table.c.id, value_ids)
+            if len(value_ids) < batch_size:
+                break
+    return report
+
+
+async def _main(args: argparse.Namespace) -> None:
+    from app.utils.sharding import get_shard_map
+
+    store = get_cold_store()
+    if store is None:
+        raise SystemExit("TIER_DIR is not configured")
+
+    shard_map = get_shard_map()
+    engines = dict(shard_map.engines)
+    primary = None
+    if not engines:
+        primary = create_async_engine(get_settings().async_database_url)
+        engines = {"(primary)": primary}
+
+    older_than = datetime.now(timezone.utc) - timedelta(days=args.older_than_days)
+    total = 0
+    for name, engine in engines.items():
+        report = await tier(
+            engine,
+            store,
+            older_than,
+            devices=args.device or None,
+            batch_size=args.batch_size,
+            dry_run=args.dry_run,
+        )
+        print(f"  {name}: {report['readings']} readings, {report['files']} files")
+        total += report["readings"]
+
+    await shard_map.dispose()
+    if primary is not None:
+        await primary.dispose()
+
+    verb = "Would move" if args.dry_run else "Moved"
+    print(f"\n{verb} {total} readings to {store.root}.")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--older-than-days", type=float, default=90)
+    parser.add_argument("--device", type=UUID, action="append")
+    parser.add_argument("--batch-size", type=int, default=10_000)
+    parser.add_argument("--dry-run", action="store_true")
+    asyncio.run(_main(parser.parse_args()))
@@ -0,0 +1,156 @@
+from collections import OrderedDict
+from collections.abc import Sequence
+from datetime import datetime
+from typing import Annotated, Any, Literal, NotRequired, Required, TypedDict, Union
+from uuid import UUID
+
+from pydantic import ConfigDict, Field, TypeAdapter, ValidationError
+
+from app.exceptions import InvalidDataError
+from app.schemas.device_schema import JsonSchema, PayloadSchema
+
+
+def _object_type(schema: JsonSchema, name: str) -> Any:
+    if not schema.properties and schema.additional_properties:
+        return dict[str, Any]
+    fields = {
+        key: (Required if key in schema.required else NotRequired)[
+            _python_type(value, f"{name}_{key}")
+        ]
+        for key, value in schema.properties.items()
+    }
+    typed = TypedDict(name, fields)  # type: ignore[misc]
+    # Extra keys pass through unchecked; the stored reading is the original
+    # dict, not the validated copy.
+    typed.__pydantic_config__ = ConfigDict(  # type: ignore[attr-defined]
+        extra="ignore" if schema.additional_properties else "forbid"
+    )
+    return typed
+
+
+def _json_type(kind: str, schema: JsonSchema, name: str) -> Any:
+    if kind in ("number", "integer"):
+        return Annotated[
+            float if kind == "number" else int,
+            Field(
+                ge=schema.minimum,
+                le=schema.maximum,
+                gt=schema.exclusive_minimum,
+                lt=schema.exclusive_maximum,
+            ),
+        ]
+    if kind == "string":
+        return Annotated[
+            str, Field(min_length=schema.min_length, max_length=schema.max_length)
+        ]
+    if kind == "array":
+        items = _python_type(schema.items, f"{name}_item") if schema.items else Any
+        return Annotated[
+            list[items],  # type: ignore[valid-type]
+            Field(min_length=schema.min_items, max_length=schema.max_items),
+        ]
+    if kind == "object":
+        return _object_type(schema, name)
+    if kind == "boolean":
+        return bool
+    return None
+
+
+def _python_type(schema: JsonSchema, name: str) -> Any:
+    """The type annotation pydantic validates a value against `schema` with."""
+    if schema.enum is not None:
+        return Literal[tuple(schema.enum)]
+    kinds = [schema.type] if isinstance(schema.type, str) else schema.type
+    if kinds is None:
+        kinds = ["object"] if schema.properties else []
+    if not kinds:
+        return Any
+    alternatives = tuple(_json_type(kind, schema, name) for kind in kinds)
+    return alternatives[0] if len(alternatives) == 1 else Union[alternatives]
+
+
+class PayloadValidator:
+    """A device's payload schema compiled once into pydantic validators."""
+
+    def __init__(self, schema: PayloadSchema):
+        payload = _python_type(schema.as_json_schema(), "Payload")
+        self._one: TypeAdapter[Any] = TypeAdapter(payload)
+        self._many: TypeAdapter[Any] = TypeAdapter(list[payload])  # type: ignore[valid-type]
+
+    def validate(self, data: dict[str, Any]) -> None:
+        """:raises InvalidDataError: With pydantic's error list as detail."""
+        try:
+            self._one.validate_python(data, strict=True)
+        except ValidationError as exc:
+            raise InvalidDataError(exc.errors(include_url=False)) from None
+
+    def validate_many(
+        self, readings: Sequence[dict[str, Any]]
+    ) -> dict[int, InvalidDataError]:
+        """
+        Validate a batch in one call.
+
+        :return: An InvalidDataError with pydantic's error list as detail for
+            every offending reading, by its index; empty when all are valid.
+        """
+        try:
+            self._many.validate_python(readings, strict=True)
+        except ValidationError as exc:
+            errors: dict[int, list[Any]] = {}
+            for error in exc.errors(include_url=False):
+                index, *loc = error["loc"]
+                errors.setdefault(int(index), []).append({**error, "loc": tuple(loc)})
+            return {index: InvalidDataError(detail) for index, detail in errors.items()}
+        return {}
+
+
+class ValidatorCache:
+    """
+    Compiled validators of the devices seen by this worker, keyed by device
+    ID and revision. The revision is the device's `updated_date`, so a schema
+    changed through another worker is recompiled on its next reading.
+    """
+
+    def __init__(self, max_devices: int = 10_000):
+        self._validators: OrderedDict[UUID, tuple[datetime, PayloadValidator]] = (
+            OrderedDict()
+        )
+        self._max_devices = max_devices
+
+    def get(
+        self, device_id: UUID, revision: datetime, notes: dict[str, Any] | None
+    ) -> PayloadValidator | None:
+        """
+        The device's validator, compiled on first use.
+
+        :param device_id: The ID of the device.
+        :param revision: The device's `updated_date`.
+        :param notes: The device's notes.
+        :return: None when the device has no `notes["schema"]`.
+        """
+        if not notes or "schema" not in notes:
+            self._validators.pop(device_id, None)
+            return None
+        cached = self._validators.get(device_id)
+        if cached is not None and cached[0] == revision:
+            self._validators.move_to_end(device_id)
+            return cached[1]
+        validator = PayloadValidator(PayloadSchema.model_validate(notes["schema"]))
+        self._validators[device_id] = (revision, validator)
+        self._validators.move_to_end(device_id)
+        if len(self._validators) > self._max_devices:
+            self._validators.popitem(last=False)
+        return validator
+
+    def invalidate(self, device_id: UUID) -> None:
+        self._validators.pop(device_id, None)
+
+
+_validators: ValidatorCache | None = None
+
+
+def get_validators() -> ValidatorCache:
+    global _validators
+    if _validators is None:
+        _validators = ValidatorCache()
+    return _validators
@@ -0,0 +1,222 @@
+"""
+Cache of read responses over the sealed past.
+
+Readings older than `CACHE_SEALED_AFTER` seconds no longer arrive, so a list
+or aggregate whose `end` is before that cutoff gives the same answer until
+something in its range is deleted. Such responses are kept, serialised, in an
+LRU bounded to `CACHE_MAX_BYTES` per worker, and with `CACHE_DIR` set also in
+files shared by the workers, bounded to `CACHE_DIR_MAX_BYTES`. They are sent
+with `Cache-Control: public, max-age=CACHE_MAX_AGE`.
+
+Every device has a `data_version` that deleting its readings, or storing one
+in the sealed past (a late spool replay), increments. It is part of the cache
+key, so the other workers and the files stop matching as soon as it changes;
+`invalidate` only frees this worker's memory early.
+"""
+
+import asyncio
+import hashlib
+import os
+import uuid
+from collections import OrderedDict
+from collections.abc import Awaitable, Callable, Mapping
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+from typing import Any
+from uuid import UUID
+
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse, Response
+from loguru import logger
+from starlette.requests import Request
+
+from app.utils.coalesce import request_key
+from app.utils.compaction import utc
+from app.utils.config import get_settings
+
+
+def sealed(end: datetime | None) -> bool:
+    """Whether a range ending at `end` lies entirely in the sealed past."""
+    if end is None:
+        return False
+    cutoff = datetime.now(timezone.utc) - timedelta(
+        seconds=get_settings().CACHE_SEALED_AFTER
+    )
+    return utc(end) <= cutoff
+
+
+class WindowCache:
+    """LRU of serialised responses in memory, over optional files on disk."""
+
+    def __init__(
+        self,
+        max_bytes: int,
+        directory: str | Path | None = None,
+        dir_max_bytes: int = 0,
+    ):
+        self.max_bytes = max_bytes
+        self.directory = Path(directory) if directory else None
+        self.dir_max_bytes = dir_max_bytes
+        self._entries: OrderedDict[str, tuple[bytes, frozenset[UUID]]] = OrderedDict()
+        self._bytes = 0
+        self._written = 0
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def _path(self, key: str) -> Path:
+        assert self.directory is not None
+        return self.directory / key[:2] / f"{key}.json"
+
+    def get(self, key: str) -> bytes | None:
+        """The response in memory, marking it most recently used."""
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        self._entries.move_to_end(key)
+        return entry[0]
+
+    def put(self, key: str, body: bytes, device_ids: frozenset[UUID]) -> None:
+        """Keep a response in memory, evicting the least recently used."""
+        # One response may not take more than a quarter of the budget.
+        if len(body) > self.max_bytes // 4:
+            return
+        previous = self._entries.pop(key, None)
+        if previous is not None:
+            self._bytes -= len(previous[0])
+        self._entries[key] = (body, device_ids)
+        self._bytes += len(body)
+        while self._bytes > self.max_bytes:
+            _, (evicted, _) = self._entries.popitem(last=False)
+            self._bytes -= len(evicted)
+            self.evictions += 1
+
+    def load(self, key: str) -> bytes | None:
+        """The response on disk, if any; blocking, run it in a thread."""
+        if self.directory is None:
+            return None
+        path = self._path(key)
+        try:
+            body = path.read_bytes()
+            os.utime(path)
+        except OSError:
+            return None
+        return body
+
+    def store(self, key: str, body: bytes) -> None:
+        """
+        Write a response to disk under a temporary name and rename it into
+        place, trimming the directory now and then; blocking, run it in a
+        thread.
+        """
+        if self.directory is None:
+            return
+        path = self._path(key)
+        try:
+            path.parent.mkdir(parents=True, exist_ok=True)
+            partial = path.with_name(f".{path.name}.{uuid.uuid4().hex}.tmp")
+            partial.write_bytes(body)
+            partial.replace(path)
+        except OSError as exc:
+            logger.warning("Writing cached response {} failed: {}", path, exc)
+            return
+        self._written += len(body)
+        if self._written > self.dir_max_bytes // 10:
+            self._written = 0
+            self.trim_directory()
+
+    def invalidate(self, device_id: UUID) -> None:
+        """Drop this worker's entries that include the device."""
+        for key in [k for k, (_, ids) in self._entries.items() if device_id in ids]:
+            body, _ = self._entries.pop(key)
+            self._bytes -= len(body)
+
+    def trim_directory(self) -> None:
+        """Delete the least recently used files until the directory fits its budget."""
+        if self.directory is None:
+            return
+        files = []
+        total = 0
+        for path in self.directory.glob("*/*.json"):
+            try:
+                stat = path.stat()
+            except OSError:
+                continue
+            files.append((stat.st_mtime, stat.st_size, path))
+            total += stat.st_size
+        files.sort()
+        for _, size, path in files:
+            if total <= self.dir_max_bytes:
+                break
+            path.unlink(missing_ok=True)
+            total -= size
+
+    def stats(self) -> dict[str, Any]:
+        return {
+            "entries": len(self._entries),
+            "bytes": self._bytes,
+            "hits": self.hits,
+            "disk_hits": self.disk_hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+        }
+
+
+async def cached_json(
+    request: Request,
+    versions: Mapping[UUID, int],
+    build: Callable[[], Awaitable[Any]],
+) -> Response:
+    """
+    Answer a read over the sealed past from the cache, or build, serialise
+    and keep the response.
+
+    :param request: The request; its path, query and credentials are the key.
+    :param versions: `data_version` of every device the response covers.
+    :param build: Produces the response content on a miss.
+    :return: The JSON response with a long-lived Cache-Control header.
+    """
+    cache = get_window_cache()
+    digest = hashlib.sha256(repr(request_key(request)).encode("utf-8"))
+    for device_id, version in sorted(versions.items()):
+        digest.update(f"|{device_id}={version}".encode("utf-8"))
+    key = digest.hexdigest()
+
+    body = cache.get(key)
+    if body is not None:
+        cache.hits += 1
+    elif cache.directory is not None:
+        body = await asyncio.to_thread(cache.load, key)
+        if body is not None:
+            cache.disk_hits += 1
+            cache.put(key, body, frozenset(versions))
+    if body is None:
+        cache.misses += 1
+        body = bytes(JSONResponse(jsonable_encoder(await build())).body)
+        cache.put(key, body, frozenset(versions))
+        if cache.directory is not None:
+            await asyncio.to_thread(cache.store, key, body)
+    return Response(
+        content=body,
+        media_type="application/json",
+        headers={"Cache-Control": f"public, max-age={get_settings().CACHE_MAX_AGE}"},
+    )
+
+
+_window_cache: WindowCache | None = None
+
+
+def get_window_cache() -> WindowCache:
+    """The cache configured by the CACHE_* settings, created on first use."""
+    global _window_cache
+    if _window_cache is None:
+        settings = get_settings()
+        _window_cache = WindowCache(
+            settings.CACHE_MAX_BYTES, settings.CACHE_DIR, settings.CACHE_DIR_MAX_BYTES
+        )
+    return _window_cache
+
+
+def window_cache_stats() -> dict[str, Any]:
+    return get_window_cache().stats()
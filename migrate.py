@@ -2,22 +2,57 @@
 One-time migration script to import data from devices.json (MongoDB export)
 into the new PostgreSQL schema.
 
+The export is parsed incrementally, so memory use does not grow with its size.
+Readings are loaded with COPY in batches of `--batch-size`, each committed on
+its own, by `--workers` connections in parallel (on the device's shard when
+`DATA_SHARDS` is set). Devices and readings get IDs derived from their
+position in the export, and every committed batch is
+recorded in a checkpoint file, so a run that is interrupted continues where it
+stopped when started again with the same export and batch size. `--dry-run`
+parses the whole export and reports what would be imported without touching
+the database.
+
 Usage:
-    uv run python migrate.py [--file devices.json] [--dry-run]
+    uv run python migrate.py [--file devices.json] [--dry-run] [--workers 4]
+        [--batch-size 10000] [--checkpoint devices.json.checkpoint] [--restart]
 """
 
 import argparse
 import asyncio
+import codecs
 import json
+import os
+import re
+import sys
+import time
 import uuid
+from collections.abc import Iterator
+from dataclasses import dataclass, field
 from datetime import datetime, timezone
 from pathlib import Path
+from typing import IO, Any
 
-from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker, create_async_engine
+from sqlalchemy import update
+from sqlalchemy.ext.asyncio import AsyncEngine, create_async_engine
 
 from app.models.api_key import ApiKey  # noqa: F401
 from app.models.device import Device, DeviceData
+from app.models.field import DeviceField
+from app.services.data_service import _is_number, _json_type
 from app.utils.config import settings
+from app.utils.database import copy_records, dialect_insert
+from app.utils.sharding import ShardMap, get_shard_map
+
+# Device IDs are derived from the position of the device document in the
+# export in this namespace, and reading IDs from the device ID and the
+# reading's position in the document.
+_NAMESPACE = uuid.UUID("6f1d0c38-5b7e-4d8a-9e43-2a7c1b9f0e55")
+_MAX_KEY_LENGTH = 255
+_COLUMNS = ["id", "device_id", "data", "created_date", "updated_date"]
+_WHITESPACE = re.compile(r"[ \t\n\r]*")
+_DECODER = json.JSONDecoder()
+# Largest single value, e.g. one reading, the reader will buffer.
+_MAX_VALUE = 64 << 20
 
 
 def parse_dt(value: str) -> datetime:
@@ -27,53 +62,501 @@ def parse_dt(value: str) -> datetime:
     return dt
 
 
-async def migrate(file: Path, dry_run: bool) -> None:
-    raw = json.loads(file.read_text())
+class ExportReader:
+    """
+    Incremental reader of the export: a JSON array of device documents, each
+    holding its readings under `data`. Only one reading, or one other value of
+    a device document, is decoded at a time.
+    """
 
-    engine = create_async_engine(settings.async_database_url, echo=False)
-    session_factory = async_sessionmaker(
-        engine, class_=AsyncSession, expire_on_commit=False
-    )
+    def __init__(self, file: IO[bytes], chunk_size: int = 1 << 20):
+        self._file = file
+        self._chunk_size = chunk_size
+        self._decoder = codecs.getincrementaldecoder("utf-8")()
+        self._buffer = ""
+        self._pos = 0
+        self._eof = False
+        self.bytes_read = 0
+
+    def _fill(self) -> bool:
+        """Append the next chunk to the buffer; False at the end of the file."""
+        if self._eof:
+            return False
+        chunk = self._file.read(self._chunk_size)
+        self.bytes_read += len(chunk)
+        self._eof = not chunk
+        consumed = self._pos
+        self._buffer = self._buffer[consumed:] + self._decoder.decode(
+            chunk, final=self._eof
+        )
+        self._pos = 0
+        return not self._eof
 
-    async with session_factory() as session:
-        for device_doc in raw:
-            device = Device(
-                name=device_doc.get("device_id", "").title(),
-                notes=device_doc.get("notes", {}),
-                api_key=None,
-                created_date=parse_dt(device_doc.get("created_date", None)),
+    def _peek(self) -> str:
+        while True:
+            self._pos = _WHITESPACE.match(self._buffer, self._pos).end()  # type: ignore[union-attr]
+            if self._pos < len(self._buffer):
+                return self._buffer[self._pos]
+            if not self._fill():
+                raise ValueError("Unexpected end of export")
+
+    def _expect(self, char: str) -> None:
+        if self._peek() != char:
+            raise ValueError(
+                f"Expected {char!r} near byte {self.bytes_read} of the export"
             )
-            session.add(device)
-
-            records = [
-                DeviceData(
-                    id=uuid.uuid4(),
-                    device_id=device.id,
-                    data=record["data"],
-                    created_date=parse_dt(record["created_date"]),
-                    updated_date=parse_dt(record["created_date"]),
+        self._pos += 1
+
+    def _value(self) -> Any:
+        self._peek()
+        while True:
+            try:
+                value, end = _DECODER.raw_decode(self._buffer, self._pos)
+            except json.JSONDecodeError:
+                # Corrupt input must not pull the rest of the file into memory.
+                if len(self._buffer) - self._pos < _MAX_VALUE and self._fill():
+                    continue
+                raise
+            # A number ending with the buffer may go on in the next chunk.
+            if end == len(self._buffer) and self._fill():
+                continue
+            self._pos = end
+            return value
+
+    def _elements(self, close: str) -> Iterator[None]:
+        """Step through the elements of an open array or object."""
+        if self._peek() == close:
+            self._pos += 1
+            return
+        while True:
+            yield
+            char = self._peek()
+            self._pos += 1
+            if char == close:
+                return
+            if char != ",":
+                raise ValueError(
+                    f"Expected ',' or {close!r} near byte {self.bytes_read} of the export"
                 )
-                for record in device_doc["data"]
-            ]
-            for r in records:
-                session.add(r)
 
-            print(f"  {device.name}: {len(records)} records")
+    def items(self) -> Iterator[tuple[str, Any]]:
+        """
+        `("device", fields)` for each device document once the keys before its
+        `data` are read, `("reading", record)` for each of its readings, then
+        `("end", fields)` with every key of the document but `data`.
+        """
+        self._expect("[")
+        for _ in self._elements("]"):
+            self._expect("{")
+            fields: dict[str, Any] = {}
+            announced = False
+            for _ in self._elements("}"):
+                key = self._value()
+                self._expect(":")
+                if key != "data":
+                    fields[key] = self._value()
+                    continue
+                yield "device", dict(fields)
+                announced = True
+                self._expect("[")
+                for _ in self._elements("]"):
+                    yield "reading", self._value()
+            if not announced:
+                yield "device", dict(fields)
+            yield "end", fields
 
-        if dry_run:
-            print("\nDry run — rolling back.")
-            await session.rollback()
+
+@dataclass
+class ImportDevice:
+    index: int
+    fields: dict[str, Any]
+    readings: int = 0
+    # key -> [count, numeric_count, last_type] for the field registry
+    keys: dict[str, list[Any]] = field(default_factory=dict)
+    skip: bool = False
+    resumed: bool = False
+    pending: int = 0
+    ended: bool = False
+
+    @property
+    def id(self) -> uuid.UUID:
+        return uuid.uuid5(_NAMESPACE, str(self.index))
+
+    @property
+    def key(self) -> str:
+        """The device's key in the checkpoint."""
+        return str(self.index)
+
+    @property
+    def name(self) -> str:
+        # Until the document's `device_id` is read the unique name column
+        # gets a placeholder.
+        return self.fields.get("device_id", f"import {self.index}").title()
+
+
+def _device_columns(device: ImportDevice) -> dict[str, Any]:
+    created = device.fields.get("created_date")
+    return {
+        "name": device.name,
+        "notes": device.fields.get("notes", {}),
+        "created_date": (parse_dt(created) if created else datetime.now(timezone.utc)),
+    }
+
+
+class Checkpoint:
+    """
+    The batches committed per device and the devices fully imported, keyed by
+    the device's position in the export and saved to
+    a JSON file after every change. What was recorded when the run started is
+    kept apart, so the parsing thread can consult it while workers add to it.
+    """
+
+    def __init__(self, path: Path | None, batch_size: int, restart: bool = False):
+        self._path = path
+        self._batch_size = batch_size
+        self._complete: set[str] = set()
+        self._batches: dict[str, set[int]] = {}
+        if path is not None and path.exists() and not restart:
+            state = json.loads(path.read_text())
+            if state["batch_size"] != batch_size:
+                raise SystemExit(
+                    f"{path} was written with --batch-size {state['batch_size']}; "
+                    "use the same batch size or --restart"
+                )
+            self._complete = set(state["complete"])
+            self._batches = {
+                name: set(batches) for name, batches in state["batches"].items()
+            }
+        self._started_complete = frozenset(self._complete)
+        self._started_batches = {
+            name: frozenset(batches) for name, batches in self._batches.items()
+        }
+
+    def was_complete(self, key: str) -> bool:
+        return key in self._started_complete
+
+    def was_started(self, key: str) -> bool:
+        return key in self._started_batches
+
+    def was_loaded(self, key: str, index: int) -> bool:
+        return index in self._started_batches.get(key, ())
+
+    def mark_started(self, key: str) -> None:
+        """Record a device before its first batch, which may commit unrecorded."""
+        self._batches.setdefault(key, set())
+        self._save()
+
+    def mark_batch(self, key: str, index: int) -> None:
+        self._batches.setdefault(key, set()).add(index)
+        self._save()
+
+    def mark_complete(self, key: str) -> None:
+        self._batches.pop(key, None)
+        self._complete.add(key)
+        self._save()
+
+    def _save(self) -> None:
+        if self._path is None:
+            return
+        state = {
+            "batch_size": self._batch_size,
+            "complete": sorted(self._complete),
+            "batches": {
+                name: sorted(batches) for name, batches in self._batches.items()
+            },
+        }
+        temp = self._path.with_name(self._path.name + ".tmp")
+        temp.write_text(json.dumps(state))
+        os.replace(temp, self._path)
+
+
+def plan(
+    reader: ExportReader, batch_size: int, checkpoint: Checkpoint
+) -> Iterator[tuple[str, ImportDevice, int, list[tuple[Any, ...]]]]:
+    """
+    Turn the export into `("device", device, 0, [])`, then
+    `("batch", device, index, rows)` for each batch of its readings still to
+    load, then `("end", device, 0, [])`. Rows are COPY-ready tuples of
+    `_COLUMNS`, with `data` as JSON text.
+    """
+    device: ImportDevice | None = None
+    rows: list[tuple[Any, ...]] = []
+    documents = 0
+    for kind, value in reader.items():
+        if kind == "reading":
+            assert device is not None
+            index = device.readings
+            device.readings += 1
+            if device.skip:
+                continue
+            for key, item in value["data"].items():
+                if len(key) > _MAX_KEY_LENGTH:
+                    continue
+                stats = device.keys.setdefault(key, [0, 0, ""])
+                stats[0] += 1
+                stats[1] += int(_is_number(item))
+                stats[2] = _json_type(item)
+            if checkpoint.was_loaded(device.key, index // batch_size):
+                continue
+            created = parse_dt(value["created_date"])
+            rows.append(
+                (
+                    uuid.uuid5(device.id, str(index)),
+                    device.id,
+                    json.dumps(value["data"], separators=(",", ":")),
+                    created,
+                    created,
+                )
+            )
+            if len(rows) == batch_size:
+                yield "batch", device, index // batch_size, rows
+                rows = []
+        elif kind == "device":
+            device = ImportDevice(index=documents, fields=value)
+            device.skip = checkpoint.was_complete(device.key)
+            device.resumed = checkpoint.was_started(device.key)
+            documents += 1
+            yield "device", device, 0, []
         else:
-            await session.commit()
-            print("\nMigration complete.")
+            assert device is not None
+            if rows:
+                yield "batch", device, (device.readings - 1) // batch_size, rows
+                rows = []
+            device.fields = value
+            yield "end", device, 0, []
 
-    await engine.dispose()
+
+class Migration:
+
+    def __init__(
+        self,
+        engine: AsyncEngine,
+        shards: ShardMap,
+        checkpoint: Checkpoint,
+        workers: int,
+    ):
+        self._engine = engine
+        self._shards = shards
+        self._checkpoint = checkpoint
+        self._workers = workers
+        self.devices = 0
+        self.readings = 0
+
+    def _data_engine(self, device_id: uuid.UUID) -> AsyncEngine:
+        if not self._shards.enabled:
+            return self._engine
+        return self._shards.engines[self._shards.shard_for(device_id)]
+
+    async def _insert_device(self, device: ImportDevice) -> None:
+        table = Device.__table__  # type: ignore[attr-defined]
+        async with self._engine.begin() as conn:
+            statement = dialect_insert(table, conn.dialect.name).values(
+                id=device.id,
+                updated_date=datetime.now(timezone.utc),
+                **_device_columns(device),
+            )
+            await conn.execute(statement.on_conflict_do_nothing(index_elements=["id"]))
+
+    async def _finish_device(self, device: ImportDevice) -> None:
+        """Store the device's keys missed before `data` and its field registry."""
+        device_table = Device.__table__  # type: ignore[attr-defined]
+        field_table = DeviceField.__table__  # type: ignore[attr-defined]
+        async with self._engine.begin() as conn:
+            await conn.execute(
+                update(device_table)
+                .where(device_table.c.id == device.id)
+                .values(**_device_columns(device))
+            )
+            if device.keys:
+                now = datetime.now(timezone.utc)
+                statement = dialect_insert(field_table, conn.dialect.name).values(
+                    [
+                        {
+                            "id": uuid.uuid4(),
+                            "device_id": device.id,
+                            "key": key,
+                            "count": count,
+                            "numeric_count": numeric_count,
+                            "last_type": last_type,
+                            "created_date": now,
+                            "updated_date": now,
+                        }
+                        for key, (
+                            count,
+                            numeric_count,
+                            last_type,
+                        ) in device.keys.items()
+                    ]
+                )
+                # Counts cover every reading of the export, so a resumed
+                # device overwrites them instead of adding to them.
+                await conn.execute(
+                    statement.on_conflict_do_update(
+                        index_elements=[field_table.c.device_id, field_table.c.key],
+                        set_={
+                            "count": statement.excluded.count,
+                            "numeric_count": statement.excluded.numeric_count,
+                            "last_type": statement.excluded.last_type,
+                        },
+                    )
+                )
+        self._checkpoint.mark_complete(device.key)
+        self.devices += 1
+        print(f"  {device.name}: {device.readings} records")
+
+    async def _load(self, queue: asyncio.Queue) -> None:
+        while (item := await queue.get()) is not None:
+            device, index, rows = item
+            await copy_records(
+                self._data_engine(device.id),
+                DeviceData.__table__,  # type: ignore[attr-defined]
+                _COLUMNS,
+                rows,
+                on_conflict="ignore" if device.resumed else "error",
+            )
+            self._checkpoint.mark_batch(device.key, index)
+            self.readings += len(rows)
+            device.pending -= 1
+            if device.ended and device.pending == 0:
+                await self._finish_device(device)
+
+    async def _produce(self, steps: Iterator, queue: asyncio.Queue) -> None:
+        while (step := await asyncio.to_thread(next, steps, None)) is not None:
+            kind, device, index, rows = step
+            if device.skip:
+                continue
+            if kind == "device":
+                await self._insert_device(device)
+                self._checkpoint.mark_started(device.key)
+            elif kind == "batch":
+                device.pending += 1
+                await queue.put((device, index, rows))
+            else:
+                device.ended = True
+                if device.pending == 0:
+                    await self._finish_device(device)
+        for _ in range(self._workers):
+            await queue.put(None)
+
+    async def run(self, steps: Iterator) -> None:
+        queue: asyncio.Queue = asyncio.Queue(maxsize=self._workers * 2)
+        async with asyncio.TaskGroup() as group:
+            group.create_task(self._produce(steps, queue))
+            for _ in range(self._workers):
+                group.create_task(self._load(queue))
+
+
+async def _report_progress(
+    reader: ExportReader, size: int, migration: Migration | None, interval: float
+) -> None:
+    started = time.monotonic()
+    while True:
+        await asyncio.sleep(interval)
+        elapsed = time.monotonic() - started
+        line = f"  {reader.bytes_read / max(size, 1):6.1%} of export read"
+        if migration is not None:
+            line += (
+                f", {migration.readings:,} readings loaded "
+                f"({migration.readings / elapsed:,.0f}/s), "
+                f"{migration.devices} devices done"
+            )
+        print(line, file=sys.stderr)
+
+
+async def migrate(
+    file: Path,
+    dry_run: bool,
+    *,
+    engine: AsyncEngine | None = None,
+    shards: ShardMap | None = None,
+    workers: int = 4,
+    batch_size: int = 10_000,
+    checkpoint: Path | None = None,
+    restart: bool = False,
+    progress_interval: float = 5.0,
+) -> None:
+    with open(file, "rb") as export:
+        reader = ExportReader(export)
+        progress = None
+        if dry_run:
+            progress = asyncio.create_task(
+                _report_progress(reader, file.stat().st_size, None, progress_interval)
+            )
+            devices = readings = 0
+            try:
+                for name, count in await asyncio.to_thread(list, _dry_run(reader)):
+                    print(f"  {name}: {count} records")
+                    devices += 1
+                    readings += count
+            finally:
+                progress.cancel()
+            print(
+                f"\nDry run — {devices} devices, {readings} records, nothing written."
+            )
+            return
+
+        own_engine = engine is None
+        if engine is None:
+            engine = create_async_engine(
+                settings.async_database_url, echo=False, pool_size=workers + 1
+            )
+        if shards is None:
+            shards = get_shard_map()
+        done = Checkpoint(checkpoint, batch_size, restart)
+        migration = Migration(engine, shards, done, workers)
+        progress = asyncio.create_task(
+            _report_progress(reader, file.stat().st_size, migration, progress_interval)
+        )
+        try:
+            await migration.run(plan(reader, batch_size, done))
+        finally:
+            progress.cancel()
+            if own_engine:
+                await engine.dispose()
+                await shards.dispose()
+        print(
+            f"\nMigration complete — {migration.devices} devices, "
+            f"{migration.readings} records loaded in this run."
+        )
+
+
+def _dry_run(reader: ExportReader) -> Iterator[tuple[str, int]]:
+    """Name and reading count of each device of the export."""
+    documents = readings = 0
+    for kind, value in reader.items():
+        if kind == "reading":
+            readings += 1
+        elif kind == "device":
+            readings = 0
+        else:
+            yield ImportDevice(index=documents, fields=value).name, readings
+            documents += 1
 
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser()
     parser.add_argument("--file", default="devices.json", type=Path)
     parser.add_argument("--dry-run", action="store_true")
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--batch-size", type=int, default=10_000)
+    parser.add_argument(
+        "--checkpoint",
+        type=Path,
+        help="Progress file; default is the export's path plus .checkpoint",
+    )
+    parser.add_argument(
+        "--restart", action="store_true", help="Ignore an existing checkpoint"
+    )
     args = parser.parse_args()
 
-    asyncio.run(migrate(args.file, args.dry_run))
+    asyncio.run(
+        migrate(
+            args.file,
+            args.dry_run,
+            workers=args.workers,
+            batch_size=args.batch_size,
+            checkpoint=args.checkpoint
+            or args.file.with_name(args.file.name + ".checkpoint"),
+            restart=args.restart,
+        )
+    )
@@ -1,6 +1,17 @@
+import gzip
+import json
+from datetime import datetime, timezone
+
+import pytest
 from fastapi.testclient import TestClient
+from sqlalchemy.ext.asyncio import AsyncSession
 
-from app.models.device import Device
+from app.models.device import DeleteJob, Device
+from app.services.api_key_service import ApiKeyService
+from app.services.delete_job_service import DeleteJobService
+from app.utils import admission, rate_limit, spool
+from app.utils.config import settings
+from app.utils.window_cache import get_window_cache
 
 
 class TestData:
@@ -119,3 +130,541 @@ class TestData:
         assert asc_response.status_code == 200
         assert len(desc_response.json()) == 3
         assert len(asc_response.json()) == 3
+
+    def test_add_data_rate_limited(
+        self,
+        client: TestClient,
+        admin_headers: dict,
+        default_devices: list[Device],
+        monkeypatch,
+    ):
+        """Posting faster than the device's rate limit should return 429."""
+        monkeypatch.setattr(
+            rate_limit,
+            "_rate_limiter",
+            rate_limit.RateLimiter(
+                rate_limit.MemoryRateLimitBackend(), rate=0.01, burst=2
+            ),
+        )
+        api_keys = client.post(
+            f"/api/v1/keys/{default_devices[0].id}",
+            headers=admin_headers,
+        )
+        data_headers: dict = {
+            "X-API-Key": api_keys.json().get("api_key"),
+            "X-Device-Id": str(default_devices[0].id),
+        }
+        statuses = [
+            client.post(
+                "/api/v1/data/", json={"temperature": 25.5}, headers=data_headers
+            )
+            for _ in range(3)
+        ]
+        assert [r.status_code for r in statuses] == [201, 201, 429]
+        assert int(statuses[2].headers["Retry-After"]) > 0
+
+    def test_add_data_payload_limits(
+        self,
+        client: TestClient,
+        admin_headers: dict,
+        default_devices: list[Device],
+        monkeypatch,
+    ):
+        """Bodies over the size, depth or key limits should return 413."""
+        monkeypatch.setattr(settings, "INGEST_MAX_BODY_BYTES", 64)
+        monkeypatch.setattr(settings, "INGEST_MAX_DEPTH", 2)
+        monkeypatch.setattr(settings, "INGEST_MAX_KEYS", 3)
+        api_keys = client.post(
+            f"/api/v1/keys/{default_devices[0].id}",
+            headers=admin_headers,
+        )
+        data_headers: dict = {
+            "X-API-Key": api_keys.json().get("api_key"),
+            "X-Device-Id": str(default_devices[0].id),
+        }
+
+        for body in (
+            {"blob": "x" * 100},
+            {"a": {"b": {"c": 1}}},
+            {"a": 1, "b": 2, "c": 3, "d": 4},
+        ):
+            response = client.post("/api/v1/data/", json=body, headers=data_headers)
+            assert response.status_code == 413
+
+        response = client.post(
+            "/api/v1/data/", json={"a": {"b": 1}}, headers=data_headers
+        )
+        assert response.status_code == 201
+
+    def test_add_data_not_an_object(
+        self, client: TestClient, admin_headers: dict, default_devices: list[Device]
+    ):
+        """A body that is not a JSON object should return 422."""
+        api_keys = client.post(
+            f"/api/v1/keys/{default_devices[0].id}",
+            headers=admin_headers,
+        )
+        data_headers: dict = {
+            "X-API-Key": api_keys.json().get("api_key"),
+            "X-Device-Id": str(default_devices[0].id),
+        }
+        for content in (b"[1, 2]", b"{not json"):
+            response = client.post(
+                "/api/v1/data/", content=content, headers=data_headers
+            )
+            assert response.status_code == 422
+
+    def test_add_data_idempotency_key(
+        self,
+        client: TestClient,
+        admin_headers: dict,
+        device_with_data: Device,
+    ):
+        """A retry with the same Idempotency-Key should return the original ID."""
+        api_keys = client.post(
+            f"/api/v1/keys/{device_with_data.id}",
+            headers=admin_headers,
+        )
+        data_headers: dict = {
+            "X-API-Key": api_keys.json().get("api_key"),
+            "X-Device-Id": str(device_with_data.id),
+        }
+        before = client.get(
+            f"/api/v1/data/device/{device_with_data.id}", params={"limit": 200}
+        )
+
+        first = client.post(
+            "/api/v1/data/",
+            json={"temperature": 25.5},
+            headers=data_headers | {"Idempotency-Key": "reading-1"},
+        )
+        retry = client.post(
+            "/api/v1/data/",
+            json={"temperature": 25.5},
+            headers=data_headers | {"Idempotency-Key": "reading-1"},
+        )
+        other = client.post(
+            "/api/v1/data/",
+            json={"temperature": 25.5},
+            headers=data_headers | {"Idempotency-Key": "reading-2"},
+        )
+        assert first.status_code == 201
+        assert retry.status_code == 200
+        assert retry.json() == {"status": "duplicate", "id": first.json()["id"]}
+        assert other.status_code == 201
+        assert other.json()["id"] != first.json()["id"]
+
+        after = client.get(
+            f"/api/v1/data/device/{device_with_data.id}", params={"limit": 200}
+        )
+        assert len(after.json()) == len(before.json()) + 2
+
+    def test_add_data_compressed_and_binary(
+        self, client: TestClient, admin_headers: dict, default_devices: list[Device]
+    ):
+        """Compressed, MessagePack and CBOR bodies should be stored as objects."""
+        msgpack = pytest.importorskip("msgpack")
+        cbor2 = pytest.importorskip("cbor2")
+        api_keys = client.post(
+            f"/api/v1/keys/{default_devices[0].id}",
+            headers=admin_headers,
+        )
+        data_headers: dict = {
+            "X-API-Key": api_keys.json().get("api_key"),
+            "X-Device-Id": str(default_devices[0].id),
+        }
+        reading = {"temperature": 21.5, "tags": ["a", "b"], "ok": True}
+        bodies = [
+            (gzip.compress(json.dumps(reading).encode()), {"Content-Encoding": "gzip"}),
+            (msgpack.packb(reading), {"Content-Type": "application/msgpack"}),
+            (
+                gzip.compress(cbor2.dumps(reading)),
+                {"Content-Type": "application/cbor", "Content-Encoding": "gzip"},
+            ),
+        ]
+        for content, headers in bodies:
+            response = client.post(
+                "/api/v1/data/", content=content, headers=data_headers | headers
+            )
+            assert response.status_code == 201
+            stored = client.get(
+                f"/api/v1/data/{response.json()['id']}", headers=admin_headers
+            )
+            assert stored.json()["data"] == reading
+
+    def test_add_data_bad_encodings(
+        self,
+        client: TestClient,
+        admin_headers: dict,
+        default_devices: list[Device],
+        monkeypatch,
+    ):
+        """Bombs should return 413, corrupt bodies 422 and unknown encodings 415."""
+        msgpack = pytest.importorskip("msgpack")
+        monkeypatch.setattr(settings, "INGEST_MAX_BODY_BYTES", 1024)
+        api_keys = client.post(
+            f"/api/v1/keys/{default_devices[0].id}",
+            headers=admin_headers,
+        )
+        data_headers: dict = {
+            "X-API-Key": api_keys.json().get("api_key"),
+            "X-Device-Id": str(default_devices[0].id),
+        }
+        gzipped = {"Content-Encoding": "gzip"}
+        bomb = gzip.compress(json.dumps({"blob": "x" * 100_000}).encode())
+        assert len(bomb) < 1024
+        for content, headers, expected in (
+            (bomb, gzipped, 413),
+            (gzip.compress(b'{"a": 1}')[:-4], gzipped, 422),
+            (b'{"a": 1}', gzipped, 422),
+            (b'{"a": 1}', {"Content-Encoding": "br"}, 415),
+            (msgpack.packb([1, 2]), {"Content-Type": "application/msgpack"}, 422),
+            (
+                msgpack.packb({"a": b"raw"}, use_bin_type=True),
+                {"Content-Type": "application/msgpack"},
+                422,
+            ),
+        ):
+            response = client.post(
+                "/api/v1/data/", content=content, headers=data_headers | headers
+            )
+            assert response.status_code == expected
+
+    def test_data_list_many(
+        self,
+        client: TestClient,
+        device_with_data: Device,
+        default_devices: list[Device],
+    ):
+        """Several devices can be listed in one request, merged or grouped."""
+        url = f"/api/v1/data/device/{device_with_data.id}"
+        single = client.get(url, params={"limit": 2}).json()
+        params = {
+            "device_id": [str(device_with_data.id), str(default_devices[0].id)],
+            "limit": 2,
+        }
+
+        response = client.get("/api/v1/data/devices", params=params)
+        assert response.status_code == 200
+        assert response.json() == single
+
+        response = client.get(
+            "/api/v1/data/devices", params=params | {"group": "device", "order": "asc"}
+        )
+        grouped = response.json()
+        assert list(grouped) == params["device_id"]
+        ascending = client.get(url, params={"limit": 2, "order": "asc"}).json()
+        assert grouped[str(device_with_data.id)] == ascending
+        assert grouped[str(default_devices[0].id)] == []
+
+        unknown = "00000000-0000-0000-0000-000000000000"
+        response = client.get("/api/v1/data/devices", params={"device_id": [unknown]})
+        assert response.status_code == 404
+        assert client.get("/api/v1/data/devices").status_code == 422
+
+    def test_sealed_ranges_are_cached(
+        self,
+        client: TestClient,
+        admin_headers: dict,
+        device_with_data: Device,
+        monkeypatch,
+    ):
+        """Reads ending in the sealed past are cached until the data changes."""
+        monkeypatch.setattr(settings, "CACHE_SEALED_AFTER", 0.0)
+        url = f"/api/v1/data/device/{device_with_data.id}"
+        params = {"end": datetime.now(timezone.utc).isoformat()}
+        cache = get_window_cache()
+        hits = cache.hits
+
+        first = client.get(url, params=params)
+        assert first.status_code == 200
+        assert first.headers["cache-control"].startswith("public, max-age=")
+        assert len(first.json()) == 3
+        second = client.get(url, params=params)
+        assert second.json() == first.json()
+        assert cache.hits == hits + 1
+
+        # Without an end in the sealed past nothing is cached.
+        assert "cache-control" not in client.get(url).headers
+
+        deleted = first.json()[0]["id"]
+        response = client.delete(f"/api/v1/data/{deleted}", headers=admin_headers)
+        assert response.status_code == 204
+        after = client.get(url, params=params).json()
+        assert [r["id"] for r in after] == [r["id"] for r in first.json()[1:]]
+
+        unknown = "00000000-0000-0000-0000-000000000000"
+        response = client.get(f"/api/v1/data/device/{unknown}", params=params)
+        assert response.status_code == 404
+
+    def test_delete_data_range(
+        self, client: TestClient, admin_headers: dict, device_with_data: Device
+    ):
+        """Deleting a time range should queue a job that deletes only that range."""
+        url = f"/api/v1/data/device/{device_with_data.id}"
+        readings = client.get(url, params={"order": "asc"}).json()
+        params = {"start": readings[1]["created_date"], "end": "2999-01-01T00:00:00Z"}
+
+        assert client.delete(url, params=params).status_code == 403
+        response = client.delete(url, params=params, headers=admin_headers)
+        assert response.status_code == 202
+        job = response.json()
+        assert (job["kind"], job["status"]) == ("range", "pending")
+
+        response = client.get(f"/api/v1/data/jobs/{job['id']}", headers=admin_headers)
+        assert response.status_code == 200
+        assert response.json()["status"] == "done"
+        assert response.json()["deleted"] == 2
+        assert [r["id"] for r in client.get(url).json()] == [readings[0]["id"]]
+
+        params = {"start": params["end"], "end": readings[0]["created_date"]}
+        response = client.delete(url, params=params, headers=admin_headers)
+        assert response.status_code == 422
+
+    def test_delete_job_not_found(self, client: TestClient, admin_headers: dict):
+        response = client.get(
+            "/api/v1/data/jobs/00000000-0000-0000-0000-000000000000",
+            headers=admin_headers,
+        )
+        assert response.status_code == 404
+
+    async def test_fail_stale_delete_jobs(
+        self, db_session: AsyncSession, default_devices: list[Device]
+    ):
+        """Jobs without progress for a while should be marked failed, others kept."""
+        device_id = default_devices[0].id
+        long_ago = datetime(2024, 1, 1, tzinfo=timezone.utc)
+        stale = DeleteJob(
+            device_id=device_id, kind="range", status="running", updated_date=long_ago
+        )
+        lost = DeleteJob(device_id=device_id, kind="device", updated_date=long_ago)
+        live = DeleteJob(device_id=device_id, kind="range", status="running")
+        done = DeleteJob(
+            device_id=device_id, kind="range", status="done", updated_date=long_ago
+        )
+        db_session.add_all([stale, lost, live, done])
+        await db_session.commit()
+
+        assert await DeleteJobService(session=db_session).fail_stale(60) == 2
+        for job in (stale, lost, live, done):
+            await db_session.refresh(job)
+        assert [job.status for job in (stale, lost, live, done)] == [
+            "failed",
+            "failed",
+            "running",
+            "done",
+        ]
+        assert stale.error and stale.finished_at is not None
+
+    def test_promote_field_and_aggregate(
+        self, client: TestClient, admin_headers: dict, default_devices: list[Device]
+    ):
+        """Promoting a field should backfill it and keep aggregates unchanged."""
+        device_id = default_devices[0].id
+        api_keys = client.post(f"/api/v1/keys/{device_id}", headers=admin_headers)
+        data_headers: dict = {
+            "X-API-Key": api_keys.json().get("api_key"),
+            "X-Device-Id": str(device_id),
+        }
+        for temperature in (18.5, 21.5, "n/a"):
+            client.post(
+                "/api/v1/data/",
+                json={"temperature": temperature, "humidity": 40},
+                headers=data_headers,
+            )
+
+        response = client.get(
+            f"/api/v1/data/device/{device_id}/fields", headers=admin_headers
+        )
+        assert response.status_code == 200
+        fields = {field["key"]: field for field in response.json()}
+        assert fields["temperature"]["count"] == 3
+        assert fields["temperature"]["numeric_count"] == 2
+
+        aggregate_url = f"/api/v1/data/device/{device_id}/aggregate"
+        before = client.get(aggregate_url, params={"field": "temperature"}).json()
+        assert before == {
+            "field": "temperature",
+            "count": 2,
+            "min": 18.5,
+            "max": 21.5,
+            "mean": 20.0,
+        }
+
+        response = client.post(
+            f"/api/v1/data/device/{device_id}/fields/temperature/promote",
+            headers=admin_headers,
+        )
+        assert response.status_code == 202
+        assert response.json()["promoted_at"] is not None
+
+        response = client.get(
+            f"/api/v1/data/device/{device_id}/fields", headers=admin_headers
+        )
+        fields = {field["key"]: field for field in response.json()}
+        assert fields["temperature"]["backfilled_at"] is not None
+        assert client.get(aggregate_url, params={"field": "temperature"}).json() == (
+            before
+        )
+
+    def test_promote_unknown_field(
+        self, client: TestClient, admin_headers: dict, default_devices: list[Device]
+    ):
+        """Promoting a key the device never sent should return 404."""
+        response = client.post(
+            f"/api/v1/data/device/{default_devices[0].id}/fields/missing/promote",
+            headers=admin_headers,
+        )
+        assert response.status_code == 404
+
+    def test_add_data_deadband(self, client: TestClient, admin_headers: dict):
+        """A deadband device should skip readings that did not change."""
+        device = client.post(
+            "/api/v1/devices/",
+            headers=admin_headers,
+            json={
+                "name": "Deadband Device",
+                "notes": {"deadband": {"tolerance": {"temperature": 0.5}}},
+            },
+        ).json()
+        api_keys = client.post(f"/api/v1/keys/{device['id']}", headers=admin_headers)
+        data_headers: dict = {
+            "X-API-Key": api_keys.json().get("api_key"),
+            "X-Device-Id": device["id"],
+        }
+
+        posted = [
+            client.post(
+                "/api/v1/data/", json={"temperature": value}, headers=data_headers
+            )
+            for value in (20.0, 20.3, 21.0)
+        ]
+        assert [response.status_code for response in posted] == [201, 200, 201]
+        responses = [response.json() for response in posted]
+        assert [r["status"] for r in responses] == ["ok", "skipped", "ok"]
+        assert responses[1]["id"] == responses[0]["id"]
+
+        stored = client.get(f"/api/v1/data/device/{device['id']}").json()
+        assert len(stored) == 2
+
+    def test_invalid_deadband_config(self, client: TestClient, admin_headers: dict):
+        """A negative tolerance should be rejected with 422."""
+        response = client.post(
+            "/api/v1/devices/",
+            headers=admin_headers,
+            json={
+                "name": "Bad Deadband Device",
+                "notes": {"deadband": {"tolerance": {"temperature": -1}}},
+            },
+        )
+        assert response.status_code == 422
+
+    def test_add_data_schema(self, client: TestClient, admin_headers: dict):
+        """A device with a payload schema should reject readings that break it."""
+        device = client.post(
+            "/api/v1/devices/",
+            headers=admin_headers,
+            json={
+                "name": "Schema Device",
+                "notes": {"schema": {"fields": {"temperature": "number"}}},
+            },
+        ).json()
+        api_keys = client.post(f"/api/v1/keys/{device['id']}", headers=admin_headers)
+        data_headers: dict = {
+            "X-API-Key": api_keys.json().get("api_key"),
+            "X-Device-Id": device["id"],
+        }
+
+        response = client.post(
+            "/api/v1/data/", json={"temperature": "warm"}, headers=data_headers
+        )
+        assert response.status_code == 422
+        assert response.json()["detail"][0]["loc"] == ["temperature"]
+        response = client.post(
+            "/api/v1/data/", json={"temperature": 21.5}, headers=data_headers
+        )
+        assert response.status_code == 201
+
+        client.put(
+            f"/api/v1/devices/{device['id']}",
+            headers=admin_headers,
+            json={"notes": {"schema": {"fields": {"temperature": "string"}}}},
+        )
+        response = client.post(
+            "/api/v1/data/", json={"temperature": "warm"}, headers=data_headers
+        )
+        assert response.status_code == 201
+
+    def test_invalid_schema_config(self, client: TestClient, admin_headers: dict):
+        """An unknown field type should be rejected with 422."""
+        response = client.post(
+            "/api/v1/devices/",
+            headers=admin_headers,
+            json={
+                "name": "Bad Schema Device",
+                "notes": {"schema": {"fields": {"temperature": "float"}}},
+            },
+        )
+        assert response.status_code == 422
+
+    def test_add_data_spooled(
+        self, client: TestClient, admin_headers: dict, tmp_path, monkeypatch
+    ):
+        """With the database down, readings of known keys should be spooled."""
+        monkeypatch.setattr(
+            spool, "_spool", spool.Spool(tmp_path, 1 << 20, fsync_interval=0)
+        )
+        device = client.post(
+            "/api/v1/devices/", headers=admin_headers, json={"name": "Spool Device"}
+        ).json()
+        api_keys = client.post(f"/api/v1/keys/{device['id']}", headers=admin_headers)
+        data_headers: dict = {
+            "X-API-Key": api_keys.json().get("api_key"),
+            "X-Device-Id": device["id"],
+        }
+        response = client.post(
+            "/api/v1/data/", json={"temperature": 20}, headers=data_headers
+        )
+        assert response.status_code == 201
+
+        async def unavailable(*args, **kwargs):
+            raise OSError("Connection refused")
+
+        monkeypatch.setattr(ApiKeyService, "get_api_key", unavailable)
+        response = client.post(
+            "/api/v1/data/", json={"temperature": 21}, headers=data_headers
+        )
+        assert response.status_code == 202
+        spooled = response.json()
+        assert spooled["status"] == "spooled"
+
+        data_headers["X-API-Key"] = "wrong"
+        response = client.post(
+            "/api/v1/data/", json={"temperature": 22}, headers=data_headers
+        )
+        assert response.status_code == 401
+
+        (segment,) = tmp_path.glob("*.seg")
+        (reading,) = spool.read_segment(segment.read_bytes())
+        assert str(reading.id) == spooled["id"]
+        assert reading.data == {"temperature": 21}
+
+    def test_ingest_shed_when_saturated(
+        self, client: TestClient, admin_headers: dict, monkeypatch
+    ):
+        """Ingest should be shed with 503 while reads keep being served."""
+        ingest = admission.AdmissionGate("ingest", 1, queue_depth=0, deadline=1.0)
+        ingest.active = 1
+        gates = {
+            **admission.get_gates(),
+            admission.INGEST: ingest,
+        }
+        monkeypatch.setattr(admission, "_gates", gates)
+
+        response = client.post("/api/v1/data/", json={"temperature": 25.5})
+        assert response.status_code == 503
+        assert response.headers["Retry-After"] == "1"
+        assert ingest.shed_queue_full == 1
+
+        response = client.get("/api/v1/devices/", headers=admin_headers)
+        assert response.status_code == 200
@@ -143,3 +143,84 @@ class TestDevice:
             json={},
         )
         assert response.status_code == 422
+
+    def test_purge_device(
+        self, client: TestClient, admin_headers: dict, device_with_data: Device
+    ):
+        """Purging a device should delete its data in a job, then the device."""
+        url = f"/api/v1/devices/{device_with_data.id}/purge"
+        assert client.post(url).status_code == 403
+        response = client.post(url, headers=admin_headers)
+        assert response.status_code == 202
+        job = response.json()
+        assert job["kind"] == "device"
+
+        response = client.get(f"/api/v1/data/jobs/{job['id']}", headers=admin_headers)
+        assert response.json()["status"] == "done"
+        assert response.json()["deleted"] == 3
+        assert response.json()["finished_at"] is not None
+        response = client.get(f"/api/v1/devices/{device_with_data.id}")
+        assert response.status_code == 404
+
+    def test_bulk_devices(
+        self, client: TestClient, admin_headers: dict, default_devices: list[Device]
+    ):
+        """A bulk request applies the valid items and reports the rest."""
+        unknown = "00000000-0000-0000-0000-000000000000"
+        payload = {
+            "create": [
+                {"name": "Bulk 1", "issue_key": True},
+                {"name": "Bulk 2", "notes": {"site": "roof"}},
+                {"name": "Test Device 1"},
+                {"name": "Bulk 1"},
+            ],
+            "update": [
+                {"id": str(default_devices[0].id), "description": "Renamed"},
+                {"id": unknown, "description": "Missing"},
+                {"id": str(default_devices[1].id), "name": "Bulk 2"},
+            ],
+            "issue_keys": [str(default_devices[2].id), unknown],
+        }
+        assert client.post("/api/v1/devices/bulk", json=payload).status_code == 403
+        response = client.post(
+            "/api/v1/devices/bulk", headers=admin_headers, json=payload
+        )
+        assert response.status_code == 200
+        results = response.json()
+        assert [(r["action"], r["index"], r["status"]) for r in results] == [
+            ("create", 0, 201),
+            ("create", 1, 201),
+            ("create", 2, 409),
+            ("create", 3, 409),
+            ("update", 0, 200),
+            ("update", 1, 404),
+            ("update", 2, 409),
+            ("issue_key", 0, 201),
+            ("issue_key", 1, 404),
+        ]
+        assert results[1]["device"]["notes"] == {"site": "roof"}
+        assert results[4]["device"]["description"] == "Renamed"
+        assert results[4]["device"]["name"] == default_devices[0].name
+
+        # The issued keys work for ingest.
+        for result, device_id in (
+            (results[0], results[0]["device"]["id"]),
+            (results[7], str(default_devices[2].id)),
+        ):
+            response = client.post(
+                "/api/v1/data/",
+                json={"temperature": 20},
+                headers={"X-API-Key": result["api_key"], "X-Device-Id": device_id},
+            )
+            assert response.status_code == 201
+
+        response = client.post(
+            "/api/v1/devices/bulk",
+            headers=admin_headers,
+            json={"issue_keys": [str(default_devices[2].id)]},
+        )
+        assert response.json()[0]["status"] == 409
+
+    def test_bulk_devices_empty(self, client: TestClient, admin_headers: dict):
+        response = client.post("/api/v1/devices/bulk", headers=admin_headers, json={})
+        assert response.status_code == 422
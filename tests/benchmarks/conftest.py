@@ -0,0 +1,101 @@
+"""
+Micro-benchmark harness for the hot paths.
+
+Timings are divided by a fixed pure-Python calibration workload measured in
+the same session, so baselines recorded on one machine remain comparable on
+another. A benchmark fails when its relative cost exceeds the stored baseline
+by more than BENCH_THRESHOLD (default 0.5, i.e. 50%).
+
+    uv run pytest -m benchmark                    # compare against baselines
+    BENCH_UPDATE=1 uv run pytest -m benchmark     # re-record baselines.json
+"""
+
+import json
+import os
+import time
+import timeit
+from collections.abc import Awaitable, Callable
+from pathlib import Path
+
+import pytest
+
+BASELINE_FILE = Path(__file__).with_name("baselines.json")
+THRESHOLD = float(os.environ.get("BENCH_THRESHOLD", "0.5"))
+UPDATE = os.environ.get("BENCH_UPDATE") == "1"
+
+
+def _calibration_workload() -> None:
+    total = 0
+    for i in range(2000):
+        total += hash(str(i)) & 0xFF
+
+
+def _calibrate() -> float:
+    return min(timeit.repeat(_calibration_workload, number=20, repeat=7)) / 20
+
+
+class Bench:
+
+    def __init__(self, calibration: float, baselines: dict, results: dict):
+        self._calibration = calibration
+        self._baselines = baselines
+        self._results = results
+
+    def run(
+        self, name: str, fn: Callable[[], object], number: int = 2000, repeat: int = 5
+    ) -> None:
+        per_op = min(timeit.repeat(fn, number=number, repeat=repeat)) / number
+        self._check(name, per_op)
+
+    async def run_async(
+        self,
+        name: str,
+        fn: Callable[[], Awaitable[object]],
+        number: int = 100,
+        repeat: int = 5,
+    ) -> None:
+        best = float("inf")
+        for _ in range(repeat):
+            start = time.perf_counter()
+            for _ in range(number):
+                await fn()
+            best = min(best, time.perf_counter() - start)
+        self._check(name, best / number)
+
+    def _check(self, name: str, per_op: float) -> None:
+        relative = per_op / self._calibration
+        self._results[name] = {
+            "ns_per_op": round(per_op * 1e9, 1),
+            "relative": round(relative, 6),
+        }
+        baseline = self._baselines.get(name)
+        if UPDATE or baseline is None:
+            return
+        limit = baseline["relative"] * (1 + THRESHOLD)
+        assert relative <= limit, (
+            f"{name} regressed: relative cost {relative:.4f} vs baseline "
+            f"{baseline['relative']:.4f} (limit {limit:.4f})"
+        )
+
+
+@pytest.fixture(scope="session")
+def bench_results():
+    results: dict = {}
+    yield results
+    if UPDATE and results:
+        baselines = (
+            json.loads(BASELINE_FILE.read_text()) if BASELINE_FILE.exists() else {}
+        )
+        baselines.update(results)
+        BASELINE_FILE.write_text(json.dumps(baselines, indent=2, sort_keys=True) + "\n")
+
+
+@pytest.fixture(scope="session")
+def bench_calibration() -> float:
+    return _calibrate()
+
+
+@pytest.fixture
+def bench(bench_calibration: float, bench_results: dict) -> Bench:
+    baselines = json.loads(BASELINE_FILE.read_text()) if BASELINE_FILE.exists() else {}
+    return Bench(bench_calibration, baselines, bench_results)
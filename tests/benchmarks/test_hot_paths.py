@@ -0,0 +1,76 @@
+import pytest
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.api.v1.data_routes import _DATA_EXCLUDE
+from app.models.api_key import ApiKey
+from app.models.device import Device, DeviceData
+from app.schemas.data_schema import DeviceDataRead
+from app.schemas.device_schema import DeviceUpdate
+from app.services.api_key_service import ApiKeyService
+from app.utils.auth import hash_api_key, verify_api_key
+
+pytestmark = pytest.mark.benchmark
+
+RAW_KEY = "k" * 54
+PAYLOAD = {
+    "temperature": 22.5,
+    "humidity": 61,
+    "battery": 3.71,
+    "rssi": -67,
+    "location": {"lat": 44.97, "lon": -93.26},
+}
+
+
+@pytest.fixture
+async def device_key(db_session: AsyncSession) -> ApiKey:
+    device = Device(name="Benchmark Device", notes={"location": "lab"})
+    db_session.add(device)
+    api_key = ApiKey(key_hash=hash_api_key(RAW_KEY), device_id=device.id)
+    db_session.add(api_key)
+    await db_session.commit()
+    return api_key
+
+
+def test_hash_api_key(bench):
+    bench.run("hash_api_key", lambda: hash_api_key(RAW_KEY), number=20000)
+
+
+async def test_verify_api_key(bench, db_session: AsyncSession, device_key: ApiKey):
+    service = ApiKeyService(session=db_session)
+
+    async def verify():
+        return await verify_api_key(
+            raw_key=RAW_KEY, device_id=device_key.device_id, api_service=service
+        )
+
+    await bench.run_async("verify_api_key", verify, number=200)
+
+
+def test_device_data_read_conversion(bench):
+    row = DeviceData(data=PAYLOAD, device_id=Device(name="x").id)
+    bench.run(
+        "device_data_read_conversion",
+        lambda: DeviceDataRead(**row.model_dump(exclude=_DATA_EXCLUDE)),
+        number=5000,
+    )
+
+
+def test_device_update_validation(bench):
+    body = {"name": "Renamed", "description": "Moved", "notes": {"location": "roof"}}
+    bench.run(
+        "device_update_validation",
+        lambda: DeviceUpdate.model_validate(body),
+        number=10000,
+    )
+
+
+async def test_jsontype_round_trip(bench, db_session: AsyncSession, device_key: ApiKey):
+    async def round_trip():
+        row = DeviceData(data=PAYLOAD, device_id=device_key.device_id)
+        db_session.add(row)
+        await db_session.commit()
+        db_session.expunge(row)
+        loaded = await db_session.get(DeviceData, row.id)
+        assert loaded is not None and loaded.data == PAYLOAD
+
+    await bench.run_async("jsontype_round_trip", round_trip, number=100)
@@ -25,11 +25,13 @@ TestingSessionLocal = async_sessionmaker(
     expire_on_commit=False,
 )
 
-database.engine = test_engine
-database.AsyncSessionFactory = TestingSessionLocal
+database.set_engine(test_engine)
 
 
 from app.main import app  # noqa: E402 - import after patching the engine
+from app.utils.database import (  # noqa: E402 - import after patching the engine
+    get_read_session,
+)
 from app.utils.database import (  # noqa: E402 - import after patching the engine
     get_session as get_db,
 )
@@ -53,6 +55,7 @@ async def create_test_tables():
 async def client(create_test_tables):
     """Fresh TestClient per test with DB dependency overridden."""
     app.dependency_overrides[get_db] = override_get_db
+    app.dependency_overrides[get_read_session] = override_get_db
     with TestClient(app) as c:
         yield c
     app.dependency_overrides.clear()
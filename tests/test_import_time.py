@@ -0,0 +1,54 @@
+import os
+import subprocess
+import sys
+
+import pytest
+
+IMPORT_BUDGET_SECONDS = float(os.environ.get("IMPORT_BUDGET_SECONDS", "2.0"))
+
+
+def _import_times(statement: str) -> list[tuple[int, int, str]]:
+    """Run `statement` in a fresh interpreter under -X importtime."""
+    result = subprocess.run(  # nosec B603
+        [sys.executable, "-X", "importtime", "-c", statement],
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    timings = []
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        self_us, cumulative_us, name = line.removeprefix("import time:").split("|")
+        timings.append((int(self_us), int(cumulative_us), name.strip()))
+    return timings
+
+
+def test_app_import_time_budget():
+    """Importing the app stays within budget; the slowest imports are reported."""
+    timings = _import_times("import app.main")
+    total = next(cum for _, cum, name in timings if name == "app.main") / 1e6
+    slowest = sorted(timings, reverse=True)[:10]
+    report = "\n".join(
+        f"  {self_us / 1000:8.1f}ms  {name}" for self_us, _, name in slowest
+    )
+    print(f"\nimport app.main: {total:.3f}s, slowest imports (self time):\n{report}")
+
+    assert total <= IMPORT_BUDGET_SECONDS, (
+        f"import app.main took {total:.3f}s (budget {IMPORT_BUDGET_SECONDS}s); "
+        f"slowest imports:\n{report}"
+    )
+
+
+@pytest.mark.parametrize(
+    "module", ["app.utils.database", "app.utils.sharding", "app.main"]
+)
+def test_modules_are_lazy(module: str):
+    """Importing the app or its database modules builds neither settings nor engines."""
+    statement = (
+        f"import sys, {module}\n"
+        "from app.utils.config import get_settings\n"
+        "assert get_settings.cache_info().currsize == 0, 'settings were built'\n"
+        "assert 'asyncpg' not in sys.modules, 'database driver was loaded'\n"
+    )
+    _import_times(statement)
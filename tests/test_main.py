@@ -10,3 +10,18 @@ class TestMain:
         response = client.get("/health")
         assert response.status_code == 200
         assert response.json() == {"status": "ok"}
+
+    def test_metrics_requires_admin(self, client):
+        """Metrics endpoint should be admin only."""
+        response = client.get("/metrics")
+        assert response.status_code == 403
+
+    def test_metrics(self, client, admin_headers):
+        """Metrics endpoint should report admission counters per traffic class."""
+        client.get("/api/v1/devices/", headers=admin_headers)
+        response = client.get("/metrics", headers=admin_headers)
+        assert response.status_code == 200
+        admission = response.json()["admission"]
+        assert set(admission) == {"ingest", "read", "admin"}
+        assert admission["read"]["admitted"] >= 1
+        assert admission["read"]["active"] == 0
@@ -0,0 +1,46 @@
+from collections.abc import Sequence
+from datetime import datetime, timedelta
+
+import pytest
+import pytest_asyncio
+from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
+from sqlmodel import SQLModel
+
+from app.models.device import Device, DeviceData
+
+
+@pytest_asyncio.fixture(loop_scope="function")
+async def engine(tmp_path):
+    """A file-backed SQLite database with every table, for jobs that open their own connections."""
+    engine = create_async_engine(f"sqlite+aiosqlite:///{tmp_path / 'data.db'}")
+    async with engine.begin() as conn:
+        await conn.run_sync(SQLModel.metadata.create_all)
+    yield engine
+    await engine.dispose()
+
+
+@pytest.fixture
+def make_device(engine):
+    """
+    Create a device in `engine` with a reading at `start + offset` for each
+    offset; reading i holds {"temperature": 20 + i, "seq": i}.
+    """
+
+    async def make(name: str, start: datetime, offsets: Sequence[timedelta]) -> Device:
+        async with AsyncSession(engine, expire_on_commit=False) as session:
+            device = Device(name=name)
+            session.add(device)
+            for i, offset in enumerate(offsets):
+                created = start + offset
+                session.add(
+                    DeviceData(
+                        device_id=device.id,
+                        data={"temperature": 20 + i, "seq": i},
+                        created_date=created,
+                        updated_date=created,
+                    )
+                )
+            await session.commit()
+        return device
+
+    return make
@@ -0,0 +1,78 @@
+import asyncio
+
+import pytest
+
+from app.utils.admission import ADMIN, INGEST, READ, AdmissionGate, classify
+
+
+@pytest.mark.parametrize(
+    "method, path, expected",
+    [
+        ("POST", "/api/v1/data/", INGEST),
+        ("POST", "/api/v1/data", INGEST),
+        ("POST", "/api/v1/data/device/abc/fields/t/promote", ADMIN),
+        ("GET", "/api/v1/data/device/abc", READ),
+        ("GET", "/api/v1/devices/", READ),
+        ("POST", "/api/v1/devices/", ADMIN),
+        ("DELETE", "/api/v1/data/abc", ADMIN),
+        ("GET", "/health", None),
+        ("GET", "/metrics", None),
+    ],
+)
+def test_classify(method, path, expected):
+    assert classify(method, path) == expected
+
+
+async def test_gate_queues_then_admits_in_order():
+    gate = AdmissionGate("test", concurrency=1, queue_depth=2, deadline=1.0)
+    assert await gate.acquire()
+
+    order = []
+
+    async def waiter(i):
+        assert await gate.acquire()
+        order.append(i)
+        gate.release()
+
+    tasks = [asyncio.create_task(waiter(i)) for i in range(2)]
+    await asyncio.sleep(0)
+    assert gate.stats()["queued"] == 2
+
+    gate.release()
+    await asyncio.gather(*tasks)
+    assert order == [0, 1]
+    assert gate.stats()["active"] == 0
+    assert gate.stats()["admitted"] == 3
+
+
+async def test_gate_sheds_when_queue_full():
+    gate = AdmissionGate("test", concurrency=1, queue_depth=0, deadline=1.0)
+    assert await gate.acquire()
+    assert not await gate.acquire()
+    assert gate.stats()["shed_queue_full"] == 1
+    gate.release()
+    assert await gate.acquire()
+
+
+async def test_gate_sheds_after_deadline():
+    gate = AdmissionGate("test", concurrency=1, queue_depth=4, deadline=0.01)
+    assert await gate.acquire()
+    assert not await gate.acquire()
+    stats = gate.stats()
+    assert stats["shed_deadline"] == 1
+    assert stats["queued"] == 0
+    gate.release()
+    assert gate.stats()["active"] == 0
+
+
+async def test_cancelled_waiter_does_not_leak_slot():
+    gate = AdmissionGate("test", concurrency=1, queue_depth=4, deadline=1.0)
+    assert await gate.acquire()
+    task = asyncio.create_task(gate.acquire())
+    await asyncio.sleep(0)
+    task.cancel()
+    with pytest.raises(asyncio.CancelledError):
+        await task
+    gate.release()
+    assert gate.stats()["active"] == 0
+    assert gate.stats()["queued"] == 0
@@ -0,0 +1,48 @@
+import httpx
+
+from app.bench.load import _percentile, compare, run_load
+from app.main import app
+
+
+def test_percentile_nearest_rank():
+    latencies = [i / 1000 for i in range(1, 101)]
+    assert _percentile(latencies, 50) == 50.0
+    assert _percentile(latencies, 95) == 95.0
+    assert _percentile(latencies, 99) == 99.0
+    assert _percentile([], 99) is None
+
+
+async def test_run_load_in_process(admin_headers: dict):
+    async with httpx.AsyncClient(
+        transport=httpx.ASGITransport(app=app), base_url="http://bench"
+    ) as client:
+        phases = await run_load(
+            client,
+            admin_secret=admin_headers["X-Admin-Secret"],
+            devices=2,
+            requests=10,
+            concurrency=1,
+        )
+
+    assert set(phases) == {"ingest", "list"}
+    for summary in phases.values():
+        assert summary["requests"] == 10
+        assert summary["errors"] == 0
+        assert summary["latency_ms"]["p99"] >= summary["latency_ms"]["p50"]
+
+
+def test_compare_reports_relative_change():
+    def result(rps, p95, p99):
+        return {
+            "phases": {
+                "ingest": {
+                    "throughput_rps": rps,
+                    "latency_ms": {"p95": p95, "p99": p99},
+                }
+            }
+        }
+
+    lines = compare(result(110, 9, 20), result(100, 10, 20))
+    assert lines == [
+        "  ingest: rps 100 -> 110 (+10.0%), p95 10 -> 9 (-10.0%), p99 20 -> 20 (+0.0%)"
+    ]
@@ -0,0 +1,111 @@
+import asyncio
+
+import httpx
+import pytest
+from fastapi import FastAPI, Header
+
+from app.utils.coalesce import SingleFlight
+from app.utils.middleware import CoalescingMiddleware
+
+
+async def test_concurrent_calls_share_one_run():
+    flight = SingleFlight()
+    calls = 0
+    release = asyncio.Event()
+
+    async def fetch():
+        nonlocal calls
+        calls += 1
+        call = calls
+        await release.wait()
+        return call
+
+    tasks = [asyncio.create_task(flight.do("key", fetch)) for _ in range(5)]
+    other = asyncio.create_task(flight.do("other", fetch))
+    await asyncio.sleep(0)
+    release.set()
+    assert await asyncio.gather(*tasks) == [1] * 5
+    assert await other == 2
+    assert flight.stats() == {"in_flight": 0, "executed": 2, "coalesced": 4}
+
+    # Later calls run again: nothing is kept.
+    assert await flight.do("key", fetch) == 3
+
+
+async def test_errors_reach_every_caller():
+    flight = SingleFlight()
+
+    async def fail():
+        await asyncio.sleep(0.01)
+        raise ValueError("boom")
+
+    results = await asyncio.gather(
+        *(flight.do("key", fail) for _ in range(3)), return_exceptions=True
+    )
+    assert all(isinstance(result, ValueError) for result in results)
+
+
+async def test_waiters_take_over_when_the_leader_is_cancelled():
+    flight = SingleFlight()
+    started = asyncio.Event()
+
+    async def fetch():
+        started.set()
+        await asyncio.sleep(0.05)
+        return "done"
+
+    leader = asyncio.create_task(flight.do("key", fetch))
+    await started.wait()
+    follower = asyncio.create_task(flight.do("key", fetch))
+    await asyncio.sleep(0)
+    leader.cancel()
+    assert await follower == "done"
+    with pytest.raises(asyncio.CancelledError):
+        await leader
+
+
+async def test_middleware_coalesces_identical_reads():
+    app = FastAPI()
+    app.add_middleware(CoalescingMiddleware)
+    hits = []
+
+    @app.get("/api/v1/slow")
+    async def slow(a: str = "", b: str = ""):
+        hits.append((a, b))
+        await asyncio.sleep(0.05)
+        return {"a": a, "b": b, "hits": len(hits)}
+
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+        responses = await asyncio.gather(
+            client.get("/api/v1/slow?a=1&b=2"),
+            client.get("/api/v1/slow?b=2&a=1"),
+            client.get("/api/v1/slow?a=1&b=2", headers={"X-Admin-Secret": "x"}),
+        )
+    assert [response.status_code for response in responses] == [200] * 3
+    assert responses[0].json() == responses[1].json()
+    assert len(hits) == 2
+
+
+async def test_middleware_keeps_primary_reads_apart():
+    app = FastAPI()
+    app.add_middleware(CoalescingMiddleware)
+    hits = []
+
+    @app.get("/api/v1/slow")
+    async def slow(read_primary: bool = Header(False, alias="X-Read-Primary")):
+        hits.append(read_primary)
+        await asyncio.sleep(0.05)
+        return {"read_primary": read_primary}
+
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+        responses = await asyncio.gather(
+            client.get("/api/v1/slow"),
+            client.get("/api/v1/slow", headers={"X-Read-Primary": "true"}),
+        )
+    assert [response.json()["read_primary"] for response in responses] == [
+        False,
+        True,
+    ]
+    assert sorted(hits) == [False, True]
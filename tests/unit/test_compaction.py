@@ -0,0 +1,145 @@
+import uuid
+from datetime import datetime, timedelta, timezone
+
+import pytest
+import pytest_asyncio
+from sqlalchemy import func, select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.exceptions import NotFoundError
+from app.models.device import Device, DeviceData, DeviceDataChunk
+from app.services.data_service import DataService
+from app.utils.compaction import compact, decode_chunk, encode_chunk
+from app.utils.sharding import ShardMap
+
+NOW = datetime.now(timezone.utc)
+START = (NOW - timedelta(days=40)).replace(minute=0, second=0, microsecond=0)
+
+
+@pytest_asyncio.fixture(loop_scope="function")
+async def device(make_device):
+    """A device with 6 readings 40 days old over two hours and 2 recent ones."""
+    offsets = [timedelta(minutes=15 * i) for i in range(6)]
+    offsets += [NOW - START - timedelta(minutes=i) for i in (2, 1)]
+    return await make_device("Compacted Device", START, offsets)
+
+
+def test_chunk_round_trip():
+    readings = [
+        DeviceData(
+            id=uuid.uuid4(),
+            device_id=uuid.uuid4(),
+            data={"v": i},
+            created_date=START + timedelta(seconds=7 * i, microseconds=i),
+            updated_date=START + timedelta(seconds=7 * i + (i % 2)),
+        )
+        for i in range(5)
+    ]
+    columns = encode_chunk(START, list(reversed(readings)))
+    chunk = DeviceDataChunk(device_id=readings[0].device_id, start=START, **columns)
+
+    decoded = decode_chunk(chunk)
+    assert [r.id for r in decoded] == [r.id for r in readings]
+    assert [r.data for r in decoded] == [r.data for r in readings]
+    assert [r.created_date for r in decoded] == [r.created_date for r in readings]
+    assert [r.updated_date for r in decoded] == [r.updated_date for r in readings]
+
+
+async def test_compact_packs_old_readings_by_hour(engine, device):
+    report = await compact(engine, NOW - timedelta(days=30), dry_run=True)
+    assert (report["readings"], report["chunks"]) == (6, 2)
+    assert report["bytes_after"] < report["bytes_before"]
+
+    report = await compact(engine, NOW - timedelta(days=30))
+    assert (report["readings"], report["chunks"]) == (6, 2)
+    async with engine.connect() as conn:
+        rows = await conn.execute(select(func.count()).select_from(DeviceData))
+        assert rows.scalar_one() == 2
+    assert (await compact(engine, NOW - timedelta(days=30)))["readings"] == 0
+
+
+async def test_service_reads_compacted_readings(engine, device):
+    async with AsyncSession(engine, expire_on_commit=False) as session:
+        service = DataService(session=session, shards=ShardMap({}))
+        before = await service.list(device.id, limit=50)
+        await compact(engine, NOW - timedelta(days=30), batch_size=4)
+        session.expunge_all()
+
+        for order in ("desc", "asc"):
+            for skip, limit in ((0, 50), (1, 3), (5, 2)):
+                readings = await service.list(
+                    device.id, skip=skip, limit=limit, order=order
+                )
+                expected = before if order == "desc" else list(reversed(before))
+                expected = expected[skip:][:limit]
+                assert [r.id for r in readings] == [r.id for r in expected]
+
+        # By ID, only rows are found; chunks are not searched.
+        compacted = before[-1]
+        with pytest.raises(NotFoundError):
+            await service.read(compacted.id)
+        with pytest.raises(NotFoundError):
+            await service.delete(compacted.id)
+
+        aggregate = await service.aggregate(device.id, "temperature")
+        assert (aggregate["count"], aggregate["min"], aggregate["max"]) == (8, 20, 27)
+        assert len(await service.list(device.id, limit=50)) == 8
+
+
+async def test_service_deletes_range_across_chunks(engine, device):
+    async with AsyncSession(engine, expire_on_commit=False) as session:
+        service = DataService(session=session, shards=ShardMap({}))
+        await compact(engine, NOW - timedelta(days=30))
+        progress = []
+
+        async def report(deleted):
+            progress.append(deleted)
+
+        # Ends mid-way through both compacted hours.
+        deleted = await service.delete_range(
+            device.id,
+            start=START + timedelta(minutes=30),
+            end=START + timedelta(minutes=75),
+            batch_size=1,
+            progress=report,
+        )
+        assert deleted == 3
+        assert progress[-1] == 3
+        remaining = await service.list(device.id, limit=50, order="asc")
+        assert [r.data["seq"] for r in remaining] == [0, 1, 5, 6, 7]
+
+        assert await service.delete_range(device.id, batch_size=2) == 5
+        assert await service.list(device.id, limit=50) == []
+        async with engine.connect() as conn:
+            chunks = await conn.execute(
+                select(func.count()).select_from(DeviceDataChunk)
+            )
+            assert chunks.scalar_one() == 0
+
+
+async def test_service_lists_many_devices(engine, device):
+    async with AsyncSession(engine, expire_on_commit=False) as session:
+        other = Device(name="Other Device")
+        session.add(other)
+        session.add(DeviceData(device_id=other.id, data={"seq": 0}))
+        await session.commit()
+        service = DataService(session=session, shards=ShardMap({}))
+        await compact(engine, NOW - timedelta(days=30))
+        session.expunge_all()
+
+        for order in ("desc", "asc"):
+            for limit in (1, 3, 50):
+                many = await service.list_many(
+                    [device.id, other.id], limit=limit, order=order
+                )
+                assert list(many) == [device.id, other.id]
+                for device_id, readings in many.items():
+                    single = await service.list(device_id, limit=limit, order=order)
+                    assert [r.id for r in readings] == [r.id for r in single]
+
+        window = await service.list_many(
+            [device.id],
+            start=START + timedelta(minutes=20),
+            end=START + timedelta(hours=1),
+        )
+        assert [r.data["seq"] for r in window[device.id]] == [3, 2]
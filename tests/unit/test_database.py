@@ -0,0 +1,132 @@
+import pytest
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import AsyncEngine, create_async_engine
+
+from app.models.api_key import ApiKey
+from app.utils import database
+from app.utils.database import ReplicaPool, get_read_session
+
+
+async def _session_url(read_primary: bool = False) -> str:
+    generator = get_read_session(read_primary=read_primary)
+    session = await anext(generator)
+    try:
+        assert isinstance(session.bind, AsyncEngine)
+        return str(session.bind.url)
+    finally:
+        await generator.aclose()
+
+
+@pytest.fixture
+def replica_url(tmp_path):
+    return f"sqlite+aiosqlite:///{tmp_path / 'replica.db'}"
+
+
+@pytest.fixture
+def broken_url(tmp_path):
+    return f"sqlite+aiosqlite:///{tmp_path / 'missing' / 'replica.db'}"
+
+
+async def test_read_session_uses_primary_without_replicas(monkeypatch):
+    monkeypatch.setattr(database, "_replicas", ReplicaPool([], retry_after=30))
+    assert await _session_url() == str(database.get_engine().url)
+
+
+async def test_read_session_uses_replica(monkeypatch, replica_url):
+    pool = ReplicaPool([create_async_engine(replica_url)], retry_after=30)
+    monkeypatch.setattr(database, "_replicas", pool)
+
+    assert await _session_url() == replica_url
+    await pool.engines[0].dispose()
+
+
+async def test_read_primary_header_bypasses_replicas(monkeypatch, replica_url):
+    pool = ReplicaPool([create_async_engine(replica_url)], retry_after=30)
+    monkeypatch.setattr(database, "_replicas", pool)
+
+    assert await _session_url(read_primary=True) == str(database.get_engine().url)
+    await pool.engines[0].dispose()
+
+
+async def test_unhealthy_replica_falls_back(monkeypatch, replica_url, broken_url):
+    broken = create_async_engine(broken_url)
+    healthy = create_async_engine(replica_url)
+    pool = ReplicaPool([broken, healthy], retry_after=30)
+    monkeypatch.setattr(database, "_replicas", pool)
+
+    urls = {await _session_url() for _ in range(4)}
+    assert urls == {replica_url}
+    assert pool.candidates() == [1]
+
+    await broken.dispose()
+    await healthy.dispose()
+
+
+async def test_all_replicas_down_falls_back_to_primary(monkeypatch, broken_url):
+    pool = ReplicaPool([create_async_engine(broken_url)], retry_after=30)
+    monkeypatch.setattr(database, "_replicas", pool)
+
+    assert await _session_url() == str(database.get_engine().url)
+    assert pool.candidates() == []
+    await pool.engines[0].dispose()
+
+
+async def test_replica_session_can_query(monkeypatch, replica_url):
+    pool = ReplicaPool([create_async_engine(replica_url)], retry_after=30)
+    monkeypatch.setattr(database, "_replicas", pool)
+
+    generator = get_read_session()
+    session = await anext(generator)
+    assert (await session.execute(text("select 1"))).scalar() == 1
+    await generator.aclose()
+    await pool.engines[0].dispose()
+
+
+async def test_create_tables_once_runs_once_per_key(tmp_path):
+    engine = create_async_engine(f"sqlite+aiosqlite:///{tmp_path / 'app.db'}")
+    table = ApiKey.__table__
+    calls = []
+
+    def create(conn):
+        calls.append(conn)
+        table.create(conn, checkfirst=True)
+
+    assert await database.create_tables_once(engine, [table], create) is True
+    assert await database.create_tables_once(engine, [table], create) is False
+    assert len(calls) == 1
+
+    other = create_async_engine(f"sqlite+aiosqlite:///{tmp_path / 'other.db'}")
+    assert await database.create_tables_once(other, [table], create) is True
+    assert len(calls) == 2
+
+    await engine.dispose()
+    await other.dispose()
+
+
+async def test_create_tables_once_runs_again_on_a_new_database(tmp_path):
+    path = tmp_path / "app.db"
+    table = ApiKey.__table__
+
+    def create(conn):
+        table.create(conn, checkfirst=True)
+
+    engine = create_async_engine(f"sqlite+aiosqlite:///{path}")
+    assert await database.create_tables_once(engine, [table], create) is True
+    await engine.dispose()
+    path.unlink()
+
+    engine = create_async_engine(f"sqlite+aiosqlite:///{path}")
+    assert await database.create_tables_once(engine, [table], create) is True
+    async with engine.connect() as conn:
+        assert (await conn.execute(text("select count(*) from apikey"))).scalar() == 0
+    await engine.dispose()
+
+
+async def test_create_tables_once_always_runs_in_memory():
+    engine = create_async_engine("sqlite+aiosqlite:///:memory:")
+    calls = []
+
+    for _ in range(2):
+        assert await database.create_tables_once(engine, [], calls.append) is True
+    assert len(calls) == 2
+    await engine.dispose()
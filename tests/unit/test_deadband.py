@@ -0,0 +1,67 @@
+import uuid
+from datetime import datetime, timedelta, timezone
+
+from app.schemas.device_schema import DeadbandConfig
+from app.utils.deadband import DeadbandFilter, deadband_config
+
+CONFIG = DeadbandConfig(heartbeat_seconds=60, tolerance={"temperature": 0.5})
+
+
+def test_deadband_config_is_opt_in():
+    assert deadband_config({"location": "lab"}) is None
+    assert deadband_config({"deadband": {}}) == DeadbandConfig()
+
+
+def test_config_is_parsed_once_per_revision():
+    device_id = uuid.uuid4()
+    deadband = DeadbandFilter()
+    first = datetime(2026, 1, 1, tzinfo=timezone.utc)
+    notes = {"deadband": {"heartbeat_seconds": 60}}
+
+    config = deadband.config(device_id, first, notes)
+    assert config == DeadbandConfig(heartbeat_seconds=60)
+    assert deadband.config(device_id, first, notes) is config
+    assert deadband.config(device_id, first + timedelta(seconds=1), {}) is None
+
+
+def test_first_reading_is_always_stored():
+    assert DeadbandFilter().unchanged(uuid.uuid4(), {"a": 1}, CONFIG, 0.0) is None
+
+
+def test_skips_within_tolerance_and_stores_changes():
+    device_id, data_id = uuid.uuid4(), uuid.uuid4()
+    deadband = DeadbandFilter()
+    deadband.remember(device_id, data_id, {"temperature": 20.0, "mode": "eco"}, 0.0)
+
+    def unchanged(data):
+        return deadband.unchanged(device_id, data, CONFIG, 1.0)
+
+    assert unchanged({"temperature": 20.4, "mode": "eco"}) == data_id
+    assert unchanged({"temperature": 20.6, "mode": "eco"}) is None
+    assert unchanged({"temperature": 20.0, "mode": "boost"}) is None
+    assert unchanged({"temperature": 20.0}) is None
+    assert unchanged({"temperature": True, "mode": "eco"}) is None
+
+
+def test_keys_without_tolerance_must_match_exactly():
+    device_id = uuid.uuid4()
+    deadband = DeadbandFilter()
+    deadband.remember(device_id, uuid.uuid4(), {"humidity": 50}, 0.0)
+    assert deadband.unchanged(device_id, {"humidity": 50.1}, CONFIG, 1.0) is None
+
+
+def test_heartbeat_stores_unchanged_reading():
+    device_id = uuid.uuid4()
+    deadband = DeadbandFilter()
+    deadband.remember(device_id, uuid.uuid4(), {"temperature": 20.0}, 0.0)
+    assert deadband.unchanged(device_id, {"temperature": 20.0}, CONFIG, 59.0)
+    assert deadband.unchanged(device_id, {"temperature": 20.0}, CONFIG, 60.0) is None
+
+
+def test_least_recently_used_device_is_forgotten():
+    deadband = DeadbandFilter(max_devices=2)
+    devices = [uuid.uuid4() for _ in range(3)]
+    for device_id in devices:
+        deadband.remember(device_id, uuid.uuid4(), {"a": 1}, 0.0)
+    assert deadband.unchanged(devices[0], {"a": 1}, CONFIG, 1.0) is None
+    assert deadband.unchanged(devices[2], {"a": 1}, CONFIG, 1.0) is not None
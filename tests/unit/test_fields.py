@@ -0,0 +1,88 @@
+import pytest_asyncio
+from sqlalchemy import func, select, update
+from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
+
+from app.models.api_key import ApiKey
+from app.models.device import Device, DeviceData
+from app.models.field import DeviceDataValue
+from app.services.data_service import DataService
+from app.utils.sharding import ShardMap
+
+
+@pytest_asyncio.fixture(loop_scope="function")
+async def api_key(db_session: AsyncSession):
+    device = Device(name="Field Device")
+    db_session.add(device)
+    key = ApiKey(key_hash="field-hash", device_id=device.id)
+    db_session.add(key)
+    await db_session.commit()
+    yield key
+
+
+async def test_ingest_records_field_registry(db_session, api_key):
+    service = DataService(session=db_session, shards=ShardMap({}))
+    for data in ({"temperature": 20, "mode": "eco"}, {"temperature": "n/a"}):
+        await service.create(data_in=data, api_key=api_key)
+
+    fields = {field.key: field for field in await service.fields(api_key.device_id)}
+    assert set(fields) == {"temperature", "mode"}
+    assert fields["temperature"].count == 2
+    assert fields["temperature"].numeric_count == 1
+    assert fields["temperature"].last_type == "string"
+    assert fields["mode"].count == 1
+
+
+async def test_promoted_field_is_backfilled_and_aggregated_from_typed_values(
+    db_session, api_key
+):
+    service = DataService(session=db_session, shards=ShardMap({}))
+    for temperature in (10, 20, "n/a"):
+        await service.create(data_in={"temperature": temperature}, api_key=api_key)
+
+    aggregate = await service.aggregate(api_key.device_id, "temperature")
+    assert (aggregate["count"], aggregate["min"], aggregate["max"]) == (2, 10, 20)
+
+    await service.promote_field(api_key.device_id, "temperature")
+    # Readings after the promotion get their typed value on ingest
+    await service.create(data_in={"temperature": 30}, api_key=api_key)
+    assert await service.backfill_field(api_key.device_id, "temperature", 1) == 2
+
+    # Aggregates now come from devicedatavalue, not the JSON data
+    await db_session.execute(update(DeviceData).values(data={}))
+    await db_session.commit()
+    aggregate = await service.aggregate(api_key.device_id, "temperature")
+    assert aggregate == {
+        "field": "temperature",
+        "count": 3,
+        "min": 10.0,
+        "max": 30.0,
+        "mean": 20.0,
+    }
+
+
+async def test_typed_values_follow_readings_to_their_shard(
+    db_session, api_key, tmp_path
+):
+    shards = ShardMap(
+        {"a": create_async_engine(f"sqlite+aiosqlite:///{tmp_path / 'a'}.db")}
+    )
+    await shards.create_tables()
+    service = DataService(session=db_session, shards=shards)
+    await service.create(data_in={"battery": 3.7}, api_key=api_key)
+    await service.promote_field(api_key.device_id, "battery")
+    await service.create(data_in={"battery": 3.5}, api_key=api_key)
+    await service.backfill_field(api_key.device_id, "battery")
+
+    async with shards.engines["a"].connect() as conn:
+        values = await conn.execute(select(func.count()).select_from(DeviceDataValue))
+        assert values.scalar_one() == 2
+    assert (await service.aggregate(api_key.device_id, "battery"))["count"] == 2
+
+    created = await service.list(api_key.device_id)
+    await service.delete(created[0].id)
+    async with shards.engines["a"].connect() as conn:
+        values = await conn.execute(select(func.count()).select_from(DeviceDataValue))
+        assert values.scalar_one() == 1
+
+    await service.close()
+    await shards.dispose()
@@ -0,0 +1,62 @@
+import uuid
+from datetime import datetime, timedelta, timezone
+
+import pytest_asyncio
+from sqlalchemy import func, select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.models.device import Device, IdempotencyKey
+from app.utils.idempotency import claim, expire
+
+
+@pytest_asyncio.fixture(loop_scope="function")
+async def device(db_session: AsyncSession):
+    device = Device(name="Retrying Device")
+    db_session.add(device)
+    await db_session.commit()
+    yield device
+
+
+async def test_claim_returns_original_reading(db_session, device):
+    first, second = uuid.uuid4(), uuid.uuid4()
+    assert await claim(db_session, device.id, "k1", first, window=60) is None
+    await db_session.commit()
+    assert await claim(db_session, device.id, "k1", second, window=60) == first
+    assert await claim(db_session, device.id, "k2", second, window=60) is None
+
+
+async def test_claim_takes_over_expired_key(db_session, device):
+    first, second = uuid.uuid4(), uuid.uuid4()
+    db_session.add(
+        IdempotencyKey(
+            device_id=device.id,
+            key="k",
+            data_id=first,
+            created_date=datetime.now(timezone.utc) - timedelta(hours=2),
+        )
+    )
+    await db_session.commit()
+    assert await claim(db_session, device.id, "k", second, window=3600) is None
+    await db_session.commit()
+    assert await claim(db_session, device.id, "k", first, window=3600) == second
+
+
+async def test_expire_deletes_old_keys_in_batches(db_session, device):
+    old = datetime.now(timezone.utc) - timedelta(hours=2)
+    for i in range(5):
+        db_session.add(
+            IdempotencyKey(
+                device_id=device.id,
+                key=f"old{i}",
+                data_id=uuid.uuid4(),
+                created_date=old,
+            )
+        )
+    db_session.add(IdempotencyKey(device_id=device.id, key="new", data_id=uuid.uuid4()))
+    await db_session.commit()
+
+    assert await expire(db_session, window=3600, batch_size=2) == 5
+    result = await db_session.execute(select(IdempotencyKey.key))
+    assert result.scalars().all() == ["new"]
+    result = await db_session.execute(select(func.count()).select_from(IdempotencyKey))
+    assert result.scalar_one() == 1
@@ -0,0 +1,156 @@
+import asyncio
+import socket
+import uuid
+from datetime import datetime, timezone
+
+import pytest
+import pytest_asyncio
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.models.api_key import ApiKey
+from app.models.device import Device, DeviceData
+from app.utils.auth import hash_api_key
+from app.utils.line_protocol import (
+    BatchWriter,
+    KeyLookup,
+    LineError,
+    LineProtocolServer,
+    parse_line,
+    store_lines,
+)
+
+NOW = datetime(2026, 10, 19, 12, 0, tzinfo=timezone.utc)
+DEVICE_ID = uuid.uuid4()
+
+
+def test_parse_line():
+    device_id, key, timestamp, fields = parse_line(
+        f'{DEVICE_ID} secret 1792411200.5 t=21.5,n=-3,ok=true,mode="a \\"b\\", c"',
+        NOW,
+    )
+    assert (device_id, key) == (DEVICE_ID, "secret")
+    assert timestamp == datetime(2026, 10, 19, 12, 0, 0, 500000, tzinfo=timezone.utc)
+    assert fields == {"t": 21.5, "n": -3, "ok": True, "mode": 'a "b", c'}
+    assert parse_line(f"{DEVICE_ID} secret - t=1", NOW)[2] == NOW
+
+
+@pytest.mark.parametrize(
+    "line",
+    [
+        f"{DEVICE_ID} secret -",
+        "not-a-uuid secret - t=1",
+        f"{DEVICE_ID} secret yesterday t=1",
+        f"{DEVICE_ID} secret - t=warm",
+        f"{DEVICE_ID} secret - t=nan",
+        f"{DEVICE_ID} secret - t=1,",
+        f"{DEVICE_ID} secret - t=1 u=2",
+        f'{DEVICE_ID} secret - t="open',
+    ],
+)
+def test_parse_line_rejects(line):
+    with pytest.raises(LineError):
+        parse_line(line, NOW)
+
+
+@pytest_asyncio.fixture(loop_scope="function")
+async def device(db_session: AsyncSession):
+    device = Device(name="Line Device")
+    db_session.add(device)
+    db_session.add(ApiKey(key_hash=hash_api_key("secret"), device_id=device.id))
+    await db_session.commit()
+    yield device
+
+
+@pytest_asyncio.fixture(loop_scope="function")
+async def server():
+    server = LineProtocolServer(
+        BatchWriter(store_lines, batch_size=100, interval=0.01),
+        KeyLookup(ttl=60),
+        max_line_bytes=256,
+        max_skew=86_400 * 365 * 100,
+    )
+    await server.start("127.0.0.1", tcp_port=0, udp_port=0)
+    yield server
+    await server.stop()
+
+
+async def _stored(db_session) -> list[DeviceData]:
+    result = await db_session.execute(select(DeviceData))
+    return list(result.scalars().all())
+
+
+async def test_tcp_answers_each_line_in_order(server, device, db_session):
+    host, port = server.sockets()["tcp"]
+    reader, writer = await asyncio.open_connection(host, port)
+    writer.write(
+        f"{device.id} secret 1792411200 temperature=20\n"
+        f"{device.id} wrong - temperature=21\n"
+        f"{device.id} secret - temperature=\n"
+        f"{device.id} secret - temperature=22\n".encode()
+    )
+    await writer.drain()
+    answers = [(await reader.readline()).decode().split(" ", 1) for _ in range(4)]
+    writer.close()
+
+    assert [answer[0] for answer in answers] == ["ok", "error", "error", "ok"]
+    assert answers[1][1].strip() == "invalid api key"
+    stored = {str(r.id): r for r in await _stored(db_session)}
+    assert set(stored) == {answers[0][1].strip(), answers[3][1].strip()}
+    first = stored[answers[0][1].strip()]
+    assert first.data == {"temperature": 20}
+    assert first.created_date.replace(tzinfo=timezone.utc) == datetime(
+        2026, 10, 19, 12, 0, tzinfo=timezone.utc
+    )
+    assert server.counters == {"lines": 4, "stored": 2, "skipped": 0, "errors": 2}
+
+
+async def test_tcp_validates_batches_against_the_schema(server, device, db_session):
+    device.notes = {"schema": {"fields": {"temperature": "number"}}}
+    db_session.add(device)
+    await db_session.commit()
+    host, port = server.sockets()["tcp"]
+    reader, writer = await asyncio.open_connection(host, port)
+    writer.write(
+        f"{device.id} secret - temperature=20\n"
+        f'{device.id} secret - temperature="warm"\n'
+        f"{device.id} secret - humidity=40\n"
+        f"{device.id} secret - temperature=22\n".encode()
+    )
+    await writer.drain()
+    answers = [(await reader.readline()).decode() for _ in range(4)]
+    writer.close()
+
+    assert [answer.split(" ", 1)[0] for answer in answers] == [
+        "ok",
+        "error",
+        "error",
+        "ok",
+    ]
+    assert answers[1].startswith("error invalid data: temperature:")
+    assert answers[2].startswith("error invalid data: temperature:")
+    stored = await _stored(db_session)
+    assert sorted(r.data["temperature"] for r in stored) == [20, 22]
+
+
+async def test_tcp_rejects_long_lines(server, device):
+    host, port = server.sockets()["tcp"]
+    reader, writer = await asyncio.open_connection(host, port)
+    writer.write(f"{device.id} secret - t={'1' * 300}\n".encode())
+    await writer.drain()
+    assert await reader.readline() == b"error line too long\n"
+    writer.close()
+
+
+async def test_udp_datagram(server, device, db_session):
+    host, port = server.sockets()["udp"]
+    with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as sock:
+        sock.sendto(
+            f"{device.id} secret - a=1\n{device.id} secret - a=2\n".encode(),
+            (host, port),
+        )
+    for _ in range(100):
+        if server.counters["stored"] == 2:
+            break
+        await asyncio.sleep(0.01)
+    assert sorted(r.data["a"] for r in await _stored(db_session)) == [1, 2]
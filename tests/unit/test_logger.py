@@ -0,0 +1,82 @@
+import io
+import threading
+
+from loguru import logger
+
+from app.utils import logger as logger_module
+from app.utils.logger import _BatchingSink, _RecordFilter
+
+
+class _BlockingStream(io.StringIO):
+    def __init__(self):
+        super().__init__()
+        self.release = threading.Event()
+
+    def write(self, s):
+        self.release.wait(timeout=5)
+        return super().write(s)
+
+
+def _record(level: str, **extra):
+    return {"level": logger.level(level), "extra": extra}
+
+
+def test_batching_sink_writes_all_messages():
+    stream = io.StringIO()
+    sink = _BatchingSink(stream, queue_size=100, batch_size=10, flush_interval=0.01)
+    for i in range(25):
+        sink.write(f"line {i}\n")
+    sink.stop()
+
+    lines = stream.getvalue().splitlines()
+    assert lines == [f"line {i}" for i in range(25)]
+    assert sink.stats()["dropped"] == 0
+
+
+def test_batching_sink_counts_and_reports_drops():
+    stream = _BlockingStream()
+    sink = _BatchingSink(stream, queue_size=2, batch_size=1, flush_interval=0.01)
+    for i in range(50):
+        sink.write(f"line {i}\n")
+    assert sink.stats()["dropped"] > 0
+
+    stream.release.set()
+    sink.stop()
+    assert "log queue overflow: dropped" in stream.getvalue()
+
+
+def test_filter_route_level_override():
+    record_filter = _RecordFilter("INFO", {"/health": "WARNING"}, 1.0)
+    assert record_filter.min_level == logger.level("INFO").no
+    assert not record_filter(_record("INFO", path="/health"))
+    assert record_filter(_record("WARNING", path="/health"))
+    assert record_filter(_record("INFO", path="/api/v1/data/"))
+
+
+def test_filter_route_level_can_lower_minimum():
+    record_filter = _RecordFilter("WARNING", {"/api/v1/data": "DEBUG"}, 1.0)
+    assert record_filter.min_level == logger.level("DEBUG").no
+    assert record_filter(_record("DEBUG", path="/api/v1/data/"))
+    assert not record_filter(_record("INFO", path="/api/v1/devices/"))
+
+
+def test_filter_samples_successful_access_logs_only():
+    record_filter = _RecordFilter("INFO", {}, 0.0)
+    assert not record_filter(_record("INFO", access=True, status=200))
+    assert record_filter(_record("INFO", access=True, status=500))
+    assert record_filter(_record("WARNING", access=True, status=200))
+    assert record_filter(_record("INFO"))
+
+
+def test_setup_logging_is_idempotent(monkeypatch):
+    calls = []
+    monkeypatch.setattr(logger_module, "_applied_config", None)
+    monkeypatch.setattr(logger_module.logger, "remove", lambda: calls.append(1))
+    monkeypatch.setattr(logger_module.logger, "add", lambda *a, **kw: None)
+
+    logger_module.setup_logging(level="INFO", route_levels={"/health": "WARNING"})
+    logger_module.setup_logging(level="INFO", route_levels={"/health": "WARNING"})
+    assert len(calls) == 1
+
+    logger_module.setup_logging(level="DEBUG")
+    assert len(calls) == 2
@@ -0,0 +1,129 @@
+import io
+import json
+
+import pytest
+from sqlalchemy import func, select
+
+from app.models.device import Device, DeviceData
+from app.models.field import DeviceField
+from app.utils.sharding import ShardMap
+from migrate import ExportReader, migrate
+
+EXPORT = [
+    {
+        "device_id": "weather station",
+        "notes": {"site": "roof"},
+        "created_date": "2024-01-01T00:00:00",
+        "data": [
+            {
+                "data": {"temperature": 20 + i, "label": "é, [x]"},
+                "created_date": f"2024-01-02T00:0{i}:00",
+            }
+            for i in range(5)
+        ],
+    },
+    {"data": [], "device_id": "idle sensor"},
+    {
+        "data": [{"data": {"on": True}, "created_date": "2024-01-03T00:00:00+00:00"}],
+        "device_id": "relay",
+        "notes": {"late": "keys after data"},
+    },
+]
+
+
+@pytest.fixture
+def export(tmp_path):
+    path = tmp_path / "devices.json"
+    path.write_text(json.dumps(EXPORT, indent=2, ensure_ascii=False))
+    return path
+
+
+@pytest.mark.parametrize("chunk_size", [1, 7, 1 << 20])
+def test_reader_streams_any_chunking(export, chunk_size):
+    with open(export, "rb") as file:
+        items = list(ExportReader(file, chunk_size=chunk_size).items())
+    kinds = [kind for kind, _ in items]
+    assert kinds == ["device"] + ["reading"] * 5 + ["end", "device", "end"] + [
+        "device",
+        "reading",
+        "end",
+    ]
+    assert items[1][1] == EXPORT[0]["data"][0]
+    # Keys after `data` are only known at the end of the document.
+    assert items[-3] == ("device", {})
+    assert items[-1] == (
+        "end",
+        {"device_id": "relay", "notes": {"late": "keys after data"}},
+    )
+
+
+def test_reader_rejects_truncated_export():
+    with pytest.raises(ValueError):
+        list(ExportReader(io.BytesIO(b'[{"data": [{"data": {}}')).items())
+
+
+async def _counts(engine):
+    async with engine.connect() as conn:
+        devices = dict((await conn.execute(select(Device.name, Device.notes))).all())
+        readings = (
+            await conn.execute(select(func.count()).select_from(DeviceData))
+        ).scalar_one()
+        fields = dict(
+            (await conn.execute(select(DeviceField.key, DeviceField.count))).all()
+        )
+    return devices, readings, fields
+
+
+async def test_migrate_loads_in_batches(export, engine, tmp_path):
+    checkpoint = tmp_path / "devices.json.checkpoint"
+    await migrate(
+        export,
+        False,
+        engine=engine,
+        shards=ShardMap({}),
+        workers=2,
+        batch_size=2,
+        checkpoint=checkpoint,
+    )
+    devices, readings, fields = await _counts(engine)
+    assert devices == {
+        "Weather Station": {"site": "roof"},
+        "Idle Sensor": {},
+        "Relay": {"late": "keys after data"},
+    }
+    assert readings == 6
+    assert fields == {"temperature": 5, "label": 5, "on": 1}
+    state = json.loads(checkpoint.read_text())
+    assert sorted(state["complete"]) == ["0", "1", "2"]
+
+    # Resuming after a crash that committed batches 1 and 2 of a device but
+    # only recorded batch 0 stores nothing twice.
+    state["complete"].remove("0")
+    state["batches"] = {"0": [0]}
+    checkpoint.write_text(json.dumps(state))
+    await migrate(
+        export,
+        False,
+        engine=engine,
+        shards=ShardMap({}),
+        workers=2,
+        batch_size=2,
+        checkpoint=checkpoint,
+    )
+    assert await _counts(engine) == (devices, readings, fields)
+
+    with pytest.raises(SystemExit):
+        await migrate(
+            export,
+            False,
+            engine=engine,
+            shards=ShardMap({}),
+            batch_size=3,
+            checkpoint=checkpoint,
+        )
+
+
+async def test_migrate_dry_run_writes_nothing(export, engine, capsys):
+    await migrate(export, True, engine=engine)
+    assert "Weather Station: 5 records" in capsys.readouterr().out
+    assert await _counts(engine) == ({}, 0, {})
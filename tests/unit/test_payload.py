@@ -0,0 +1,61 @@
+import json
+
+import pytest
+
+from app.utils.payload import JSONLimitScanner, PayloadLimitExceeded, check_limits
+
+
+def feed_in_chunks(scanner: JSONLimitScanner, body: bytes, size: int) -> None:
+    for start in range(0, len(body), size):
+        end = start + size
+        scanner.feed(body[start:end])
+
+
+@pytest.mark.parametrize("chunk_size", [1, 3, 1024])
+def test_scanner_counts_depth_and_keys(chunk_size):
+    body = json.dumps({"a": {"b": [1, {"c": 2}]}, "d": "x"}).encode()
+    scanner = JSONLimitScanner(max_depth=10, max_keys=10)
+    feed_in_chunks(scanner, body, chunk_size)
+    assert scanner.keys == 4
+    assert scanner.depth == 0
+
+
+@pytest.mark.parametrize("chunk_size", [1, 2, 1024])
+def test_scanner_ignores_structure_inside_strings(chunk_size):
+    body = json.dumps({"k": 'x:{[\\"]}:', "q": "\\"}).encode()
+    scanner = JSONLimitScanner(max_depth=1, max_keys=2)
+    feed_in_chunks(scanner, body, chunk_size)
+    assert scanner.keys == 2
+    assert scanner.depth == 0
+
+
+def test_scanner_rejects_deep_nesting():
+    scanner = JSONLimitScanner(max_depth=3, max_keys=100)
+    with pytest.raises(PayloadLimitExceeded, match="nesting"):
+        scanner.feed(b'{"a": {"b": {"c": {')
+
+
+def test_scanner_rejects_too_many_keys():
+    scanner = JSONLimitScanner(max_depth=3, max_keys=2)
+    with pytest.raises(PayloadLimitExceeded, match="keys"):
+        scanner.feed(b'{"a": 1, "b": 2, "c": 3}')
+
+
+def test_check_limits_accepts_json_values():
+    check_limits({"a": [1, 2.5, "x", True, None], "b": {"c": 1}}, 3, 3)
+
+
+@pytest.mark.parametrize(
+    "value",
+    [{1: "x"}, {"a": b"bytes"}, {"a": float("nan")}, {"a": {1, 2}}],
+)
+def test_check_limits_rejects_non_json_values(value):
+    with pytest.raises(ValueError):
+        check_limits(value, 3, 3)
+
+
+def test_check_limits_counts_depth_and_keys():
+    with pytest.raises(PayloadLimitExceeded, match="nesting"):
+        check_limits({"a": [[1]]}, 2, 10)
+    with pytest.raises(PayloadLimitExceeded, match="keys"):
+        check_limits({"a": {"b": 1, "c": 2}}, 10, 2)
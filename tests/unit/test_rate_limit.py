@@ -0,0 +1,63 @@
+import uuid
+
+import pytest
+
+from app.utils.rate_limit import (
+    MemoryRateLimitBackend,
+    RateLimiter,
+    SQLiteRateLimitBackend,
+    _take,
+)
+
+
+@pytest.fixture(params=["memory", "sqlite"])
+def backend(request, tmp_path):
+    if request.param == "memory":
+        return MemoryRateLimitBackend()
+    return SQLiteRateLimitBackend(str(tmp_path / "buckets.db"))
+
+
+def test_take_refills_up_to_burst():
+    assert _take(0.0, 0.0, rate=2.0, burst=5, now=10.0) == (4.0, 0.0)
+    tokens, retry_after = _take(0.0, 0.0, rate=2.0, burst=5, now=0.25)
+    assert tokens == 0.5
+    assert retry_after == 0.25
+
+
+async def test_backend_allows_burst_then_limits(backend):
+    results = [await backend.acquire("key", 1.0, 3, now=100.0) for _ in range(4)]
+    assert results[:3] == [0.0, 0.0, 0.0]
+    assert results[3] == pytest.approx(1.0)
+
+    assert await backend.acquire("key", 1.0, 3, now=101.0) == 0.0
+    assert await backend.acquire("other", 1.0, 3, now=101.0) == 0.0
+
+
+async def test_sqlite_backend_is_shared_between_instances(tmp_path):
+    path = str(tmp_path / "buckets.db")
+    first, second = SQLiteRateLimitBackend(path), SQLiteRateLimitBackend(path)
+
+    assert await first.acquire("key", 1.0, 2, now=50.0) == 0.0
+    assert await second.acquire("key", 1.0, 2, now=50.0) == 0.0
+    assert await first.acquire("key", 1.0, 2, now=50.0) > 0
+
+
+async def test_memory_backend_evicts_oldest_keys():
+    backend = MemoryRateLimitBackend(max_keys=2)
+    for key in ("a", "b", "c"):
+        await backend.acquire(key, 1.0, 1, now=0.0)
+    assert list(backend._buckets) == ["b", "c"]
+
+
+async def test_device_overrides_and_disabled_rate():
+    device_id = str(uuid.uuid4())
+    limiter = RateLimiter(
+        MemoryRateLimitBackend(), rate=0.0, burst=1, overrides={device_id: (1.0, 1)}
+    )
+    assert limiter.limits_for(device_id) == (1.0, 1)
+    assert limiter.limits_for(str(uuid.uuid4())) == (0.0, 1)
+
+    assert await limiter.check("k", str(uuid.uuid4())) == 0.0
+    assert await limiter.check("k", str(uuid.uuid4())) == 0.0
+    assert await limiter.check("k", device_id) == 0.0
+    assert await limiter.check("k", device_id) > 0
@@ -0,0 +1,150 @@
+import uuid
+
+import pytest_asyncio
+from sqlalchemy import func, select
+from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
+from sqlmodel import SQLModel
+
+from app.models.api_key import ApiKey
+from app.models.device import Device, DeviceData
+from app.services.data_service import DataService
+from app.utils.sharding import ShardMap, rebalance
+
+
+def _shard_map(tmp_path, names):
+    return ShardMap(
+        {
+            name: create_async_engine(f"sqlite+aiosqlite:///{tmp_path / name}.db")
+            for name in names
+        }
+    )
+
+
+async def _device_counts(shards: ShardMap) -> dict[str, dict[uuid.UUID, int]]:
+    counts: dict[str, dict[uuid.UUID, int]] = {}
+    for name, engine in shards.engines.items():
+        async with engine.connect() as conn:
+            table = DeviceData.__table__  # type: ignore[attr-defined]
+            result = await conn.execute(
+                select(table.c.device_id, func.count()).group_by(table.c.device_id)
+            )
+            counts[name] = dict(result.all())
+    return counts
+
+
+@pytest_asyncio.fixture(loop_scope="function")
+async def shards(tmp_path):
+    shard_map = _shard_map(tmp_path, ["a", "b", "c"])
+    await shard_map.create_tables()
+    yield shard_map
+    await shard_map.dispose()
+
+
+@pytest_asyncio.fixture(loop_scope="function")
+async def api_keys(db_session: AsyncSession):
+    keys = []
+    # Fixed IDs keep placement deterministic, so some devices always move to "d"
+    for i in range(12):
+        device = Device(id=uuid.UUID(int=i + 1), name=f"Sharded Device {i}")
+        db_session.add(device)
+        key = ApiKey(key_hash=f"hash-{i}", device_id=device.id)
+        db_session.add(key)
+        keys.append(key)
+    await db_session.commit()
+    yield keys
+
+
+def test_shard_for_is_deterministic(tmp_path):
+    shard_map = _shard_map(tmp_path, ["a", "b", "c"])
+    device_ids = [uuid.uuid4() for _ in range(300)]
+
+    placement = [shard_map.shard_for(device_id) for device_id in device_ids]
+    assert placement == [shard_map.shard_for(device_id) for device_id in device_ids]
+    assert set(placement) == {"a", "b", "c"}
+
+
+def test_adding_a_shard_only_moves_devices_to_it(tmp_path):
+    before = _shard_map(tmp_path, ["a", "b", "c"])
+    after = _shard_map(tmp_path, ["a", "b", "c", "d"])
+
+    for device_id in (uuid.uuid4() for _ in range(300)):
+        old, new = before.shard_for(device_id), after.shard_for(device_id)
+        assert new == old or new == "d"
+
+
+async def test_readings_are_stored_on_the_device_shard(
+    db_session: AsyncSession, shards: ShardMap, api_keys: list[ApiKey]
+):
+    service = DataService(session=db_session, shards=shards)
+    ids = {}
+    for key in api_keys:
+        created = await service.create(data_in={"temperature": 20}, api_key=key)
+        ids[key.device_id] = uuid.UUID(created["id"])
+
+    counts = await _device_counts(shards)
+    for device_id in ids:
+        assert counts[shards.shard_for(device_id)][device_id] == 1
+
+    primary = await db_session.execute(select(func.count()).select_from(DeviceData))
+    assert primary.scalar() == 0
+
+    device_id, data_id = next(iter(ids.items()))
+    assert [d.id for d in await service.list(device_id=device_id)] == [data_id]
+    assert (await service.read(data_id=data_id)).device_id == device_id
+
+    await service.delete(data_id=data_id)
+    assert list(await service.list(device_id=device_id)) == []
+    await service.close()
+
+
+async def test_rebalance_moves_devices_to_new_shard(
+    tmp_path, db_session: AsyncSession, shards: ShardMap, api_keys: list[ApiKey]
+):
+    service = DataService(session=db_session, shards=shards)
+    for key in api_keys:
+        for _ in range(3):
+            await service.create(data_in={"temperature": 20}, api_key=key)
+    await service.close()
+
+    grown = ShardMap({**shards.engines, **_shard_map(tmp_path, ["d"]).engines})
+    await grown.create_tables()
+
+    moves = await rebalance(grown, grown.engines, batch_size=2)
+    assert moves
+    assert all(target == "d" for _, target, _ in moves.values())
+
+    counts = await _device_counts(grown)
+    placed = {device_id: name for name, found in counts.items() for device_id in found}
+    assert len(placed) == len(api_keys)
+    for name, found in counts.items():
+        for device_id, count in found.items():
+            assert grown.shard_for(device_id) == name
+            assert count == 3
+
+    assert await rebalance(grown, grown.engines) == {}
+    await grown.engines["d"].dispose()
+
+
+async def test_rebalance_dry_run_writes_nothing(
+    tmp_path, db_session: AsyncSession, shards: ShardMap, api_keys: list[ApiKey]
+):
+    service = DataService(session=db_session, shards=shards)
+    for key in api_keys:
+        await service.create(data_in={"temperature": 20}, api_key=key)
+    await service.close()
+    before = await _device_counts(shards)
+
+    grown = ShardMap({**shards.engines, **_shard_map(tmp_path, ["d"]).engines})
+    await grown.create_tables()
+    assert await rebalance(grown, shards.engines, dry_run=True)
+    assert await _device_counts(shards) == before
+    await grown.engines["d"].dispose()
+
+
+async def test_shard_tables_have_no_device_table(shards: ShardMap):
+    async with shards.engines["a"].connect() as conn:
+        tables = await conn.run_sync(
+            lambda sync_conn: SQLModel.metadata.tables.keys()
+            & set(sync_conn.dialect.get_table_names(sync_conn))
+        )
+    assert tables == {"devicedata", "devicedatachunk", "devicedatavalue"}
@@ -0,0 +1,133 @@
+import asyncio
+import fcntl
+import shutil
+import uuid
+
+import pytest_asyncio
+from sqlalchemy import func, select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.models.device import Device, DeviceData
+from app.services.data_service import DataService
+from app.utils import idempotency
+from app.utils.sharding import ShardMap
+from app.utils.spool import Spool, read_segment, replay
+
+
+@pytest_asyncio.fixture(loop_scope="function")
+async def device(db_session: AsyncSession):
+    device = Device(name="Spooled Device")
+    db_session.add(device)
+    await db_session.commit()
+    yield device
+
+
+def _readings(device_id, count):
+    return [
+        DeviceData(device_id=device_id, data={"temperature": 20 + i})
+        for i in range(count)
+    ]
+
+
+async def test_appends_share_one_segment(tmp_path):
+    spool = Spool(tmp_path, segment_bytes=1 << 20, fsync_interval=0.01)
+    readings = _readings(uuid.uuid4(), 5)
+    await asyncio.gather(*(spool.append(reading) for reading in readings))
+    await spool.seal()
+
+    (segment,) = spool.segments()
+    stored = read_segment(segment.read_bytes())
+    assert [r.id for r in stored] == [r.id for r in readings]
+    assert [r.data for r in stored] == [r.data for r in readings]
+    assert stored[0].created_date == readings[0].created_date
+    assert spool.stats()["segments"] == 1
+    assert spool.stats()["appended"] == 5
+
+
+async def test_segment_is_locked_before_it_is_visible(tmp_path, monkeypatch):
+    spool = Spool(tmp_path, segment_bytes=1 << 20, fsync_interval=0)
+    visible = []
+    flock = fcntl.flock
+
+    def locking(file, operation):
+        visible.append(list(tmp_path.glob("*.seg")))
+        return flock(file, operation)
+
+    monkeypatch.setattr(fcntl, "flock", locking)
+    await spool.append(_readings(uuid.uuid4(), 1)[0])
+    assert visible == [[]]
+    assert len(list(tmp_path.glob("*.seg"))) == 1
+    assert not list(tmp_path.glob("*.tmp"))
+
+
+async def test_segments_rotate_by_size(tmp_path):
+    spool = Spool(tmp_path, segment_bytes=1, fsync_interval=0)
+    for reading in _readings(uuid.uuid4(), 3):
+        await spool.append(reading)
+    assert len(spool.segments()) == 3
+
+
+async def test_torn_record_is_dropped(tmp_path):
+    spool = Spool(tmp_path, segment_bytes=1 << 20, fsync_interval=0)
+    for reading in _readings(uuid.uuid4(), 2):
+        await spool.append(reading)
+    await spool.seal()
+    (segment,) = spool.segments()
+    data = segment.read_bytes()
+    assert len(read_segment(data[:-3])) == 1
+
+
+async def test_replay_is_idempotent(tmp_path, db_session, device):
+    spool = Spool(tmp_path, segment_bytes=1 << 20, fsync_interval=0)
+    for reading in _readings(device.id, 3):
+        await spool.append(reading)
+    await spool.append(DeviceData(device_id=uuid.uuid4(), data={"orphan": True}))
+    await spool.seal()
+    # As if a replay crashed after storing the readings, before deleting.
+    (segment,) = spool.segments()
+    shutil.copy(segment, tmp_path / f"{segment.name.split('-')[0]}-0.seg")
+
+    service = DataService(session=db_session, shards=ShardMap({}))
+    stored = await replay(spool, service.store_many, batch_size=2)
+    assert stored == 3
+    assert spool.segments() == []
+    assert spool.stats()["replayed"] == 8
+
+    result = await db_session.execute(select(func.count()).select_from(DeviceData))
+    assert result.scalar_one() == 3
+    fields = {f.key: f for f in await service.fields(device.id)}
+    assert fields["temperature"].count == 3
+
+
+async def test_replay_claims_idempotency_keys(tmp_path, db_session, device):
+    spool = Spool(tmp_path, segment_bytes=1 << 20, fsync_interval=0)
+    first, retry, other = _readings(device.id, 3)
+    # A retry after a lost 202, spooled as well, and a key claimed while the
+    # database was up.
+    await spool.append(first, "boot-1/7")
+    await spool.append(retry, "boot-1/7")
+    await spool.append(other, "boot-1/8")
+    await idempotency.claim(db_session, device.id, "boot-1/8", uuid.uuid4(), 3600)
+    await db_session.commit()
+    await spool.seal()
+    (segment,) = spool.segments()
+    shutil.copy(segment, tmp_path / f"{segment.name.split('-')[0]}-0.seg")
+
+    service = DataService(session=db_session, shards=ShardMap({}))
+    assert await replay(spool, service.store_many, batch_size=2) == 1
+    result = await db_session.execute(select(DeviceData.id))
+    assert result.scalars().all() == [first.id]
+
+
+async def test_replay_skips_locked_segments(tmp_path, db_session, device):
+    spool = Spool(tmp_path, segment_bytes=1 << 20, fsync_interval=0)
+    await spool.append(_readings(device.id, 1)[0])
+    await spool.seal()
+    (segment,) = spool.segments()
+
+    service = DataService(session=db_session, shards=ShardMap({}))
+    with open(segment, "rb") as other_worker:
+        fcntl.flock(other_worker, fcntl.LOCK_EX)
+        assert await replay(spool, service.store_many, batch_size=10) == 0
+    assert spool.segments() == [segment]
+    assert await replay(spool, service.store_many, batch_size=10) == 1
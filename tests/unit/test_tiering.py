@@ -0,0 +1,177 @@
+import uuid
+from datetime import datetime, timedelta, timezone
+
+import pytest
+import pytest_asyncio
+from sqlalchemy import delete, func, select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.models.device import DeviceData, DeviceDataChunk
+from app.models.field import DeviceDataValue, DeviceField
+from app.services.data_service import DataService
+from app.utils.compaction import compact
+from app.utils.sharding import ShardMap
+
+pytest.importorskip("pyarrow")
+
+from app.utils import tiering  # noqa: E402
+from app.utils.tiering import ColdStore, tier  # noqa: E402
+
+NOW = datetime.now(timezone.utc)
+START = (NOW - timedelta(days=120)).replace(minute=0, second=0, microsecond=0)
+
+
+@pytest_asyncio.fixture(loop_scope="function")
+async def device(make_device):
+    """A device with 6 readings 120 days old, 2 at 60 days and 2 recent ones."""
+    offsets = [timedelta(minutes=15 * i) for i in range(6)]
+    offsets += [timedelta(days=60, minutes=i) for i in (0, 1)]
+    offsets += [NOW - START - timedelta(minutes=i) for i in (2, 1)]
+    return await make_device("Tiered Device", START, offsets)
+
+
+@pytest.fixture
+def store(tmp_path):
+    return ColdStore(tmp_path / "tier")
+
+
+async def _count(engine, model) -> int:
+    async with engine.connect() as conn:
+        result = await conn.execute(select(func.count()).select_from(model))
+        return result.scalar_one()
+
+
+async def test_tier_moves_old_rows_and_chunks(engine, device, store):
+    # The 120 day old readings end up in chunks first, as in production.
+    await compact(engine, NOW - timedelta(days=90))
+    assert await _count(engine, DeviceDataChunk) == 2
+
+    report = await tier(engine, store, NOW - timedelta(days=30), dry_run=True)
+    assert report == {"readings": 8, "files": 0}
+    assert not store.root.exists()
+
+    report = await tier(engine, store, NOW - timedelta(days=30), batch_size=1)
+    assert report["readings"] == 8
+    assert await _count(engine, DeviceData) == 2
+    assert await _count(engine, DeviceDataChunk) == 0
+    months = {p.name for p in (store.root / f"device_id={device.id}").iterdir()}
+    assert len(months) == 2
+
+    tiered = store.read(device.id, order="asc")
+    assert [r.data["seq"] for r in tiered] == list(range(8))
+    assert (await tier(engine, store, NOW - timedelta(days=30)))["readings"] == 0
+
+
+async def test_tier_deletes_in_bounded_id_lists(engine, device, store, monkeypatch):
+    """Batches larger than one IN list (asyncpg takes 32767 parameters) are split."""
+    monkeypatch.setattr(tiering, "_IDS_PER_STATEMENT", 2)
+    await compact(engine, NOW - timedelta(days=90))
+
+    report = await tier(engine, store, NOW - timedelta(days=30), batch_size=5)
+    assert report["readings"] == 8
+    assert await _count(engine, DeviceData) == 2
+    assert await _count(engine, DeviceDataChunk) == 0
+
+
+async def test_service_reads_tiered_readings(engine, device, store):
+    async with AsyncSession(engine, expire_on_commit=False) as session:
+        service = DataService(session=session, shards=ShardMap({}), cold=store)
+        before = await service.list(device.id, limit=50)
+        await compact(engine, NOW - timedelta(days=90))
+        await tier(engine, store, NOW - timedelta(days=100))
+        await tier(engine, store, NOW - timedelta(days=30))
+        session.expunge_all()
+
+        for order in ("desc", "asc"):
+            for skip, limit in ((0, 50), (1, 3), (5, 4)):
+                readings = await service.list(
+                    device.id, skip=skip, limit=limit, order=order
+                )
+                expected = before if order == "desc" else list(reversed(before))
+                expected = expected[skip:][:limit]
+                assert [r.id for r in readings] == [r.id for r in expected]
+
+        in_range = await service.list(
+            device.id,
+            start=START + timedelta(minutes=30),
+            end=START + timedelta(days=60, minutes=1),
+        )
+        assert [r.data["seq"] for r in in_range] == [6, 5, 4, 3, 2]
+
+        aggregate = await service.aggregate(device.id, "temperature")
+        assert (aggregate["count"], aggregate["min"], aggregate["max"]) == (10, 20, 29)
+
+
+async def test_service_drops_readings_stored_twice(engine, device, store):
+    async with AsyncSession(engine, expire_on_commit=False) as session:
+        service = DataService(session=session, shards=ShardMap({}), cold=store)
+        before = await service.list(device.id, limit=50)
+        # A tiering run that crashed after writing, before deleting.
+        store.write(device.id, before[-6:])
+
+        readings = await service.list(device.id, limit=50, order="asc")
+        assert [r.id for r in readings] == [r.id for r in reversed(before)]
+
+
+async def test_typed_aggregates_include_tiered_readings(engine, device, store):
+    async with AsyncSession(engine, expire_on_commit=False) as session:
+        session.add(
+            DeviceField(
+                device_id=device.id, key="temperature", count=10, last_type="number"
+            )
+        )
+        await session.commit()
+        service = DataService(session=session, shards=ShardMap({}), cold=store)
+        expected = await service.aggregate(device.id, "temperature")
+        assert expected["count"] == 10
+
+        # Promoted before tiering: the moved readings take their values along.
+        await service.promote_field(device.id, "temperature")
+        assert await service.backfill_field(device.id, "temperature") == 10
+        await compact(engine, NOW - timedelta(days=90))
+        await tier(engine, store, NOW - timedelta(days=100))
+        assert await _count(engine, DeviceDataValue) == 4
+        assert await service.aggregate(device.id, "temperature") == expected
+
+        # Promoted after tiering: only the readings left are backfilled.
+        await tier(engine, store, NOW - timedelta(days=30))
+        field = await service.promote_field(device.id, "temperature")
+        field.backfilled_at = None
+        await session.execute(delete(DeviceDataValue))
+        await session.commit()
+        assert await service.backfill_field(device.id, "temperature") == 2
+        assert await service.aggregate(device.id, "temperature") == expected
+
+
+def test_delete_device_removes_files(store):
+    reading = DeviceData(
+        device_id=uuid.uuid4(),
+        data={"v": 1},
+        created_date=START,
+        updated_date=START,
+    )
+    store.write(reading.device_id, [reading])
+    assert store.read(reading.device_id)
+    store.delete_device(reading.device_id)
+    assert store.read(reading.device_id) == []
+
+
+def test_delete_range_rewrites_files(store):
+    device_id = uuid.uuid4()
+    readings = [
+        DeviceData(
+            device_id=device_id,
+            data={"day": day},
+            created_date=START + timedelta(days=day),
+            updated_date=START,
+        )
+        for day in range(0, 60, 10)
+    ]
+    store.write(device_id, readings)
+    deleted = store.delete_range(
+        device_id, START + timedelta(days=5), START + timedelta(days=35)
+    )
+    assert deleted == 3
+    assert [r.data["day"] for r in store.read(device_id, order="asc")] == [0, 40, 50]
+    assert store.delete_range(device_id, None, None) == 3
+    assert store.read(device_id) == []
@@ -0,0 +1,102 @@
+import uuid
+from datetime import datetime, timedelta, timezone
+
+import pytest
+from pydantic import ValidationError
+
+from app.exceptions import InvalidDataError
+from app.schemas.device_schema import DeviceCreate, PayloadSchema
+from app.utils.validation import PayloadValidator, ValidatorCache
+
+FIELDS = {"schema": {"fields": {"temperature": "number", "unit": "string?"}}}
+JSON_SCHEMA = {
+    "schema": {
+        "json_schema": {
+            "type": "object",
+            "properties": {
+                "temperature": {"type": "number", "minimum": -50, "maximum": 150},
+                "mode": {"enum": ["eco", "boost"]},
+                "samples": {"type": "array", "items": {"type": "integer"}},
+                "error": {"type": ["string", "null"]},
+            },
+            "required": ["temperature"],
+            "additionalProperties": False,
+        }
+    }
+}
+
+
+def _validator(notes):
+    return PayloadValidator(PayloadSchema.model_validate(notes["schema"]))
+
+
+def _rejects(validator, data) -> bool:
+    try:
+        validator.validate(data)
+    except InvalidDataError:
+        return True
+    return False
+
+
+def test_fields_spec():
+    validator = _validator(FIELDS)
+    assert not _rejects(validator, {"temperature": 21})
+    assert not _rejects(validator, {"temperature": 21.5, "unit": "C", "other": [1]})
+    assert _rejects(validator, {"unit": "C"})
+    assert _rejects(validator, {"temperature": "21"})
+    assert _rejects(validator, {"temperature": True})
+    assert _rejects(validator, {"temperature": 21, "unit": 1})
+
+
+def test_json_schema_spec():
+    validator = _validator(JSON_SCHEMA)
+    assert not _rejects(
+        validator,
+        {"temperature": 20, "mode": "eco", "samples": [1, 2], "error": None},
+    )
+    assert _rejects(validator, {"temperature": 200})
+    assert _rejects(validator, {"temperature": 20, "mode": "turbo"})
+    assert _rejects(validator, {"temperature": 20, "samples": [1.5]})
+    assert _rejects(validator, {"temperature": 20, "extra": 1})
+
+
+def test_validate_many_reports_index():
+    validator = _validator(FIELDS)
+    rejected = validator.validate_many(
+        [{"temperature": 1}, {"temperature": "x"}, {}, {"temperature": 2}]
+    )
+    assert set(rejected) == {1, 2}
+    assert rejected[1].detail[0]["loc"] == ("temperature",)
+    assert validator.validate_many([{"temperature": 1}]) == {}
+
+
+def test_invalid_specs_are_rejected():
+    for schema in (
+        {"fields": {"temperature": "float"}},
+        {"fields": {}, "json_schema": {"type": "object"}},
+        {"json_schema": {"type": "array"}},
+        {"json_schema": {"type": "object", "pattern": "^a"}},
+    ):
+        with pytest.raises(ValidationError):
+            DeviceCreate(name="Device", notes={"schema": schema})
+
+
+def test_cache_compiles_once_per_revision():
+    cache = ValidatorCache(max_devices=1)
+    device_id = uuid.uuid4()
+    revision = datetime.now(timezone.utc)
+
+    validator = cache.get(device_id, revision, FIELDS)
+    assert cache.get(device_id, revision, FIELDS) is validator
+    assert (
+        cache.get(device_id, revision + timedelta(seconds=1), FIELDS) is not validator
+    )
+    assert cache.get(device_id, revision, {"location": "lab"}) is None
+
+    validator = cache.get(device_id, revision, FIELDS)
+    cache.invalidate(device_id)
+    assert cache.get(device_id, revision, FIELDS) is not validator
+
+    validator = cache.get(device_id, revision, FIELDS)
+    cache.get(uuid.uuid4(), revision, FIELDS)
+    assert cache.get(device_id, revision, FIELDS) is not validator
@@ -0,0 +1,68 @@
+import os
+import time
+from datetime import datetime, timedelta, timezone
+from uuid import uuid4
+
+from app.utils.config import settings
+from app.utils.window_cache import WindowCache, sealed
+
+
+def test_sealed(monkeypatch):
+    monkeypatch.setattr(settings, "CACHE_SEALED_AFTER", 3600.0)
+    now = datetime.now(timezone.utc)
+    assert sealed(now - timedelta(hours=2))
+    assert not sealed(now)
+    assert not sealed(None)
+    # Naive datetimes are taken as UTC.
+    assert sealed((now - timedelta(hours=2)).replace(tzinfo=None))
+
+
+def test_memory_is_bounded_lru():
+    cache = WindowCache(max_bytes=100)
+    device = uuid4()
+    cache.put("a", b"x" * 20, frozenset({device}))
+    cache.put("b", b"x" * 20, frozenset({device}))
+    assert cache.get("a") is not None
+    for key in "cdef":
+        cache.put(key, b"x" * 20, frozenset({device}))
+    # "b" was the least recently used.
+    assert cache.get("b") is None
+    assert cache.get("a") is not None
+    assert cache.stats()["bytes"] <= 100
+    assert cache.evictions == 1
+
+    # A response over a quarter of the budget is not kept.
+    cache.put("large", b"x" * 26, frozenset({device}))
+    assert cache.get("large") is None
+
+
+def test_invalidate_drops_entries_of_the_device():
+    cache = WindowCache(max_bytes=1000)
+    left, right = uuid4(), uuid4()
+    cache.put("left", b"1", frozenset({left}))
+    cache.put("both", b"2", frozenset({left, right}))
+    cache.put("right", b"3", frozenset({right}))
+    cache.invalidate(left)
+    assert cache.get("left") is None
+    assert cache.get("both") is None
+    assert cache.get("right") == b"3"
+    assert cache.stats()["bytes"] == 1
+
+
+def test_disk_round_trip_and_trim(tmp_path):
+    cache = WindowCache(max_bytes=0, directory=tmp_path, dir_max_bytes=10_000)
+    assert cache.load("0" * 64) is None
+    keys = [f"{n:064x}" for n in range(3)]
+    for n, key in enumerate(keys):
+        cache.store(key, b"x" * 100)
+        path = tmp_path / key[:2] / f"{key}.json"
+        os.utime(path, (time.time() - 100 + n, time.time() - 100 + n))
+    assert cache.load(keys[0]) == b"x" * 100
+    assert not list(tmp_path.glob("*/.*.tmp"))
+
+    # Loading marked the first file as used, so the second goes first.
+    cache.dir_max_bytes = 250
+    cache.trim_directory()
+    assert cache.load(keys[1]) is None
+    assert cache.load(keys[0]) is not None
+    assert cache.load(keys[2]) is not None